@@ -14,7 +14,7 @@ login_manager = LoginManager()
 socketio = SocketIO()
 
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
     
     app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'dev-secret-key')
@@ -26,10 +26,91 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
+    # Listings use cursor pagination; per_page is clamped to this and `count=estimate` stops counting here
+    app.config['PAGINATION_MAX_PER_PAGE'] = 100
+    app.config['PAGINATION_COUNT_CAP'] = 1000
+    # Resumable uploads: suggested chunk size for clients and how long idle sessions are kept
+    app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024
+    app.config['UPLOAD_SESSION_TTL_HOURS'] = 24
+    # Migrations in migrations/ are applied at startup; with several processes set DB_AUTO_UPGRADE=0
+    # and run `flask db upgrade` once before starting them
+    app.config['DB_AUTO_UPGRADE'] = os.environ.get('DB_AUTO_UPGRADE', '1') == '1'
+    # Background jobs: run them on a thread inside the web process unless a separate
+    # `flask jobs worker` is deployed (set JOBS_IN_PROCESS_WORKER=0 then)
+    app.config['JOBS_IN_PROCESS_WORKER'] = os.environ.get('JOBS_IN_PROCESS_WORKER', '1') == '1'
+    app.config['JOB_POLL_INTERVAL'] = 2
+    app.config['JOB_RETRY_BASE_SECONDS'] = 30
+    app.config['JOB_TIMEOUT_SECONDS'] = 15 * 60
+    # View/download counts are buffered and written in batches this often (seconds)
+    app.config['COUNTER_FLUSH_INTERVAL'] = int(os.environ.get('COUNTER_FLUSH_INTERVAL', '5'))
+    # Activity log events are queued and bulk-inserted by a background thread;
+    # ACTIVITY_LOG_ASYNC=0 writes each one synchronously instead
+    app.config['ACTIVITY_LOG_ASYNC'] = os.environ.get('ACTIVITY_LOG_ASYNC', '1') == '1'
+    app.config['ACTIVITY_LOG_BATCH_SIZE'] = 500
+    app.config['ACTIVITY_LOG_FLUSH_INTERVAL'] = 1.0
+    app.config['ACTIVITY_LOG_QUEUE_SIZE'] = 10000
+    app.config['ACTIVITY_LOG_PUT_TIMEOUT'] = 0.05
+    # Admin analytics read daily rollups refreshed this often (seconds); raw activity rows older
+    # than ACTIVITY_LOG_RETENTION_DAYS (0 = keep forever) are moved to ARCHIVE_DIR if set, otherwise deleted
+    app.config['ANALYTICS_ROLLUP_INTERVAL'] = 600
+    app.config['ACTIVITY_LOG_RETENTION_DAYS'] = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', '0'))
+    # Old chat messages and activity rows are moved, a month at a time, into compressed segment
+    # files under ARCHIVE_DIR (ACTIVITY_LOG_ARCHIVE_DIR is the older name); history pages still read them
+    app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR') or os.environ.get('ACTIVITY_LOG_ARCHIVE_DIR')
+    app.config['CHAT_ARCHIVE_AFTER_DAYS'] = int(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', '0'))
+    app.config['ARCHIVE_INTERVAL'] = 24 * 60 * 60
+    # PDF/EPUB text extraction for search runs in a pool of this many processes; text beyond
+    # TEXT_EXTRACT_MAX_CHARS per document is not indexed
+    app.config['TEXT_EXTRACT_PROCESSES'] = int(os.environ.get('TEXT_EXTRACT_PROCESSES', '2'))
+    app.config['TEXT_EXTRACT_MAX_CHARS'] = 2000000
+    app.config['TEXT_EXTRACT_TIMEOUT'] = 300
+    # Shared page data (dashboard blocks) is cached in Redis when REDIS_URL is set, otherwise
+    # in each process; entries are dropped when content changes and expire after the TTL
+    app.config['CACHE_DEFAULT_TTL'] = 60
+    app.config['CACHE_MAX_ENTRIES'] = 512
+    app.config['DASHBOARD_CACHE_TTL'] = int(os.environ.get('DASHBOARD_CACHE_TTL', '60'))
+    app.config['CATEGORY_CACHE_TTL'] = 300
+    # Logged-in users are loaded from the cache for up to this many seconds (0 = query every request)
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', '60'))
+    # Socket.IO connections reload their user's roles at least this often (seconds)
+    app.config['SOCKET_CONTEXT_TTL'] = 300
+    # Community timelines cached for the posts API: how long, and how many recent posts per community
+    app.config['FEED_CACHE_TTL'] = 300
+    app.config['FEED_TIMELINE_LENGTH'] = 500
+    # Chat messages get Snowflake ids, are journaled to CHAT_JOURNAL_DIR and inserted in batches by a
+    # background thread. Processes sharing CHAT_JOURNAL_DIR claim free worker ids (0-1023) by locking
+    # a journal each; processes on other hosts need their own CHAT_WORKER_ID. CHAT_WRITE_BEHIND=0
+    # inserts each message before it is broadcast
+    app.config['CHAT_WRITE_BEHIND'] = os.environ.get('CHAT_WRITE_BEHIND', '1') == '1'
+    app.config['CHAT_WORKER_ID'] = int(os.environ['CHAT_WORKER_ID']) if os.environ.get('CHAT_WORKER_ID') else None
+    app.config['CHAT_JOURNAL_DIR'] = os.environ.get('CHAT_JOURNAL_DIR') or os.path.join(app.root_path, 'chat-journal')
+    app.config['CHAT_JOURNAL_FSYNC'] = os.environ.get('CHAT_JOURNAL_FSYNC', '0') == '1'
+    app.config['CHAT_BATCH_SIZE'] = 200
+    app.config['CHAT_FLUSH_INTERVAL'] = 0.2
+    app.config['CHAT_QUEUE_SIZE'] = 10000
+    app.config['CHAT_PUT_TIMEOUT'] = 0.05
+    # Chat rooms open with this many recent messages from a ring buffer (shared in Redis when REDIS_URL is set)
+    app.config['CHAT_RECENT_LENGTH'] = int(os.environ.get('CHAT_RECENT_LENGTH', '100'))
+    # Typeahead suggestions come from an in-memory index; other worker processes' edits
+    # are picked up within this many seconds
+    app.config['SUGGEST_LIMIT'] = 8
+    app.config['SUGGEST_SYNC_INTERVAL'] = 30
     # Community photo constraints
     app.config['MAX_COMMUNITY_PHOTO_SIZE'] = 2 * 1024 * 1024  # 2 MB
     app.config['COMMUNITY_PHOTO_THUMB_SIZE'] = (300, 300)
+    app.config['MAX_PROFILE_PHOTO_SIZE'] = 10 * 1024 * 1024  # 10 MB, phone camera photos
+    # Widths (px) of the resized WebP/JPEG copies generated for profile and community photos
+    app.config['IMAGE_VARIANT_WIDTHS'] = (80, 160, 320, 640)
+    # Browser cache lifetime (seconds) for served content files; revalidated via ETag after that
+    app.config['CONTENT_FILE_MAX_AGE'] = int(os.environ.get('CONTENT_FILE_MAX_AGE', '0'))
+    # How file bytes leave the app: 'python' streams them from the worker, 'x-accel' (nginx)
+    # and 'x-sendfile' (lighttpd/Apache) hand the transfer to the fronting web server
+    app.config['FILE_DELIVERY_BACKEND'] = os.environ.get('FILE_DELIVERY_BACKEND', 'python')
+    app.config['FILE_DELIVERY_INTERNAL_PREFIX'] = os.environ.get('FILE_DELIVERY_INTERNAL_PREFIX', '/_protected/')
     app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+    # tests override settings (database, upload folder, TESTING) before anything uses them
+    if test_config:
+        app.config.update(test_config)
     
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
@@ -44,7 +125,7 @@ def create_app():
         os.makedirs(live_folder)
     
     db.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, directory=os.path.join(app.root_path, 'migrations'))
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
@@ -63,11 +144,11 @@ def create_app():
     else:
         socketio.init_app(app, cors_allowed_origins='*')
     
-    from models import User
+    from services import identity
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity.load_user(int(user_id))
     
     from routes.auth import auth_bp
     from routes.main import main_bp
@@ -98,9 +179,40 @@ def create_app():
     except Exception as e:
         print('Warning: failed to initialize community socket handlers:', e)
 
+    from services.blobstore import blobs_cli
+    from services.jobs import jobs_cli
+    from services.counters import counters_cli
+    from services.analytics import analytics_cli
+    from services.queryplans import queryplans_cli
+    from services.search import search_cli
+    from services.timelines import feed_cli
+    from services.chat import chat_cli
+    from services.archive import archive_cli
+    app.cli.add_command(blobs_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(counters_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(queryplans_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(feed_cli)
+    app.cli.add_command(chat_cli)
+    app.cli.add_command(archive_cli)
+
     with app.app_context():
+        from services import schema
+        if not schema.init_app(app):
+            return app
         db.create_all()
+        from services import search, suggest
+        search.init_app(app)
+        suggest.init_app(app)
         create_default_admin()
+        if not app.config.get('TESTING'):
+            # periodic jobs are queued at startup, each unless one is already pending
+            from services import analytics, archive, jobs
+            analytics.ensure_scheduled()
+            archive.ensure_scheduled()
+            jobs.init_app(app)
     
     return app
 
@@ -0,0 +1,43 @@
+"""add daily activity rollup tables
+
+Revision ID: 20261017_add_activity_rollups
+Revises: 20261017_add_photo_variants
+Create Date: 2026-10-17 00:40:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_activity_rollups'
+down_revision = '20261017_add_photo_variants'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_action_stat',
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column('action', sa.String(length=50), primary_key=True),
+        sa.Column('count', sa.Integer, nullable=False, server_default='0')
+    )
+    op.create_table(
+        'daily_content_stat',
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column('content_id', sa.Integer, sa.ForeignKey('content.id'), primary_key=True),
+        sa.Column('action', sa.String(length=50), primary_key=True),
+        sa.Column('count', sa.Integer, nullable=False, server_default='0')
+    )
+    op.create_table(
+        'daily_user_stat',
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('user.id'), primary_key=True),
+        sa.Column('action', sa.String(length=50), primary_key=True),
+        sa.Column('count', sa.Integer, nullable=False, server_default='0')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_user_stat')
+    op.drop_table('daily_content_stat')
+    op.drop_table('daily_action_stat')
@@ -0,0 +1,37 @@
+"""add archive_segment manifest for archived chat and activity rows
+
+Revision ID: 20261017_add_archive_segments
+Revises: 20261017_chat_message_bigint_id
+Create Date: 2026-10-17 06:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_archive_segments'
+down_revision = '20261017_chat_message_bigint_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'archive_segment',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('table_name', sa.String(length=50), nullable=False),
+        sa.Column('partition_key', sa.Integer, nullable=False),
+        sa.Column('month', sa.String(length=7), nullable=False),
+        sa.Column('path', sa.String(length=255), nullable=False),
+        sa.Column('row_count', sa.Integer, nullable=False),
+        sa.Column('first_at', sa.DateTime, nullable=False),
+        sa.Column('last_at', sa.DateTime, nullable=False),
+        sa.Column('first_id', sa.BigInteger, nullable=False),
+        sa.Column('last_id', sa.BigInteger, nullable=False),
+        sa.Column('created_at', sa.DateTime, nullable=True)
+    )
+    op.create_index('ix_archive_segment_partition', 'archive_segment', ['table_name', 'partition_key', 'last_at'])
+
+
+def downgrade():
+    op.drop_index('ix_archive_segment_partition', table_name='archive_segment')
+    op.drop_table('archive_segment')
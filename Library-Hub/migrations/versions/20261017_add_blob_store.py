@@ -0,0 +1,40 @@
+"""add blob table and blob references on content / live_session
+
+Revision ID: 20261017_add_blob_store
+Revises: 20261017_add_upload_session
+Create Date: 2026-10-17 00:10:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_blob_store'
+down_revision = '20261017_add_upload_session'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'blob',
+        sa.Column('sha256', sa.String(length=64), primary_key=True),
+        sa.Column('size', sa.BigInteger, nullable=False),
+        sa.Column('ref_count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime, nullable=True)
+    )
+    with op.batch_alter_table('content') as batch_op:
+        batch_op.add_column(sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_content_blob_sha256', 'blob', ['blob_sha256'], ['sha256'])
+    with op.batch_alter_table('live_session') as batch_op:
+        batch_op.add_column(sa.Column('recording_blob', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_live_session_recording_blob', 'blob', ['recording_blob'], ['sha256'])
+
+
+def downgrade():
+    with op.batch_alter_table('live_session') as batch_op:
+        batch_op.drop_constraint('fk_live_session_recording_blob', type_='foreignkey')
+        batch_op.drop_column('recording_blob')
+    with op.batch_alter_table('content') as batch_op:
+        batch_op.drop_constraint('fk_content_blob_sha256', type_='foreignkey')
+        batch_op.drop_column('blob_sha256')
+    op.drop_table('blob')
@@ -0,0 +1,24 @@
+"""add indexes for loading feed comments and paging community members
+
+Revision ID: 20261017_add_community_feed_indexes
+Revises: 20261017_add_content_tags_tag_index
+Create Date: 2026-10-17 02:10:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_community_feed_indexes'
+down_revision = '20261017_add_content_tags_tag_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_comment_post_created', 'comment', ['post_id', 'created_at'])
+    op.create_index('ix_membership_community_joined', 'membership', ['community_id', 'joined_at'])
+
+
+def downgrade():
+    op.drop_index('ix_membership_community_joined', table_name='membership')
+    op.drop_index('ix_comment_post_created', table_name='comment')
@@ -0,0 +1,48 @@
+"""add extracted document pages and their search index
+
+Revision ID: 20261017_add_content_pages
+Revises: 20261017_add_content_search
+Create Date: 2026-10-17 01:10:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_content_pages'
+down_revision = '20261017_add_content_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'content_page',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('content_id', sa.Integer, sa.ForeignKey('content.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('page_number', sa.Integer, nullable=False),
+        sa.Column('start_offset', sa.Integer, nullable=False),
+        sa.Column('text', sa.Text, nullable=False),
+        sa.UniqueConstraint('content_id', 'page_number', name='uq_content_page_number')
+    )
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS content_page_fts USING fts5("
+                   "body, tokenize='porter unicode61 remove_diacritics 2')")
+    elif dialect == 'postgresql':
+        op.create_table(
+            'content_page_search',
+            sa.Column('page_id', sa.Integer, sa.ForeignKey('content_page.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('document', sa.dialects.postgresql.TSVECTOR, nullable=False)
+        )
+        op.create_index('ix_content_page_search_document', 'content_page_search', ['document'],
+                        postgresql_using='gin')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS content_page_fts')
+    elif dialect == 'postgresql':
+        op.drop_index('ix_content_page_search_document', table_name='content_page_search')
+        op.drop_table('content_page_search')
+    op.drop_table('content_page')
@@ -0,0 +1,54 @@
+"""add full-text search index for content
+
+Revision ID: 20261017_add_content_search
+Revises: 20261017_add_hot_query_indexes
+Create Date: 2026-10-17 01:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_content_search'
+down_revision = '20261017_add_hot_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5("
+                   "title, author, description, tags, category, "
+                   "tokenize='porter unicode61 remove_diacritics 2')")
+        op.execute("INSERT INTO content_fts (rowid, title, author, description, tags, category) "
+                   "SELECT c.id, c.title, COALESCE(c.author, ''), COALESCE(c.description, ''), "
+                   "COALESCE((SELECT group_concat(t.name, ' ') FROM content_tags ct "
+                   "JOIN tag t ON t.id = ct.tag_id WHERE ct.content_id = c.id), ''), "
+                   "COALESCE((SELECT cat.name FROM category cat WHERE cat.id = c.category_id), '') "
+                   "FROM content c")
+    elif dialect == 'postgresql':
+        op.create_table(
+            'content_search',
+            sa.Column('content_id', sa.Integer, sa.ForeignKey('content.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('document', sa.dialects.postgresql.TSVECTOR, nullable=False)
+        )
+        op.create_index('ix_content_search_document', 'content_search', ['document'], postgresql_using='gin')
+        op.execute("INSERT INTO content_search (content_id, document) "
+                   "SELECT c.id, "
+                   "setweight(to_tsvector('english', COALESCE(c.title, '')), 'A') || "
+                   "setweight(to_tsvector('english', COALESCE(c.author, '')), 'B') || "
+                   "setweight(to_tsvector('english', COALESCE((SELECT string_agg(t.name, ' ') "
+                   "FROM content_tags ct JOIN tag t ON t.id = ct.tag_id WHERE ct.content_id = c.id), '')), 'B') || "
+                   "setweight(to_tsvector('english', COALESCE((SELECT cat.name FROM category cat "
+                   "WHERE cat.id = c.category_id), '')), 'C') || "
+                   "setweight(to_tsvector('english', COALESCE(c.description, '')), 'D') "
+                   "FROM content c")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS content_fts')
+    elif dialect == 'postgresql':
+        op.drop_index('ix_content_search_document', table_name='content_search')
+        op.drop_table('content_search')
@@ -0,0 +1,22 @@
+"""add reverse index on content_tags for browsing by tag
+
+Revision ID: 20261017_add_content_tags_tag_index
+Revises: 20261017_add_content_pages
+Create Date: 2026-10-17 01:20:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_content_tags_tag_index'
+down_revision = '20261017_add_content_pages'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_content_tags_tag_id', 'content_tags', ['tag_id', 'content_id'])
+
+
+def downgrade():
+    op.drop_index('ix_content_tags_tag_id', table_name='content_tags')
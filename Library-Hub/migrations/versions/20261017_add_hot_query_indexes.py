@@ -0,0 +1,49 @@
+"""add indexes for the hot listing and lookup queries
+
+Revision ID: 20261017_add_hot_query_indexes
+Revises: 20261017_add_activity_rollups
+Create Date: 2026-10-17 00:50:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_hot_query_indexes'
+down_revision = '20261017_add_activity_rollups'
+branch_labels = None
+depends_on = None
+
+
+def _partial(condition_sqlite, condition_postgresql):
+    return {'sqlite_where': sa.text(condition_sqlite), 'postgresql_where': sa.text(condition_postgresql)}
+
+
+PUBLIC = _partial('is_public = 1', 'is_public = true')
+NOT_DELETED = _partial('is_deleted = 0', 'is_deleted = false')
+GLOBAL = _partial('is_global = 1', 'is_global = true')
+
+INDEXES = [
+    ('ix_content_public_created', 'content', ['created_at'], PUBLIC),
+    ('ix_content_public_views', 'content', ['view_count'], PUBLIC),
+    ('ix_content_public_category', 'content', ['category_id', 'created_at'], PUBLIC),
+    ('ix_activity_log_user_timestamp', 'activity_log', ['user_id', 'timestamp'], {}),
+    ('ix_activity_log_action_timestamp', 'activity_log', ['action', 'timestamp'], {}),
+    ('ix_activity_log_timestamp', 'activity_log', ['timestamp'], {}),
+    ('ix_activity_log_content_id', 'activity_log', ['content_id'], {}),
+    ('ix_notification_recipient_created', 'notification', ['recipient_id', 'created_at'], {}),
+    ('ix_notification_global_created', 'notification', ['is_global', 'created_at'], GLOBAL),
+    ('ix_post_feed', 'post', ['community_id', 'is_pinned', 'created_at'], NOT_DELETED),
+    ('ix_post_author_community', 'post', ['author_id', 'community_id', 'created_at'], {}),
+    ('ix_chat_message_community_created', 'chat_message', ['community_id', 'created_at'], {}),
+    ('ix_live_session_started_at', 'live_session', ['started_at'], {}),
+]
+
+
+def upgrade():
+    for name, table, columns, kwargs in INDEXES:
+        op.create_index(name, table, columns, **kwargs)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
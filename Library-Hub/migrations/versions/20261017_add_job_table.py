@@ -0,0 +1,37 @@
+"""add job table for background processing
+
+Revision ID: 20261017_add_job_table
+Revises: 20261017_add_blob_store
+Create Date: 2026-10-17 00:20:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_job_table'
+down_revision = '20261017_add_blob_store'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('payload', sa.Text, nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer, nullable=False, server_default='3'),
+        sa.Column('last_error', sa.Text, nullable=True),
+        sa.Column('run_at', sa.DateTime, nullable=True),
+        sa.Column('created_at', sa.DateTime, nullable=True),
+        sa.Column('started_at', sa.DateTime, nullable=True),
+        sa.Column('finished_at', sa.DateTime, nullable=True)
+    )
+    op.create_index('ix_job_status_run_at', 'job', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_index('ix_job_status_run_at', table_name='job')
+    op.drop_table('job')
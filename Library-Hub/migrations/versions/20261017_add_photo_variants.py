@@ -0,0 +1,28 @@
+"""add photo variant columns to user and community
+
+Revision ID: 20261017_add_photo_variants
+Revises: 20261017_add_job_table
+Create Date: 2026-10-17 00:30:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_photo_variants'
+down_revision = '20261017_add_job_table'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('profile_photo_variants', sa.String(length=100), nullable=True))
+    with op.batch_alter_table('community') as batch_op:
+        batch_op.add_column(sa.Column('photo_variants', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('community') as batch_op:
+        batch_op.drop_column('photo_variants')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('profile_photo_variants')
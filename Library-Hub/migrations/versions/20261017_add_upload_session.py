@@ -0,0 +1,36 @@
+"""add upload_session table for resumable uploads
+
+Revision ID: 20261017_add_upload_session
+Revises: 20251228_add_live_fields
+Create Date: 2026-10-17 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_add_upload_session'
+down_revision = '20251228_add_live_fields'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'upload_session',
+        sa.Column('id', sa.String(length=32), primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('user.id'), nullable=False),
+        sa.Column('target', sa.String(length=20), nullable=False),
+        sa.Column('live_session_id', sa.Integer, sa.ForeignKey('live_session.id'), nullable=True),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('content_type', sa.String(length=20), nullable=True),
+        sa.Column('total_size', sa.Integer, nullable=False),
+        sa.Column('received_size', sa.Integer, nullable=True),
+        sa.Column('checksum', sa.String(length=64), nullable=True),
+        sa.Column('upload_metadata', sa.Text, nullable=True),
+        sa.Column('created_at', sa.DateTime, nullable=True),
+        sa.Column('updated_at', sa.DateTime, nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_table('upload_session')
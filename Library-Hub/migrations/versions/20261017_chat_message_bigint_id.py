@@ -0,0 +1,29 @@
+"""widen chat_message.id to 64 bits for Snowflake ids
+
+Revision ID: 20261017_chat_message_bigint_id
+Revises: 20261017_add_community_feed_indexes
+Create Date: 2026-10-17 04:30:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_chat_message_bigint_id'
+down_revision = '20261017_add_community_feed_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite integers are already 64-bit
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    op.alter_column('chat_message', 'id', existing_type=sa.Integer(), type_=sa.BigInteger(),
+                    existing_nullable=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    op.alter_column('chat_message', 'id', existing_type=sa.BigInteger(), type_=sa.Integer(),
+                    existing_nullable=False)
@@ -5,9 +5,44 @@ import bcrypt
 
 db = SQLAlchemy()
 
+# Sub-folder of UPLOAD_FOLDER that holds each content type's files
+CONTENT_TYPE_FOLDERS = {
+    'pdf': 'pdfs',
+    'ebook': 'ebooks',
+    'audio': 'audio',
+    'video': 'videos',
+    'live': 'live'
+}
+
+def image_variant_name(filename, width, fmt):
+    """Name (relative to the photo's folder) of a resized copy written by services/images.py."""
+    stem = filename.rsplit('.', 1)[0]
+    return f'variants/{stem}_w{width}.{fmt}'
+
+def photo_variant_path(folder, filename, variants, width=None, fmt='jpg'):
+    """Upload-relative path of the smallest variant at least `width` wide.
+
+    Falls back to the original photo until its variants have been generated.
+    """
+    if not filename:
+        return None
+    widths = sorted(int(w) for w in variants.split(',')) if variants else []
+    if not widths:
+        return f'{folder}/{filename}'
+    chosen = next((w for w in widths if width and w >= width), widths[-1])
+    return f'{folder}/{image_variant_name(filename, chosen, fmt)}'
+
+def photo_variant_srcset(folder, filename, variants, fmt='jpg'):
+    """[(upload-relative path, width), ...] for building an `srcset`."""
+    if not filename or not variants:
+        return []
+    return [(f'{folder}/{image_variant_name(filename, int(w), fmt)}', int(w)) for w in variants.split(',')]
+
 content_tags = db.Table('content_tags',
     db.Column('content_id', db.Integer, db.ForeignKey('content.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    # the primary key serves lookups by content; browsing by tag goes the other way
+    db.Index('ix_content_tags_tag_id', 'tag_id', 'content_id')
 )
 
 class User(UserMixin, db.Model):
@@ -18,6 +53,7 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), default='student')
     bio = db.Column(db.Text)
     profile_photo = db.Column(db.String(255))
+    profile_photo_variants = db.Column(db.String(100))  # comma separated widths, e.g. "80,160,320"
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     
@@ -31,6 +67,12 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
     
+    def profile_photo_path(self, width=None, fmt='jpg'):
+        return photo_variant_path('profiles', self.profile_photo, self.profile_photo_variants, width, fmt)
+    
+    def profile_photo_srcset(self, fmt='jpg'):
+        return photo_variant_srcset('profiles', self.profile_photo, self.profile_photo_variants, fmt)
+    
     def is_admin(self):
         return self.role == 'admin'
     
@@ -61,6 +103,17 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
 
+class Blob(db.Model):
+    """A stored file, addressed by the SHA-256 of its bytes.
+
+    `ref_count` is the number of `Content` rows and `LiveSession`
+    recordings pointing at it; the file is removed when it drops to zero.
+    """
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Content(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -69,6 +122,8 @@ class Content(db.Model):
     content_type = db.Column(db.String(20), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer)
+    # sha256 of the stored bytes when the file lives in the blob store (see services/blobstore.py)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'))
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     is_public = db.Column(db.Boolean, default=True)
@@ -81,6 +136,16 @@ class Content(db.Model):
                           backref=db.backref('contents', lazy='dynamic'))
     activities = db.relationship('ActivityLog', backref='content', lazy='dynamic')
     
+    # Browse/dashboard listings only ever show public content, so those indexes skip private rows
+    __table_args__ = (
+        db.Index('ix_content_public_created', 'created_at',
+                 sqlite_where=is_public == True, postgresql_where=is_public == True),
+        db.Index('ix_content_public_views', 'view_count',
+                 sqlite_where=is_public == True, postgresql_where=is_public == True),
+        db.Index('ix_content_public_category', 'category_id', 'created_at',
+                 sqlite_where=is_public == True, postgresql_where=is_public == True),
+    )
+    
     def get_type_icon(self):
         icons = {
             'pdf': 'fa-file-pdf',
@@ -90,6 +155,9 @@ class Content(db.Model):
         }
         return icons.get(self.content_type, 'fa-file')
     
+    def get_type_folder(self):
+        return CONTENT_TYPE_FOLDERS.get(self.content_type, 'pdfs')
+    
     def get_file_size_formatted(self):
         if not self.file_size:
             return 'Unknown'
@@ -109,6 +177,49 @@ class ActivityLog(db.Model):
     ip_address = db.Column(db.String(50))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_activity_log_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_activity_log_action_timestamp', 'action', 'timestamp'),
+        db.Index('ix_activity_log_timestamp', 'timestamp'),
+        db.Index('ix_activity_log_content_id', 'content_id'),
+    )
+
+class DailyActionStat(db.Model):
+    """ActivityLog counts per day and action, maintained by services/analytics.py."""
+    day = db.Column(db.Date, primary_key=True)
+    action = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+class DailyContentStat(db.Model):
+    """ActivityLog counts per day, content item and action."""
+    day = db.Column(db.Date, primary_key=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('content.id'), primary_key=True)
+    action = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+class ContentPage(db.Model):
+    """Text extracted from one page of a PDF (or one chapter of an EPUB).
+
+    `start_offset` is where the page starts in the document's full text, i.e.
+    the pages joined with newlines.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('content.id', ondelete='CASCADE'), nullable=False)
+    page_number = db.Column(db.Integer, nullable=False)
+    start_offset = db.Column(db.Integer, nullable=False)
+    text = db.Column(db.Text, nullable=False, default='')
+
+    __table_args__ = (
+        db.UniqueConstraint('content_id', 'page_number', name='uq_content_page_number'),
+    )
+
+class DailyUserStat(db.Model):
+    """ActivityLog counts per day, user and action."""
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    action = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -119,6 +230,13 @@ class Notification(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     sent_at = db.Column(db.DateTime)
 
+    __table_args__ = (
+        db.Index('ix_notification_recipient_created', 'recipient_id', 'created_at'),
+        # only global notifications are indexed; is_global leads so "recipient OR global" can use both indexes
+        db.Index('ix_notification_global_created', 'is_global', 'created_at',
+                 sqlite_where=is_global == True, postgresql_where=is_global == True),
+    )
+
 
 # Community system models
 class Community(db.Model):
@@ -129,12 +247,19 @@ class Community(db.Model):
     photo = db.Column(db.String(255))
     photo_thumbnail = db.Column(db.String(255))
     photo_thumbnail_2x = db.Column(db.String(255))
+    photo_variants = db.Column(db.String(100))
     is_private = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     memberships = db.relationship('Membership', backref='community', lazy='dynamic')
     posts = db.relationship('Post', backref='community', lazy='dynamic')
 
+    def photo_path(self, width=None, fmt='jpg'):
+        return photo_variant_path('communities', self.photo, self.photo_variants, width, fmt)
+
+    def photo_srcset(self, fmt='jpg'):
+        return photo_variant_srcset('communities', self.photo, self.photo_variants, fmt)
+
 class Membership(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -145,7 +270,11 @@ class Membership(db.Model):
     # relationship to the user who is a member
     user = db.relationship('User', backref='memberships')
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'community_id', name='_user_community_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'community_id', name='_user_community_uc'),
+        # community member lists, newest first
+        db.Index('ix_membership_community_joined', 'community_id', 'joined_at'),
+    )
 
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -161,6 +290,13 @@ class Post(db.Model):
     author = db.relationship('User', backref='posts')
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
+    # community feed: pinned first, newest first, deleted posts excluded
+    __table_args__ = (
+        db.Index('ix_post_feed', 'community_id', 'is_pinned', 'created_at',
+                 sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        db.Index('ix_post_author_community', 'author_id', 'community_id', 'created_at'),
+    )
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
@@ -170,8 +306,12 @@ class Comment(db.Model):
 
     author = db.relationship('User', backref='comments')
 
+    # comments of the posts on a feed page
+    __table_args__ = (db.Index('ix_comment_post_created', 'post_id', 'created_at'),)
+
 class ChatMessage(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    # Snowflake ids assigned by services.chat, which also orders messages by them
+    id = db.Column(db.BigInteger().with_variant(db.Integer(), 'sqlite'), primary_key=True, autoincrement=False)
     community_id = db.Column(db.Integer, db.ForeignKey('community.id'), nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
@@ -180,6 +320,8 @@ class ChatMessage(db.Model):
 
     author = db.relationship('User', backref='chat_messages')
 
+    __table_args__ = (db.Index('ix_chat_message_community_created', 'community_id', 'created_at'),)
+
 class DirectMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -206,6 +348,7 @@ class LiveSession(db.Model):
     ended_at = db.Column(db.DateTime)
     recording_path = db.Column(db.String(500))
     recording_size = db.Column(db.Integer)
+    recording_blob = db.Column(db.String(64), db.ForeignKey('blob.sha256'))
     description = db.Column(db.Text)
     stream_key = db.Column(db.String(255))
     thumbnail = db.Column(db.String(255))
@@ -215,6 +358,8 @@ class LiveSession(db.Model):
     host = db.relationship('User', backref='live_sessions')
     community = db.relationship('Community', backref='live_sessions')
 
+    __table_args__ = (db.Index('ix_live_session_started_at', 'started_at'),)
+
     # Tags for sessions are kept in a dedicated association table so they
     # don't conflict with Content tags which use `content_tags`.
     live_session_tags = db.Table('live_session_tags',
@@ -242,10 +387,16 @@ class LiveSession(db.Model):
             content_type='live',
             file_path=filename,
             file_size=self.recording_size,
+            blob_sha256=self.recording_blob,
             category_id=None,
             uploaded_by=uploader,
             is_public=make_public,
         )
+        # the content shares the session's stored recording rather than copying it
+        if self.recording_blob:
+            db.session.execute(db.update(Blob).where(Blob.sha256 == self.recording_blob)
+                               .values(ref_count=Blob.ref_count + 1)
+                               .execution_options(synchronize_session=False))
         # copy tags
         content.tags = list(self.tags)
         db.session.add(content)
@@ -254,3 +405,66 @@ class LiveSession(db.Model):
         db.session.commit()
         return content
 
+
+
+class UploadSession(db.Model):
+    """A resumable, chunked upload in progress.
+
+    Chunks are appended to a temp file under ``uploads/tmp``; on finalize
+    the file is checksummed and turned into a `Content` record or attached
+    to a `LiveSession` as its recording, depending on `target`.
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    target = db.Column(db.String(20), nullable=False)  # content, live
+    live_session_id = db.Column(db.Integer, db.ForeignKey('live_session.id'))
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(20))
+    total_size = db.Column(db.Integer, nullable=False)
+    received_size = db.Column(db.Integer, default=0)
+    checksum = db.Column(db.String(64))
+    upload_metadata = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = db.relationship('User')
+    live_session = db.relationship('LiveSession')
+
+
+class Job(db.Model):
+    """A unit of background work run by the job worker (see services/jobs.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    last_error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+
+class ArchiveSegment(db.Model):
+    """A compressed file of rows moved out of a table by services/archive.py.
+
+    `partition_key` is the community (chat) or user (activity) the rows
+    belong to; the time and id bounds let history pages find the segments
+    that can hold a range without opening them.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    partition_key = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    path = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    first_id = db.Column(db.BigInteger, nullable=False)
+    last_id = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_archive_segment_partition', 'table_name', 'partition_key', 'last_at'),)
@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from models import db, User, Content, Category, ActivityLog, Notification, LiveSession
+from models import db, User, Content, Category, ActivityLog, Notification, LiveSession, Job
+from services import analytics as rollups, categories as category_catalogue, jobs as job_queue
+from services.pagination import paginate_request
 from functools import wraps
 from sqlalchemy import desc, func
 from datetime import datetime, timedelta
@@ -32,14 +34,10 @@ def dashboard():
     recent_users = User.query.order_by(desc(User.created_at)).limit(10).all()
     
     top_content = Content.query.order_by(desc(Content.view_count)).limit(10).all()
-    top_downloaders = db.session.query(
-        User, func.count(ActivityLog.id).label('download_count')
-    ).join(ActivityLog).filter(
-        ActivityLog.action == 'download'
-    ).group_by(User.id).order_by(desc('download_count')).limit(10).all()
+    top_downloaders = rollups.top_users(action='download')
     
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    weekly_activity = ActivityLog.query.filter(ActivityLog.timestamp >= week_ago).count()
+    week_ago = datetime.utcnow().date() - timedelta(days=7)
+    weekly_activity = rollups.activity_total(week_ago)
     
     stats = {
         'total_users': total_users,
@@ -62,7 +60,6 @@ def dashboard():
 @login_required
 @admin_required
 def users():
-    page = request.args.get('page', 1, type=int)
     role_filter = request.args.get('role', '')
     search = request.args.get('search', '').strip()
     
@@ -77,7 +74,7 @@ def users():
             (User.email.ilike(f'%{search}%'))
         )
     
-    users = query.order_by(desc(User.created_at)).paginate(page=page, per_page=20, error_out=False)
+    users = paginate_request(query, User.created_at, User.id)
     
     return render_template('admin/users.html', users=users, role_filter=role_filter, search=search)
 
@@ -107,7 +104,6 @@ def edit_user(user_id):
 @login_required
 @admin_required
 def content():
-    page = request.args.get('page', 1, type=int)
     type_filter = request.args.get('type', '')
     search = request.args.get('search', '').strip()
     
@@ -122,7 +118,7 @@ def content():
             (Content.author.ilike(f'%{search}%'))
         )
     
-    contents = query.order_by(desc(Content.created_at)).paginate(page=page, per_page=20, error_out=False)
+    contents = paginate_request(query, Content.created_at, Content.id)
     
     return render_template('admin/content.html', contents=contents, type_filter=type_filter, search=search)
 
@@ -225,8 +221,7 @@ def categories():
                 db.session.commit()
                 flash('Category deleted successfully!', 'success')
     
-    categories = Category.query.all()
-    return render_template('admin/categories.html', categories=categories)
+    return render_template('admin/categories.html', categories=category_catalogue.catalogue())
 
 @admin_bp.route('/notifications', methods=['GET', 'POST'])
 @login_required
@@ -258,7 +253,6 @@ def notifications():
 @login_required
 @admin_required
 def activity():
-    page = request.args.get('page', 1, type=int)
     action_filter = request.args.get('action', '')
     
     query = ActivityLog.query
@@ -266,43 +260,54 @@ def activity():
     if action_filter:
         query = query.filter_by(action=action_filter)
     
-    activities = query.order_by(desc(ActivityLog.timestamp)).paginate(page=page, per_page=50, error_out=False)
+    activities = paginate_request(query, ActivityLog.timestamp, ActivityLog.id, default_per_page=50)
     
     actions = db.session.query(ActivityLog.action).distinct().all()
     action_types = [a[0] for a in actions]
     
     return render_template('admin/activity.html', activities=activities, action_filter=action_filter, action_types=action_types)
 
+@admin_bp.route('/jobs')
+@login_required
+@admin_required
+def jobs():
+    page = request.args.get('page', 1, type=int)
+    status_filter = request.args.get('status', '')
+    
+    query = Job.query
+    
+    if status_filter:
+        query = query.filter_by(status=status_filter)
+    
+    job_list = query.order_by(desc(Job.created_at)).paginate(page=page, per_page=50, error_out=False)
+    
+    return render_template('admin/jobs.html', jobs=job_list, status_filter=status_filter,
+                         status_counts=job_queue.status_counts())
+
+@admin_bp.route('/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def retry_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status == 'failed':
+        job_queue.retry(job)
+        db.session.commit()
+        flash('Job queued for retry.', 'success')
+    return redirect(url_for('admin.jobs', status=request.args.get('status', '')))
+
 @admin_bp.route('/analytics')
 @login_required
 @admin_required
 def analytics():
-    days_30 = datetime.utcnow() - timedelta(days=30)
-    
-    daily_views = db.session.query(
-        func.date(ActivityLog.timestamp),
-        func.count(ActivityLog.id)
-    ).filter(
-        ActivityLog.action == 'view',
-        ActivityLog.timestamp >= days_30
-    ).group_by(func.date(ActivityLog.timestamp)).all()
-    
-    daily_downloads = db.session.query(
-        func.date(ActivityLog.timestamp),
-        func.count(ActivityLog.id)
-    ).filter(
-        ActivityLog.action == 'download',
-        ActivityLog.timestamp >= days_30
-    ).group_by(func.date(ActivityLog.timestamp)).all()
+    days_30 = datetime.utcnow().date() - timedelta(days=30)
+    
+    daily_views = rollups.daily_action_counts('view', days_30)
+    daily_downloads = rollups.daily_action_counts('download', days_30)
     
     top_content = Content.query.order_by(desc(Content.view_count)).limit(10).all()
     top_downloaded = Content.query.order_by(desc(Content.download_count)).limit(10).all()
     
-    active_users = db.session.query(
-        User, func.count(ActivityLog.id).label('activity_count')
-    ).join(ActivityLog).filter(
-        ActivityLog.timestamp >= days_30
-    ).group_by(User.id).order_by(desc('activity_count')).limit(10).all()
+    active_users = rollups.top_users(since=days_30)
     
     content_by_category = db.session.query(
         Category.name, func.count(Content.id)
@@ -1,15 +1,46 @@
-from flask import Blueprint, jsonify, request
+import hashlib
+import math
+from flask import Blueprint, current_app, jsonify, request
 from flask_login import login_required, current_user
 from models import db, Content, Category, User, ActivityLog
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload, selectinload
+from services import archive, categories as category_catalogue, facets, search as search_index, suggest
+from services.pagination import InvalidCursor, paginate_request, per_page_arg
 
 api_bp = Blueprint('api', __name__)
 
+@api_bp.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+def _offset_pagination(query, page):
+    """Legacy ?page= pagination, kept for existing clients; prefer the after/before cursors."""
+    result = query.paginate(page=page, per_page=per_page_arg(), error_out=False)
+    return result.items, {
+        'page': result.page,
+        'pages': result.pages,
+        'total': result.total,
+        'has_next': result.has_next,
+        'has_prev': result.has_prev
+    }
+
+def _cursor_requested():
+    return bool(request.args.get('after') or request.args.get('before'))
+
+def _keyset_pagination(result):
+    """Cursor pagination fields; a first page requested without cursors also keeps the
+    ``page``/``pages``/``total`` fields responses had before cursors existed."""
+    pagination = result.to_dict()
+    if not _cursor_requested() and result.total is not None:
+        pagination['page'] = 1
+        pagination['pages'] = math.ceil(result.total / result.per_page)
+    return pagination
+
 @api_bp.route('/content')
 @login_required
 def get_content():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    page = request.args.get('page', type=int)
     content_type = request.args.get('type', '')
     category_id = request.args.get('category', type=int)
     search = request.args.get('q', '').strip()
@@ -22,15 +53,21 @@ def get_content():
     if category_id:
         query = query.filter_by(category_id=category_id)
     
-    if search:
-        query = query.filter(
-            (Content.title.ilike(f'%{search}%')) |
-            (Content.author.ilike(f'%{search}%'))
-        )
+    query = facets.filter_tags(query, facets.tag_args())
     
-    contents = query.order_by(desc(Content.created_at)).paginate(page=page, per_page=per_page, error_out=False)
-    
-    return jsonify({
+    if search:
+        query, _ = search_index.filter_query(query, search)
+    
+    # load each page's categories and tags up front rather than per row
+    listing = query.options(joinedload(Content.category), selectinload(Content.tags))
+    if page:
+        contents, pagination = _offset_pagination(listing.order_by(desc(Content.created_at), desc(Content.id)), page)
+    else:
+        result = paginate_request(listing, Content.created_at, Content.id,
+                                  default_count='none' if _cursor_requested() else 'exact')
+        contents, pagination = result.items, _keyset_pagination(result)
+    
+    response = {
         'success': True,
         'data': [{
             'id': c.id,
@@ -38,18 +75,23 @@ def get_content():
             'author': c.author,
             'type': c.content_type,
             'category': c.category.name if c.category else None,
+            'tags': [t.name for t in c.tags],
             'views': c.view_count,
             'downloads': c.download_count,
             'created_at': c.created_at.isoformat()
-        } for c in contents.items],
-        'pagination': {
-            'page': contents.page,
-            'pages': contents.pages,
-            'total': contents.total,
-            'has_next': contents.has_next,
-            'has_prev': contents.has_prev
+        } for c in contents],
+        'pagination': pagination
+    }
+    if request.args.get('facets') == '1':
+        counts = facets.counts(query)
+        response['facets'] = {
+            'total': counts['total'],
+            'type': counts['type'],
+            'category': {str(k): v for k, v in counts['category'].items() if k is not None},
+            'tag': [{'name': name, 'count': n} for name, n in counts['tag']]
         }
-    })
+    
+    return jsonify(response)
 
 @api_bp.route('/content/<int:content_id>')
 @login_required
@@ -81,15 +123,9 @@ def get_content_detail(content_id):
 @api_bp.route('/categories')
 @login_required
 def get_categories():
-    categories = Category.query.all()
     return jsonify({
         'success': True,
-        'data': [{
-            'id': c.id,
-            'name': c.name,
-            'description': c.description,
-            'content_count': c.contents.count()
-        } for c in categories]
+        'data': category_catalogue.catalogue()
     })
 
 @api_bp.route('/search')
@@ -100,13 +136,11 @@ def search():
     if len(query) < 2:
         return jsonify({'success': True, 'data': []})
     
-    search = f'%{query}%'
-    contents = Content.query.filter(
-        Content.is_public == True,
-        (Content.title.ilike(search)) |
-        (Content.author.ilike(search)) |
-        (Content.description.ilike(search))
-    ).limit(10).all()
+    matches, score = search_index.filter_query(Content.query.filter(Content.is_public == True), query)
+    if score is not None:
+        matches = matches.order_by(score.desc())
+    contents = matches.limit(10).all()
+    pages = search_index.matching_pages([c.id for c in contents], query)
     
     return jsonify({
         'success': True,
@@ -114,10 +148,37 @@ def search():
             'id': c.id,
             'title': c.title,
             'author': c.author,
-            'type': c.content_type
+            'type': c.content_type,
+            'page': pages.get(c.id)
         } for c in contents]
     })
 
+@api_bp.route('/suggest')
+@login_required
+def get_suggestions():
+    """Typeahead suggestions from the in-memory index.
+
+    Responses depend only on the normalised prefix and the index version, so
+    clients should send the normalised prefix (``q`` in the response) to share
+    cached entries, and revalidate with the ETag.
+    """
+    prefix, matches = suggest.suggest(request.args.get('q', ''), current_app.config.get('SUGGEST_LIMIT', 8))
+    # the prefix may not be Latin-1, which headers must be
+    etag = f"{suggest.index.version}-{hashlib.sha1(prefix.encode('utf-8')).hexdigest()}"
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify({
+            'success': True,
+            'q': prefix,
+            'data': [{'id': cid, 'title': title, 'author': author, 'type': content_type}
+                     for cid, title, author, content_type in matches]
+        })
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
+
 @api_bp.route('/stats')
 @login_required
 def get_stats():
@@ -144,12 +205,16 @@ def get_stats():
 @api_bp.route('/user/history')
 @login_required
 def get_user_history():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    page = request.args.get('page', type=int)
+    query = ActivityLog.query.filter_by(user_id=current_user.id)
     
-    activities = ActivityLog.query.filter_by(user_id=current_user.id).order_by(
-        desc(ActivityLog.timestamp)
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    if page:
+        activities, pagination = _offset_pagination(
+            query.order_by(desc(ActivityLog.timestamp), desc(ActivityLog.id)), page)
+    else:
+        result = archive.paginate_request('activity_log', query, current_user.id,
+                                          default_count='none' if _cursor_requested() else 'exact')
+        activities, pagination = result.items, _keyset_pagination(result)
     
     return jsonify({
         'success': True,
@@ -159,10 +224,6 @@ def get_user_history():
             'details': a.details,
             'content_id': a.content_id,
             'timestamp': a.timestamp.isoformat()
-        } for a in activities.items],
-        'pagination': {
-            'page': activities.page,
-            'pages': activities.pages,
-            'total': activities.total
-        }
+        } for a in activities],
+        'pagination': pagination
     })
@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 import os
 from models import db, User, ActivityLog, Community, Membership
 from email_validator import validate_email, EmailNotValidError
+from services import activity, images, jobs
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -29,14 +30,7 @@ def login():
             
             login_user(user, remember=remember)
             
-            log = ActivityLog(
-                user_id=user.id,
-                action='login',
-                details='User logged in',
-                ip_address=request.remote_addr
-            )
-            db.session.add(log)
-            db.session.commit()
+            activity.record(user.id, 'login', details='User logged in', ip_address=request.remote_addr)
             
             next_page = request.args.get('next')
             if next_page:
@@ -106,14 +100,9 @@ def register():
         db.session.add(membership)
         db.session.commit()
 
-        log = ActivityLog(
-            user_id=user.id,
-            action='register',
-            details=f'New user registration and joined community {community.name}',
-            ip_address=request.remote_addr
-        )
-        db.session.add(log)
-        db.session.commit()
+        activity.record(user.id, 'register',
+                        details=f'New user registration and joined community {community.name}',
+                        ip_address=request.remote_addr)
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -123,14 +112,7 @@ def register():
 @auth_bp.route('/logout')
 @login_required
 def logout():
-    log = ActivityLog(
-        user_id=current_user.id,
-        action='logout',
-        details='User logged out',
-        ip_address=request.remote_addr
-    )
-    db.session.add(log)
-    db.session.commit()
+    activity.record(current_user.id, 'logout', details='User logged out', ip_address=request.remote_addr)
     
     logout_user()
     flash('You have been logged out.', 'info')
@@ -149,20 +131,38 @@ def profile():
         
         current_user.name = name
         current_user.bio = bio
+        replaced_photo = None
         
         if 'profile_photo' in request.files:
             file = request.files['profile_photo']
             if file.filename:
-                import os
-                from flask import current_app
                 from werkzeug.utils import secure_filename
                 
-                filename = secure_filename(f"{current_user.id}_{file.filename}")
+                # a fresh name each time, so the photo being replaced is untouched until this one is saved
+                filename = secure_filename(f"{current_user.id}_{int(os.urandom(4).hex(), 16)}_{file.filename}")
+                if not images.allowed_image(filename):
+                    flash('Unsupported image format. Allowed: png, jpg, jpeg, gif, webp', 'error')
+                    return render_template('auth/profile.html')
                 filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], 'profiles', filename)
-                file.save(filepath)
+                max_size = current_app.config.get('MAX_PROFILE_PHOTO_SIZE', 10 * 1024 * 1024)
+                try:
+                    images.save_capped(file.stream, filepath, max_size)
+                except images.ImageTooLarge:
+                    flash(f'Photo is too large (max {max_size // (1024 * 1024)} MB).', 'error')
+                    return render_template('auth/profile.html')
+                replaced_photo = current_user.profile_photo
                 current_user.profile_photo = filename
+                # resized variants are built by the job worker; the original is shown until then
+                current_user.profile_photo_variants = None
+                jobs.enqueue('images.variants', kind='profile', object_id=current_user.id)
         
         db.session.commit()
+        if replaced_photo:
+            images.remove_variants('profiles', replaced_photo)
+            try:
+                os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], 'profiles', replaced_photo))
+            except OSError:
+                pass
         flash('Profile updated successfully!', 'success')
     
     activities = ActivityLog.query.filter_by(user_id=current_user.id).order_by(ActivityLog.timestamp.desc()).limit(20).all()
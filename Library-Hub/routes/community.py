@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, make_response
 from flask_login import login_required, current_user
-from models import db, Community, Membership, Post, Comment, ChatMessage, User, ActivityLog
+from models import db, Community, Membership, Post, Comment, ChatMessage, User
+from services import activity, archive, chatlog, images, jobs, sockets, timelines, chat as chat_messages, feed as post_feed
+from services.pagination import InvalidCursor, keyset_paginate, per_page_arg
+from sqlalchemy.orm import joinedload
 from functools import wraps
 from datetime import datetime, timedelta
 import time
@@ -21,6 +24,9 @@ community_bp = Blueprint('community', __name__)
 # In-memory mute map: { community_id: { user_id: until_timestamp } }
 _muted_users = {}
 
+# members listed per page in the feed's side panel
+MEMBERS_PER_PAGE = 50
+
 
 def _is_user_muted(community_id, user_id):
     """Check whether a user is muted in a community. Returns (muted: bool, until: datetime|None)."""
@@ -42,6 +48,25 @@ def _is_user_muted(community_id, user_id):
     return False, None
 
 
+def _muted_members(community_id, user_ids):
+    """{user_id: until} for the muted users among `user_ids`, in one Redis round-trip."""
+    r = getattr(current_app, 'redis', None)
+    if r and user_ids:
+        try:
+            pipe = r.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.ttl(f"mute:{community_id}:{user_id}")
+            now = datetime.utcnow()
+            return {user_id: now + timedelta(seconds=ttl)
+                    for user_id, ttl in zip(user_ids, pipe.execute()) if ttl and ttl > 0}
+        except Exception:
+            # fall back to in-memory
+            pass
+    now = datetime.utcnow()
+    mutes = _muted_users.get(community_id, {})
+    return {user_id: mutes[user_id] for user_id in user_ids if user_id in mutes and mutes[user_id] > now}
+
+
 def _set_user_mute(community_id, user_id, seconds):
     """Mute or unmute a user for a number of seconds. If seconds<=0 unmute."""
     r = getattr(current_app, 'redis', None)
@@ -69,6 +94,11 @@ def get_membership(user, community_id):
     return Membership.query.filter_by(user_id=user.id, community_id=community_id).first()
 
 
+def _wants_json():
+    """Whether the client asked for JSON (the feed script does) rather than a redirect."""
+    return request.accept_mimetypes.best == 'application/json'
+
+
 def community_member_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -78,6 +108,8 @@ def community_member_required(f):
             return redirect(url_for('main.dashboard'))
         membership = get_membership(current_user, community_id)
         if not membership:
+            if _wants_json():
+                return jsonify({'success': False, 'error': 'Not a member of this community'}), 403
             flash('You are not a member of this community.', 'error')
             return redirect(url_for('main.dashboard'))
         return f(*args, **kwargs)
@@ -92,6 +124,9 @@ def role_required(min_role):
         @wraps(f)
         def decorated(*args, **kwargs):
             community_id = kwargs.get('community_id') or request.view_args.get('community_id')
+            if not community_id and kwargs.get('post_id'):
+                # post actions (pin, delete) are checked against the post's community
+                community_id = Post.query.get_or_404(kwargs['post_id']).community_id
             membership = get_membership(current_user, community_id)
             if not membership or order.get(membership.role, 0) < order.get(min_role, 0):
                 flash('Permission denied.', 'error')
@@ -156,49 +191,26 @@ def create_community():
                     os.makedirs(dest_dir)
                 path = os.path.join(dest_dir, filename)
 
-                # read file into memory to check size and type safely
-                data = f.read()
-                if len(data) > current_app.config.get('MAX_COMMUNITY_PHOTO_SIZE', 2 * 1024 * 1024):
-                    flash('Photo is too large (max 2 MB).', 'error')
-                    return render_template('community/new.html')
-
                 # Basic mime/extension check
                 allowed_ext = ('png', 'jpg', 'jpeg', 'gif')
                 if not filename.lower().endswith(allowed_ext):
                     flash('Unsupported image format. Allowed: png, jpg, jpeg, gif', 'error')
                     return render_template('community/new.html')
 
-                # write to disk
-                with open(path, 'wb') as out:
-                    out.write(data)
-                photo = filename
-
-                # try to generate thumbnails (1x and 2x) and optimize if Pillow available
+                # stream to disk, rejecting oversized photos without buffering them in memory
                 try:
-                    from PIL import Image
-                    base_thumb_name = f"thumb_{filename}"
-                    thumb_path = os.path.join(dest_dir, base_thumb_name)
-                    img = Image.open(path)
-                    # generate 1x
-                    img1 = img.copy()
-                    img1.thumbnail(current_app.config.get('COMMUNITY_PHOTO_THUMB_SIZE', (300, 300)))
-                    img1.save(thumb_path, optimize=True, quality=85)
-                    # generate 2x
-                    img2 = img.copy()
-                    w, h = current_app.config.get('COMMUNITY_PHOTO_THUMB_SIZE', (300, 300))
-                    img2.thumbnail((w*2, h*2))
-                    base_thumb_name_2x = f"thumb2x_{filename}"
-                    thumb2x_path = os.path.join(dest_dir, base_thumb_name_2x)
-                    img2.save(thumb2x_path, optimize=True, quality=80)
-                    photo_thumb = base_thumb_name
-                    photo_thumb2 = base_thumb_name_2x
-                except Exception:
-                    # thumbnail generation failed; proceed without it
-                    photo_thumb = None
-                    photo_thumb2 = None
+                    images.save_capped(f.stream, path, current_app.config.get('MAX_COMMUNITY_PHOTO_SIZE', 2 * 1024 * 1024))
+                except images.ImageTooLarge:
+                    flash('Photo is too large (max 2 MB).', 'error')
+                    return render_template('community/new.html')
+                photo = filename
 
         community = Community(name=name, slug=slug, description=description, photo=photo, photo_thumbnail=photo_thumb, photo_thumbnail_2x=photo_thumb2, is_private=is_private)
         db.session.add(community)
+        db.session.flush()
+        # thumbnails and responsive variants are generated by the job worker
+        if photo:
+            jobs.enqueue('images.variants', kind='community', object_id=community.id)
         db.session.commit()
 
         # Ensure the creator is a member with admin privileges so they can access the feed
@@ -244,6 +256,8 @@ def delete_community(community_id):
         import os
         upload_base = current_app.config.get('UPLOAD_FOLDER')
         comm_dir = os.path.join(upload_base, 'communities') if upload_base else None
+        if community.photo and comm_dir:
+            images.remove_variants('communities', community.photo)
         for fn in (community.photo, community.photo_thumbnail, community.photo_thumbnail_2x):
             if fn and comm_dir:
                 try:
@@ -257,6 +271,9 @@ def delete_community(community_id):
         # Finally remove the community record
         db.session.delete(community)
         db.session.commit()
+        timelines.forget(community_id)
+        chatlog.forget(community_id)
+        archive.discard('chat_message', community_id)
         flash('Community deleted successfully.', 'success')
     except Exception:
         db.session.rollback()
@@ -269,19 +286,71 @@ def delete_community(community_id):
 @community_member_required
 def feed(community_id):
     community = Community.query.get_or_404(community_id)
-    # Recent posts, pinned first
-    posts = Post.query.filter_by(community_id=community.id, is_deleted=False).order_by(Post.is_pinned.desc(), Post.created_at.desc()).limit(50).all()
-    # preload comments and prepare simple member list (do not show private info)
-    for p in posts:
-        p.comments_list = p.comments.order_by(Comment.created_at.asc()).all()
-    members_q = Membership.query.filter_by(community_id=community.id).all()
+    # Pinned posts, then one page of the timeline (both from the timeline cache, with the last few
+    # comments of each post); the feed script loads older pages and full comment lists from posts_fragment
+    pinned, items, timeline = timelines.posts_page(community.id, after=request.args.get('after'))
+    posts = [post_feed.post_view(payload) for payload in pinned + items]
+    # one page of members (do not show private info), newest first, with their mute state
+    member_page = keyset_paginate(
+        Membership.query.filter_by(community_id=community.id).options(joinedload(Membership.user)),
+        Membership.joined_at, Membership.id, MEMBERS_PER_PAGE,
+        after=request.args.get('members_after'), before=request.args.get('members_before'), count='exact')
+    mutes = _muted_members(community.id, [m.user_id for m in member_page.items])
     members = []
-    for m in members_q:
-        muted, until = _is_user_muted(community.id, m.user_id)
+    for m in member_page.items:
+        until = mutes.get(m.user_id)
         members.append({'user_id': m.user_id, 'name': m.user.name, 'role': m.role, 'muted_until': until.isoformat() if until else None})
+    moderators = (Membership.query.filter(Membership.community_id == community.id, Membership.role.in_(['teacher', 'admin']))
+                  .options(joinedload(Membership.user)).order_by(Membership.id).all())
     current_membership = get_membership(current_user, community.id)
     current_role = current_membership.role if current_membership else 'student'
-    return render_template('community/feed.html', community=community, posts=posts, members=members, current_role=current_role)
+    return render_template('community/feed.html', community=community, posts=posts, timeline=timeline, members=members,
+                           member_page=member_page, member_count=member_page.total, moderators=moderators,
+                           current_role=current_role)
+
+
+@community_bp.route('/<int:community_id>/posts')
+@login_required
+@community_member_required
+def posts_json(community_id):
+    """Cursor-paginated timeline (``after``/``before``/``per_page``) with the last comments and a count per post.
+
+    The first page also lists the pinned posts.
+    """
+    try:
+        pinned, posts, page = timelines.posts_page(community_id, per_page_arg(post_feed.PAGE_SIZE),
+                                                   after=request.args.get('after'), before=request.args.get('before'))
+    except InvalidCursor:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    return jsonify({'success': True, 'pinned': pinned, 'data': posts, 'pagination': page.to_dict()})
+
+
+@community_bp.route('/<int:community_id>/posts/fragment')
+@login_required
+@community_member_required
+def posts_fragment(community_id):
+    """Rendered post cards, for patching the feed page in place.
+
+    ``since=<post id>`` returns the posts newer than it, ``ids=1,2`` re-renders
+    those posts (e.g. after a comment) and ``after=<cursor>`` returns the next
+    older page, with the following cursor in ``X-Next-Cursor``.
+    """
+    next_cursor = None
+    if request.args.get('after'):
+        timeline = post_feed.timeline(community_id, after=request.args.get('after'))
+        posts, next_cursor = timeline.items, timeline.next_cursor
+    elif request.args.get('since', type=int) is not None:
+        posts = post_feed.posts_since(community_id, request.args.get('since', type=int))
+    else:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+        posts = post_feed.posts_by_id(community_id, ids[:post_feed.PAGE_SIZE]) if ids else []
+    post_feed.attach_comments(posts)
+    current_membership = get_membership(current_user, community_id)
+    current_role = current_membership.role if current_membership else 'student'
+    response = make_response(render_template('community/_post_cards.html', posts=posts, current_role=current_role))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @community_bp.route('/<int:community_id>/post', methods=['POST'])
@@ -291,14 +360,18 @@ def create_post(community_id):
     title = request.form.get('title', '').strip()
     body = request.form.get('body', '').strip()
     if not body:
+        if _wants_json():
+            return jsonify({'success': False, 'error': 'Post body is required'}), 400
         flash('Post body is required.', 'error')
         return redirect(url_for('community.feed', community_id=community_id))
     post = Post(community_id=community_id, author_id=current_user.id, title=title, body=body)
     db.session.add(post)
     db.session.commit()
-    flash('Post created.', 'success')
     # notify via socket
     _emit_room('post_created', {'post_id': post.id, 'title': post.title, 'body': post.body}, room=f'community_{community_id}')
+    if _wants_json():
+        return jsonify({'success': True, 'post_id': post.id}), 201
+    flash('Post created.', 'success')
     return redirect(url_for('community.feed', community_id=community_id))
 
 
@@ -308,16 +381,22 @@ def add_comment(post_id):
     post = Post.query.get_or_404(post_id)
     membership = get_membership(current_user, post.community_id)
     if not membership:
+        if _wants_json():
+            return jsonify({'success': False, 'error': 'Not a member of this community'}), 403
         flash('You are not a member of this community.', 'error')
         return redirect(url_for('main.dashboard'))
     body = request.form.get('body', '').strip()
     if not body:
+        if _wants_json():
+            return jsonify({'success': False, 'error': 'Comment body is required'}), 400
         flash('Comment body is required.', 'error')
         return redirect(url_for('community.feed', community_id=post.community_id))
     c = Comment(post_id=post.id, author_id=current_user.id, body=body)
     db.session.add(c)
     db.session.commit()
     _emit_room('comment_added', {'post_id': post.id, 'comment_id': c.id, 'body': c.body, 'author': current_user.name}, room=f'community_{post.community_id}')
+    if _wants_json():
+        return jsonify({'success': True, 'post_id': post.id, 'comment_id': c.id}), 201
     flash('Comment added.', 'success')
     return redirect(url_for('community.feed', community_id=post.community_id))
 
@@ -351,8 +430,24 @@ def delete_post(post_id):
 @community_member_required
 def chat(community_id):
     community = Community.query.get_or_404(community_id)
-    recent = ChatMessage.query.filter_by(community_id=community.id).order_by(ChatMessage.created_at.desc()).limit(100).all()[::-1]
-    return render_template('community/chat.html', community=community, messages=recent)
+    recent = chatlog.recent(community.id)
+    history_cursor = chatlog.cursor(recent[0]) if chatlog.has_history(community.id, recent) else None
+    messages = [dict(m, created_at=datetime.fromisoformat(m['created_at'])) for m in recent]
+    return render_template('community/chat.html', community=community, messages=messages, history_cursor=history_cursor)
+
+
+@community_bp.route('/<int:community_id>/chat/history')
+@login_required
+@community_member_required
+def chat_history(community_id):
+    """Messages older than the ``before`` cursor (``per_page`` of them, oldest first) and the cursor to go further back."""
+    if not request.args.get('before'):
+        return jsonify({'success': False, 'error': 'Missing cursor'}), 400
+    try:
+        messages, before = chatlog.history(community_id, request.args['before'], per_page_arg(chatlog.HISTORY_PAGE_SIZE))
+    except InvalidCursor:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    return jsonify({'success': True, 'data': messages, 'before': before})
 
 
 @community_bp.route('/<int:community_id>/member/<int:user_id>')
@@ -371,58 +466,104 @@ def member_profile(community_id, user_id):
 
 
 # --- Socket events (registered at runtime via init_socketio) ---
+# Handlers read the signed-in user and their roles from the connection's
+# `sockets.SocketContext` instead of `current_user`; a chat message costs
+# no database reads, only the Redis generation and mute lookups.
+
+def _community_id(data):
+    try:
+        return int(data.get('community_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _socket_context():
+    """The current connection's context, or None (after telling the client) if it isn't signed in."""
+    ctx = sockets.get(request.sid)
+    if ctx is None:
+        emit('error', {'message': 'Not signed in'})
+        return None
+    # stop sending a room's messages to users who were removed from it
+    while ctx.left:
+        leave_room(f'community_{ctx.left.pop()}')
+    return ctx
+
+
+def _handle_connect(auth=None):
+    if current_user.is_authenticated:
+        sockets.connect(request.sid, current_user.id)
+
+
+def _handle_disconnect(*args):
+    sockets.disconnect(request.sid)
+
 
 def _handle_join(data):
-    community_id = data.get('community_id')
+    community_id = _community_id(data)
     if not community_id:
         return
-    membership = get_membership(current_user, community_id)
-    if not membership:
+    ctx = _socket_context()
+    if ctx is None:
+        return
+    if not ctx.role(community_id):
         emit('error', {'message': 'Not a member of this community'})
         return
+    ctx.rooms.add(community_id)
     room = f'community_{community_id}'
     join_room(room)
-    emit('user_joined', {'user': current_user.name}, room=room)
+    emit('user_joined', {'user': ctx.name}, room=room)
 
 
 def _handle_leave(data):
-    community_id = data.get('community_id')
+    community_id = _community_id(data)
+    ctx = _socket_context()
+    if ctx is None:
+        return
+    ctx.rooms.discard(community_id)
     room = f'community_{community_id}'
     leave_room(room)
-    emit('user_left', {'user': current_user.name}, room=room)
+    emit('user_left', {'user': ctx.name}, room=room)
 
 
 def _handle_message(data):
-    community_id = data.get('community_id')
+    community_id = _community_id(data)
     text = (data.get('message') or '').strip()
     if not community_id or not text:
         return
-    membership = get_membership(current_user, community_id)
-    if not membership:
+    ctx = _socket_context()
+    if ctx is None:
+        return
+    if not ctx.role(community_id):
         emit('error', {'message': 'Not a member'}, room=request.sid)
         return
-    # check muted
-    muted, until = _is_user_muted(community_id, current_user.id)
+    # checked per message: a mute set from another process must apply at once
+    muted, until = _is_user_muted(community_id, ctx.user_id)
     if muted:
-        emit('muted', {'until': until.isoformat() if until else None}, room=request.sid)
+        emit('muted', {'until': until.isoformat()}, room=request.sid)
         return
-    # persist
-    msg = ChatMessage(community_id=community_id, author_id=current_user.id, message=text)
-    db.session.add(msg)
-    db.session.commit()
-    room = f'community_{community_id}'
-    emit('message', {'id': msg.id, 'author': current_user.name, 'message': text, 'created_at': msg.created_at.isoformat()}, room=room)
+    # broadcast now; the message is journaled and inserted by the chat writer
+    payload = chat_messages.post(community_id, ctx.user_id, text)
+    payload['author'] = ctx.name
+    chatlog.push(payload)
+    emit('message', payload, room=f'community_{community_id}')
 
 
 def _handle_mute(data):
     # data: {community_id, target_user_id, seconds}
-    community_id = data.get('community_id')
+    community_id = _community_id(data)
     target = data.get('target_user_id')
     seconds = int(data.get('seconds') or 0)
-    membership = get_membership(current_user, community_id)
-    if not membership or membership.role not in ['teacher', 'admin']:
+    ctx = _socket_context()
+    if ctx is None:
+        return
+    if ctx.role(community_id) not in ['teacher', 'admin']:
         emit('error', {'message': 'Permission denied'})
         return
+    try:
+        target = int(target)
+    except (TypeError, ValueError):
+        emit('error', {'message': 'Unknown member'})
+        return
     until = datetime.utcnow() + timedelta(seconds=seconds) if seconds > 0 else None
     # use Redis if available
     _set_user_mute(community_id, target, seconds)
@@ -434,6 +575,8 @@ def _handle_mute(data):
 
 def init_socketio(sio):
     """Register Socket.IO handlers on the provided SocketIO server instance."""
+    sio.on_event('connect', _handle_connect)
+    sio.on_event('disconnect', _handle_disconnect)
     sio.on_event('join', _handle_join)
     sio.on_event('leave', _handle_leave)
     sio.on_event('message', _handle_message)
@@ -487,9 +630,7 @@ def mute_member(community_id, user_id):
         flash('Member unmuted.', 'success')
 
     # activity log
-    log = ActivityLog(user_id=current_user.id, action='mute' if seconds > 0 else 'unmute', details=details)
-    db.session.add(log)
-    db.session.commit()
+    activity.record(current_user.id, 'mute' if seconds > 0 else 'unmute', details=details)
 
     return redirect(url_for('community.member_profile', community_id=community_id, user_id=user_id))
 
@@ -1,8 +1,10 @@
 import os
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, current_app, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from models import db, Content, Category, Tag, ActivityLog
+from models import db, Content, Category, Tag, ActivityLog, DailyContentStat, UploadSession
+from services import activity, blobstore, categories as category_catalogue, counters, resumable, textextract
+from services.delivery import file_validators, is_not_modified, is_continuation_request, not_modified_response, send_content_file
 from functools import wraps
 
 content_bp = Blueprint('content', __name__)
@@ -30,6 +32,49 @@ def allowed_file(filename, content_type):
     ext = filename.rsplit('.', 1)[1].lower()
     return ext in ALLOWED_EXTENSIONS.get(content_type, [])
 
+def _upload_filename(original_filename):
+    """Logical filename recorded in `Content.file_path` (the bytes live in the blob store)."""
+    filename = secure_filename(original_filename)
+    return f"{current_user.id}_{int(os.urandom(4).hex(), 16)}_{filename}"
+
+def _create_content(title, author, description, content_type, file_path, blob, category_id, is_public, tags_str):
+    content = Content(
+        title=title,
+        author=author,
+        description=description,
+        content_type=content_type,
+        file_path=file_path,
+        file_size=blob.size,
+        blob_sha256=blob.sha256,
+        category_id=category_id if category_id else None,
+        uploaded_by=current_user.id,
+        is_public=is_public
+    )
+    
+    if tags_str:
+        tag_names = [t.strip().lower() for t in tags_str.split(',') if t.strip()]
+        for tag_name in tag_names:
+            tag = Tag.query.filter_by(name=tag_name).first()
+            if not tag:
+                tag = Tag(name=tag_name)
+                db.session.add(tag)
+            content.tags.append(tag)
+    
+    db.session.add(content)
+    db.session.flush()
+    
+    log = ActivityLog(
+        user_id=current_user.id,
+        content_id=content.id,
+        action='upload',
+        details=f'Uploaded: {title}',
+        ip_address=request.remote_addr
+    )
+    db.session.add(log)
+    textextract.queue_extraction(content)
+    db.session.commit()
+    return content
+
 @content_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 @upload_required
@@ -45,77 +90,111 @@ def upload():
         
         if not title or not content_type:
             flash('Title and content type are required.', 'error')
-            return render_template('content/upload.html', categories=Category.query.all())
+            return render_template('content/upload.html', categories=category_catalogue.catalogue())
         
         if 'file' not in request.files:
             flash('No file selected.', 'error')
-            return render_template('content/upload.html', categories=Category.query.all())
+            return render_template('content/upload.html', categories=category_catalogue.catalogue())
         
         file = request.files['file']
         if file.filename == '':
             flash('No file selected.', 'error')
-            return render_template('content/upload.html', categories=Category.query.all())
+            return render_template('content/upload.html', categories=category_catalogue.catalogue())
         
         if not allowed_file(file.filename, content_type):
             flash(f'Invalid file type for {content_type}.', 'error')
-            return render_template('content/upload.html', categories=Category.query.all())
-        
-        filename = secure_filename(file.filename)
-        unique_filename = f"{current_user.id}_{int(os.urandom(4).hex(), 16)}_{filename}"
-        
-        type_folder = {
-            'pdf': 'pdfs',
-            'ebook': 'ebooks',
-            'audio': 'audio',
-            'video': 'videos',
-            'live': 'live'
-        }.get(content_type, 'pdfs')
+            return render_template('content/upload.html', categories=category_catalogue.catalogue())
         
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], type_folder, unique_filename)
-        file.save(filepath)
-        
-        file_size = os.path.getsize(filepath)
-        
-        content = Content(
-            title=title,
-            author=author,
-            description=description,
-            content_type=content_type,
-            file_path=unique_filename,
-            file_size=file_size,
-            category_id=category_id if category_id else None,
-            uploaded_by=current_user.id,
-            is_public=is_public
-        )
-        
-        if tags_str:
-            tag_names = [t.strip().lower() for t in tags_str.split(',') if t.strip()]
-            for tag_name in tag_names:
-                tag = Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    tag = Tag(name=tag_name)
-                    db.session.add(tag)
-                content.tags.append(tag)
-        
-        db.session.add(content)
-        db.session.flush()
-        
-        log = ActivityLog(
-            user_id=current_user.id,
-            content_id=content.id,
-            action='upload',
-            details=f'Uploaded: {title}',
-            ip_address=request.remote_addr
-        )
-        db.session.add(log)
-        db.session.commit()
+        blob = blobstore.store_stream(file.stream)
+        content = _create_content(title, author, description, content_type, _upload_filename(file.filename),
+                                  blob, category_id, is_public, tags_str)
         
         flash('Content uploaded successfully!', 'success')
         return redirect(url_for('content.view', content_id=content.id))
     
-    categories = Category.query.all()
+    categories = category_catalogue.catalogue()
     return render_template('content/upload.html', categories=categories)
 
+@content_bp.route('/upload/sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    """Start a resumable upload; the Content record is created on finalize."""
+    if not current_user.can_upload():
+        return jsonify({'error': 'forbidden'}), 403
+    payload = request.get_json() or {}
+    title = (payload.get('title') or '').strip()
+    content_type = payload.get('content_type', '')
+    filename = payload.get('filename') or ''
+    size = payload.get('size')
+    if not title or not content_type:
+        return jsonify({'error': 'title-and-type-required'}), 400
+    if not allowed_file(filename, content_type):
+        return jsonify({'error': 'invalid-file-type'}), 400
+    if not isinstance(size, int):
+        return jsonify({'error': 'size-required'}), 400
+    metadata = {
+        'title': title,
+        'author': (payload.get('author') or '').strip(),
+        'description': (payload.get('description') or '').strip(),
+        'category_id': int(payload['category_id']) if str(payload.get('category_id') or '').isdigit() else None,
+        'is_public': bool(payload.get('is_public', True)),
+        'tags': (payload.get('tags') or '').strip(),
+    }
+    try:
+        session = resumable.create_session(current_user.id, 'content', filename, size,
+                                           checksum=payload.get('sha256'), content_type=content_type,
+                                           metadata=metadata)
+    except resumable.UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    return jsonify(resumable.session_status(session)), 201
+
+def _get_upload_session(upload_id):
+    session = UploadSession.query.get_or_404(upload_id)
+    if session.user_id != current_user.id:
+        abort(404)
+    return session
+
+@content_bp.route('/upload/sessions/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_session(upload_id):
+    """Query progress (GET), append a chunk (PUT) or abandon (DELETE) a resumable upload.
+
+    Shared by content uploads and live recording uploads.
+    """
+    session = _get_upload_session(upload_id)
+    if request.method == 'DELETE':
+        resumable.abort_session(session)
+        return jsonify({'status': 'aborted'})
+    if request.method == 'GET':
+        resumable.sync_offset(session)
+        return jsonify(resumable.session_status(session))
+    try:
+        offset = resumable.requested_offset(request.headers, request.args)
+        resumable.write_chunk(session, offset, request.stream)
+    except resumable.UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    return jsonify(resumable.session_status(session))
+
+@content_bp.route('/upload/sessions/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload_session(upload_id):
+    session = _get_upload_session(upload_id)
+    if session.target != 'content':
+        return jsonify({'error': 'wrong-target'}), 400
+    payload = request.get_json(silent=True) or {}
+    try:
+        digest = resumable.finalize(session, checksum=payload.get('sha256'))
+    except resumable.UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    meta = resumable.load_metadata(session)
+    filename = _upload_filename(session.filename)
+    content_type = session.content_type
+    blob = resumable.store_as_blob(session, digest)
+    content = _create_content(meta.get('title'), meta.get('author'), meta.get('description'), content_type,
+                              filename, blob, meta.get('category_id'), meta.get('is_public', True),
+                              meta.get('tags', ''))
+    return jsonify({'content_id': content.id, 'url': url_for('content.view', content_id=content.id)}), 201
+
 @content_bp.route('/view/<int:content_id>')
 @login_required
 def view(content_id):
@@ -125,17 +204,10 @@ def view(content_id):
         flash('You do not have permission to view this content.', 'error')
         return redirect(url_for('main.browse'))
     
-    content.view_count += 1
+    counters.increment('view', content.id)
     
-    log = ActivityLog(
-        user_id=current_user.id,
-        content_id=content.id,
-        action='view',
-        details=f'Viewed: {content.title}',
-        ip_address=request.remote_addr
-    )
-    db.session.add(log)
-    db.session.commit()
+    activity.record(current_user.id, 'view', details=f'Viewed: {content.title}', content_id=content.id,
+                    ip_address=request.remote_addr)
     
     related = Content.query.filter(
         Content.id != content.id,
@@ -143,7 +215,10 @@ def view(content_id):
         Content.category_id == content.category_id
     ).limit(4).all() if content.category_id else []
     
-    return render_template('content/view.html', content=content, related=related)
+    # set when arriving from a search hit inside the document text
+    page = request.args.get('page', type=int)
+    
+    return render_template('content/view.html', content=content, related=related, page=page)
 
 @content_bp.route('/download/<int:content_id>')
 @login_required
@@ -154,33 +229,26 @@ def download(content_id):
         flash('You do not have permission to download this content.', 'error')
         return redirect(url_for('content.view', content_id=content_id))
     
-    type_folder = {
-        'pdf': 'pdfs',
-        'ebook': 'ebooks',
-        'audio': 'audio',
-        'video': 'videos',
-        'live': 'live'
-    }.get(content.content_type, 'pdfs')
-    
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], type_folder, content.file_path)
+    filepath = blobstore.content_path(content)
     
-    if not os.path.exists(filepath):
+    try:
+        validators = file_validators(filepath, tag=content.id, digest=content.blob_sha256)
+    except OSError:
         flash('File not found.', 'error')
         return redirect(url_for('content.view', content_id=content_id))
     
-    content.download_count += 1
+    # Revalidations and resumed/seeking range requests are not new downloads
+    if is_not_modified(validators):
+        return not_modified_response(validators)
+    if is_continuation_request():
+        return send_content_file(validators, as_attachment=True, download_name=content.file_path.split('_', 2)[-1])
     
-    log = ActivityLog(
-        user_id=current_user.id,
-        content_id=content.id,
-        action='download',
-        details=f'Downloaded: {content.title}',
-        ip_address=request.remote_addr
-    )
-    db.session.add(log)
-    db.session.commit()
+    counters.increment('download', content.id)
     
-    return send_file(filepath, as_attachment=True, download_name=content.file_path.split('_', 2)[-1])
+    activity.record(current_user.id, 'download', details=f'Downloaded: {content.title}', content_id=content.id,
+                    ip_address=request.remote_addr)
+    
+    return send_content_file(validators, as_attachment=True, download_name=content.file_path.split('_', 2)[-1])
 
 @content_bp.route('/edit/<int:content_id>', methods=['GET', 'POST'])
 @login_required
@@ -214,7 +282,7 @@ def edit(content_id):
         flash('Content updated successfully!', 'success')
         return redirect(url_for('content.view', content_id=content_id))
     
-    categories = Category.query.all()
+    categories = category_catalogue.catalogue()
     current_tags = ', '.join([tag.name for tag in content.tags])
     return render_template('content/edit.html', content=content, categories=categories, current_tags=current_tags)
 
@@ -228,19 +296,15 @@ def delete(content_id):
         flash('You do not have permission to delete this content.', 'error')
         return redirect(url_for('content.view', content_id=content_id))
     
-    type_folder = {
-        'pdf': 'pdfs',
-        'ebook': 'ebooks',
-        'audio': 'audio',
-        'video': 'videos',
-        'live': 'live'
-    }.get(content.content_type, 'pdfs')
-    
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], type_folder, content.file_path)
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    if content.blob_sha256:
+        blobstore.release(content.blob_sha256)
+    else:
+        filepath = blobstore.content_path(content)
+        if os.path.exists(filepath):
+            os.remove(filepath)
     
     ActivityLog.query.filter_by(content_id=content.id).delete()
+    DailyContentStat.query.filter_by(content_id=content.id).delete()
     
     db.session.delete(content)
     db.session.commit()
@@ -256,17 +320,13 @@ def serve_file(content_id):
     if not content.is_public and not current_user.can_upload():
         abort(403)
     
-    type_folder = {
-        'pdf': 'pdfs',
-        'ebook': 'ebooks',
-        'audio': 'audio',
-        'video': 'videos',
-        'live': 'live'
-    }.get(content.content_type, 'pdfs')
-    
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], type_folder, content.file_path)
+    filepath = blobstore.content_path(content)
     
-    if not os.path.exists(filepath):
+    try:
+        validators = file_validators(filepath, tag=content.id, digest=content.blob_sha256)
+    except OSError:
         abort(404)
     
-    return send_file(filepath)
+    if is_not_modified(validators):
+        return not_modified_response(validators)
+    return send_content_file(validators, download_name=content.file_path.split('_', 2)[-1])
@@ -1,8 +1,8 @@
-from flask import Blueprint, request, jsonify, current_app, abort
+from flask import Blueprint, request, jsonify, abort
 from flask_login import login_required, current_user
-from models import db, LiveSession, User, Content
+from models import db, LiveSession, User, Content, UploadSession
+from services import blobstore, resumable
 from datetime import datetime
-import os
 from werkzeug.utils import secure_filename
 # import socketio lazily inside functions to avoid circular import with app
 
@@ -89,14 +89,25 @@ def upload_recording(session_id):
     if 'recording' not in request.files:
         return jsonify({'error': 'no-file'}), 400
     f = request.files['recording']
-    filename = secure_filename(f.filename)
-    live_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'live')
-    dest_name = f"{session_id}_{int(datetime.utcnow().timestamp())}_{filename}"
-    dest = os.path.join(live_dir, dest_name)
-    f.save(dest)
-    # store filename only (content routes expect file_path to be filename in the live folder)
+    blob = blobstore.store_stream(f.stream)
+    _attach_recording(session, _recording_filename(session_id, f.filename), blob)
+    return jsonify({'status': 'ok', 'path': session.recording_path})
+
+
+def _recording_filename(session_id, original_filename):
+    """Logical recording filename; the bytes live in the blob store."""
+    filename = secure_filename(original_filename)
+    return f"{session_id}_{int(datetime.utcnow().timestamp())}_{filename}"
+
+
+def _attach_recording(session, dest_name, blob):
+    # a re-uploaded recording replaces the previous one
+    if session.recording_blob:
+        blobstore.release(session.recording_blob)
+    # store filename only (saved Content rows reuse it as their file_path / download name)
     session.recording_path = dest_name
-    session.recording_size = os.path.getsize(dest) if os.path.exists(dest) else None
+    session.recording_size = blob.size
+    session.recording_blob = blob.sha256
     db.session.add(session)
     db.session.commit()
     try:
@@ -104,6 +115,47 @@ def upload_recording(session_id):
         socketio.emit('live:recording_uploaded', {'id': session.id, 'path': session.recording_path}, broadcast=True)
     except Exception:
         pass
+
+
+@live_bp.route('/upload/<int:session_id>/sessions', methods=['POST'])
+@login_required
+def create_recording_upload(session_id):
+    """Start a resumable recording upload.
+
+    Chunks go to /content/upload/sessions/<upload_id> like content uploads;
+    finish with /live/upload/sessions/<upload_id>/finalize.
+    """
+    _require_teacher()
+    LiveSession.query.get_or_404(session_id)
+    payload = request.get_json() or {}
+    filename = payload.get('filename') or ''
+    size = payload.get('size')
+    if not filename or not isinstance(size, int):
+        return jsonify({'error': 'filename-and-size-required'}), 400
+    try:
+        upload = resumable.create_session(current_user.id, 'live', filename, size,
+                                          checksum=payload.get('sha256'), live_session_id=session_id)
+    except resumable.UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    return jsonify(resumable.session_status(upload)), 201
+
+
+@live_bp.route('/upload/sessions/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_recording_upload(upload_id):
+    _require_teacher()
+    upload = UploadSession.query.get_or_404(upload_id)
+    if upload.user_id != current_user.id or upload.target != 'live':
+        abort(404)
+    payload = request.get_json(silent=True) or {}
+    try:
+        digest = resumable.finalize(upload, checksum=payload.get('sha256'))
+    except resumable.UploadError as e:
+        return jsonify(e.to_dict()), e.status
+    session = LiveSession.query.get_or_404(upload.live_session_id)
+    dest_name = _recording_filename(session.id, upload.filename)
+    blob = resumable.store_as_blob(upload, digest)
+    _attach_recording(session, dest_name, blob)
     return jsonify({'status': 'ok', 'path': session.recording_path})
 
 
@@ -2,6 +2,9 @@ from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user
 from models import db, Content, Category, Notification, ActivityLog
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
+from services import activity, archive, categories as category_catalogue, dashboard as dashboard_blocks, facets, search
+from services.pagination import paginate_request
 import os
 import time
 import json
@@ -13,44 +16,29 @@ main_bp = Blueprint('main', __name__)
 @main_bp.route('/')
 def index():
     if current_user.is_authenticated:
-        return render_template('dashboard.html')
+        return dashboard()
     return render_template('index.html')
 
 @main_bp.route('/dashboard')
 @login_required
 def dashboard():
-    recent_content = Content.query.filter_by(is_public=True).order_by(desc(Content.created_at)).limit(8).all()
-    popular_content = Content.query.filter_by(is_public=True).order_by(desc(Content.view_count)).limit(8).all()
-    categories = Category.query.all()
-    
+    # everything but the notifications is shared by all users and cached
     notifications = Notification.query.filter(
         (Notification.recipient_id == current_user.id) | (Notification.is_global == True)
     ).filter_by(is_read=False).order_by(desc(Notification.created_at)).limit(5).all()
     
-    stats = {
-        'total_content': Content.query.count(),
-        'total_pdfs': Content.query.filter_by(content_type='pdf').count(),
-        'total_videos': Content.query.filter_by(content_type='video').count(),
-        'total_audio': Content.query.filter_by(content_type='audio').count(),
-    }
-    
     return render_template('dashboard.html', 
-                         recent_content=recent_content,
-                         popular_content=popular_content,
-                         categories=categories,
                          notifications=notifications,
-                         stats=stats)
+                         **dashboard_blocks.blocks())
 
 @main_bp.route('/browse')
 @login_required
 def browse():
-    page = request.args.get('page', 1, type=int)
-    per_page = 12
-    
     content_type = request.args.get('type', '')
     category_id = request.args.get('category', '', type=str)
-    sort_by = request.args.get('sort', 'recent')
     search_query = request.args.get('q', '').strip()
+    tags = facets.tag_args()
+    sort_by = request.args.get('sort', 'relevance' if search_query else 'recent')
     
     query = Content.query.filter_by(is_public=True)
     
@@ -60,29 +48,32 @@ def browse():
     if category_id and category_id.isdigit():
         query = query.filter_by(category_id=int(category_id))
     
-    if search_query:
-        search = f"%{search_query}%"
-        query = query.filter(
-            (Content.title.ilike(search)) |
-            (Content.author.ilike(search)) |
-            (Content.description.ilike(search))
-        )
+    query = facets.filter_tags(query, tags)
+    
+    sort_columns = {'popular': Content.view_count, 'downloads': Content.download_count}
+    sort_column = sort_columns.get(sort_by, Content.created_at)
     
-    if sort_by == 'popular':
-        query = query.order_by(desc(Content.view_count))
-    elif sort_by == 'downloads':
-        query = query.order_by(desc(Content.download_count))
-    else:
-        query = query.order_by(desc(Content.created_at))
+    if search_query:
+        query, score = search.filter_query(query, search_query)
+        if sort_by == 'relevance' and score is not None:
+            sort_column = score
     
-    contents = query.paginate(page=page, per_page=per_page, error_out=False)
-    categories = Category.query.all()
+    # cards show the category name
+    contents = paginate_request(query.options(joinedload(Content.category)), sort_column, Content.id,
+                                default_per_page=12)
+    facet_counts = facets.counts(query)
+    categories = category_catalogue.catalogue()
+    # deep-link hits inside PDF/EPUB text to the page they were found on
+    match_pages = search.matching_pages([c.id for c in contents.items], search_query) if search_query else {}
     
     return render_template('browse.html', 
                          contents=contents,
+                         match_pages=match_pages,
+                         facets=facet_counts,
                          categories=categories,
                          current_type=content_type,
                          current_category=category_id,
+                         current_tags=tags,
                          current_sort=sort_by,
                          search_query=search_query)
 
@@ -103,10 +94,8 @@ def notifications():
 @main_bp.route('/history')
 @login_required
 def history():
-    page = request.args.get('page', 1, type=int)
-    activities = ActivityLog.query.filter_by(user_id=current_user.id).order_by(
-        desc(ActivityLog.timestamp)
-    ).paginate(page=page, per_page=20, error_out=False)
+    activities = archive.paginate_request('activity_log', ActivityLog.query.filter_by(user_id=current_user.id),
+                                          current_user.id)
     
     return render_template('history.html', activities=activities)
 
@@ -115,7 +104,7 @@ def history():
 @login_required
 def categories():
     """Public-facing categories list. Users can click a category to browse items in it."""
-    categories = Category.query.all()
+    categories = category_catalogue.catalogue()
     return render_template('categories.html', categories=categories)
 
 
@@ -236,14 +225,10 @@ def chat_message():
         reply = _call_openai_chat(message)
     except Exception as e:
         # record failure in activity log for debugging
-        log = ActivityLog(user_id=current_user.id, action='chat_error', details=str(e))
-        db.session.add(log)
-        db.session.commit()
+        activity.record(current_user.id, 'chat_error', details=str(e))
         return {'success': False, 'error': 'AI provider error: ' + str(e)}, 502
 
     # record successful chat in activity log
-    log = ActivityLog(user_id=current_user.id, action='chat', details=message)
-    db.session.add(log)
-    db.session.commit()
+    activity.record(current_user.id, 'chat', details=message)
 
     return {'success': True, 'reply': reply}
@@ -1,4 +1,6 @@
-from flask import Blueprint, current_app, send_from_directory, abort
+from flask import Blueprint, current_app, abort
+from werkzeug.security import safe_join
+from services.delivery import file_validators, is_not_modified, not_modified_response, send_content_file
 import os
 main_uploads = Blueprint('uploads', __name__)
 
@@ -7,8 +9,11 @@ def uploads(filename):
     base = current_app.config.get('UPLOAD_FOLDER')
     if not base:
         abort(404)
-    path = os.path.join(base, filename)
-    if not os.path.isfile(path):
+    path = safe_join(base, filename)
+    if path is None or not os.path.isfile(path):
         abort(404)
-    # send from the uploads directory root
-    return send_from_directory(base, filename)
+    # served through the delivery layer so nginx/lighttpd can take over the transfer
+    validators = file_validators(path)
+    if is_not_modified(validators):
+        return not_modified_response(validators)
+    return send_content_file(validators)
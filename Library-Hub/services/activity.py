@@ -0,0 +1,153 @@
+"""Asynchronous, batched ActivityLog writer.
+
+`record()` puts the event on a bounded in-memory queue and returns; a
+daemon thread bulk-inserts queued events in one transaction every
+``ACTIVITY_LOG_FLUSH_INTERVAL`` seconds or ``ACTIVITY_LOG_BATCH_SIZE``
+events, whichever comes first. When the queue is full, `record()` waits
+up to ``ACTIVITY_LOG_PUT_TIMEOUT`` seconds for room and then writes the
+event itself, so bursts slow down the requests producing them instead of
+dropping audit records or growing memory without bound. Whatever is still
+queued is written at process exit.
+
+With ``ACTIVITY_LOG_ASYNC`` off (and under TESTING) every event is written
+synchronously, the way the routes used to do it.
+"""
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+
+from models import db, ActivityLog
+
+_queue = None
+_queue_lock = threading.Lock()
+_thread = None
+_stats = {'queued': 0, 'written': 0, 'overflowed': 0, 'failed': 0}
+
+
+def _async_enabled(app):
+    return app.config.get('ACTIVITY_LOG_ASYNC') and not app.config.get('TESTING')
+
+
+def record(user_id, action, details=None, content_id=None, ip_address=None):
+    """Log an activity. Does not touch the caller's session unless writing synchronously."""
+    event = {
+        'user_id': user_id,
+        'action': action,
+        'details': details,
+        'content_id': content_id,
+        'ip_address': ip_address,
+        'timestamp': datetime.utcnow(),
+    }
+    app = current_app._get_current_object()
+    if not _async_enabled(app):
+        _write_sync(event)
+        return
+    q = _ensure_writer(app)
+    try:
+        q.put(event, timeout=app.config.get('ACTIVITY_LOG_PUT_TIMEOUT', 0.05))
+        _stats['queued'] += 1
+    except queue.Full:
+        _stats['overflowed'] += 1
+        _write_sync(event)
+
+
+def _write_sync(event):
+    db.session.add(ActivityLog(**event))
+    db.session.commit()
+
+
+def _insert_batch(batch):
+    db.session.execute(insert(ActivityLog), batch)
+    db.session.commit()
+
+
+def _write_batch(app, batch, attempts=3):
+    for attempt in range(attempts):
+        try:
+            _insert_batch(batch)
+            _stats['written'] += len(batch)
+            return True
+        except Exception:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                _stats['failed'] += len(batch)
+                app.logger.exception('Dropping %d activity log events after %d attempts', len(batch), attempts)
+                return False
+            time.sleep(0.5 * 2 ** attempt)
+        finally:
+            db.session.remove()
+
+
+def _take_batch(q, batch_size, wait):
+    """Block for the first event, then collect more until the batch is full or `wait` elapses."""
+    batch = [q.get()]
+    deadline = time.monotonic() + wait
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(q.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _writer_main(app, q):
+    batch_size = app.config.get('ACTIVITY_LOG_BATCH_SIZE', 500)
+    wait = app.config.get('ACTIVITY_LOG_FLUSH_INTERVAL', 1.0)
+    while True:
+        batch = _take_batch(q, batch_size, wait)
+        with app.app_context():
+            _write_batch(app, batch)
+        for _ in batch:
+            q.task_done()
+
+
+def drain(app=None):
+    """Write everything still queued from the calling thread; returns the number of events written."""
+    app = app or current_app._get_current_object()
+    q = _queue
+    if q is None:
+        return 0
+    batch_size = app.config.get('ACTIVITY_LOG_BATCH_SIZE', 500)
+    written = 0
+    with app.app_context():
+        while True:
+            batch = []
+            while len(batch) < batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            if _write_batch(app, batch, attempts=1):
+                written += len(batch)
+            for _ in batch:
+                q.task_done()
+    return written
+
+
+def _ensure_writer(app):
+    global _queue, _thread
+    if _queue is not None:
+        return _queue
+    with _queue_lock:
+        if _queue is None:
+            q = queue.Queue(maxsize=app.config.get('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+            _thread = threading.Thread(target=_writer_main, args=(app, q), name='activity-log-writer', daemon=True)
+            _thread.start()
+            atexit.register(drain, app)
+            _queue = q
+    return _queue
+
+
+def stats():
+    """Counters since process start plus the current queue depth."""
+    return dict(_stats, pending=_queue.qsize() if _queue is not None else 0)
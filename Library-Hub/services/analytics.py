@@ -0,0 +1,168 @@
+"""Daily ActivityLog rollups and raw-log retention.
+
+Admin analytics read `DailyActionStat`, `DailyContentStat` and
+`DailyUserStat` instead of grouping the raw, ever-growing `activity_log`
+table on every page load. `rollup()` rebuilds each day from the raw rows
+(delete + INSERT ... SELECT ... GROUP BY), so it is idempotent and can be
+re-run over any range; it runs as the ``analytics.rollup`` background job,
+which re-schedules itself every ``ANALYTICS_ROLLUP_INTERVAL`` seconds.
+
+Raw rows older than ``ACTIVITY_LOG_RETENTION_DAYS`` (0 keeps everything)
+are deleted once their day has been rolled up or, when ``ARCHIVE_DIR`` is
+set, moved to `services.archive` a month at a time. Days without raw rows
+are never rebuilt, so pruned history keeps its totals.
+"""
+from datetime import datetime, time, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, literal, select
+
+from models import db, ActivityLog, DailyActionStat, DailyContentStat, DailyUserStat, Job, User
+from services import archive, jobs
+
+ROLLUP_JOB = 'analytics.rollup'
+
+analytics_cli = AppGroup('analytics', help='Maintain ActivityLog rollups.')
+
+
+def _bounds(day):
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def rollup_day(day):
+    """Recompute all aggregates for `day` from the raw log (not committed). Returns the raw row count."""
+    start, end = _bounds(day)
+    in_day = (ActivityLog.timestamp >= start, ActivityLog.timestamp < end)
+    raw = db.session.query(func.count(ActivityLog.id)).filter(*in_day).scalar()
+    if not raw:
+        # nothing logged, or already pruned by retention: keep whatever totals we have
+        return 0
+    day_value = literal(day, db.Date)
+    for model in (DailyActionStat, DailyContentStat, DailyUserStat):
+        db.session.execute(delete(model).where(model.day == day))
+    db.session.execute(insert(DailyActionStat).from_select(
+        ['day', 'action', 'count'],
+        select(day_value, ActivityLog.action, func.count(ActivityLog.id))
+        .where(*in_day).group_by(ActivityLog.action)))
+    db.session.execute(insert(DailyContentStat).from_select(
+        ['day', 'content_id', 'action', 'count'],
+        select(day_value, ActivityLog.content_id, ActivityLog.action, func.count(ActivityLog.id))
+        .where(*in_day, ActivityLog.content_id.isnot(None))
+        .group_by(ActivityLog.content_id, ActivityLog.action)))
+    db.session.execute(insert(DailyUserStat).from_select(
+        ['day', 'user_id', 'action', 'count'],
+        select(day_value, ActivityLog.user_id, ActivityLog.action, func.count(ActivityLog.id))
+        .where(*in_day).group_by(ActivityLog.user_id, ActivityLog.action)))
+    return raw
+
+
+def last_rolled_day():
+    return db.session.query(func.max(DailyActionStat.day)).scalar()
+
+
+def rollup(since=None, until=None):
+    """Roll up every day from `since` (default: the last rolled-up day, or the first log entry) to `until` (today).
+
+    Each day is committed separately; returns the number of days rebuilt.
+    """
+    until = until or datetime.utcnow().date()
+    if since is None:
+        since = last_rolled_day()
+        if since is None:
+            first = db.session.query(func.min(ActivityLog.timestamp)).scalar()
+            if first is None:
+                return 0
+            since = first.date()
+    rebuilt = 0
+    day = since
+    while day <= until:
+        if rollup_day(day):
+            rebuilt += 1
+        db.session.commit()
+        day += timedelta(days=1)
+    return rebuilt
+
+
+def apply_retention(days=None):
+    """Remove raw rows older than `days` whose day is already rolled up.
+
+    With ``ARCHIVE_DIR`` set they are archived instead of deleted, which
+    happens once their whole month is past the cutoff. Returns the number
+    of rows removed.
+    """
+    days = current_app.config.get('ACTIVITY_LOG_RETENTION_DAYS', 0) if days is None else days
+    last = last_rolled_day()
+    if not days or last is None:
+        return 0
+    cutoff_day = min(datetime.utcnow().date() - timedelta(days=days), last)
+    if current_app.config.get('ARCHIVE_DIR'):
+        return archive.archive_table('activity_log', datetime.combine(cutoff_day, time.min))
+    first = db.session.query(func.min(ActivityLog.timestamp)).scalar()
+    if first is None:
+        return 0
+    removed = 0
+    day = first.date()
+    while day < cutoff_day:
+        start, end = _bounds(day)
+        in_day = (ActivityLog.timestamp >= start, ActivityLog.timestamp < end)
+        removed += ActivityLog.query.filter(*in_day).delete(synchronize_session=False)
+        db.session.commit()
+        day += timedelta(days=1)
+    return removed
+
+
+def ensure_scheduled():
+    """Queue the periodic rollup job unless one is already pending."""
+    pending = Job.query.filter(Job.name == ROLLUP_JOB, Job.status.in_(('queued', 'running'))).first()
+    if pending is None:
+        jobs.enqueue(ROLLUP_JOB)
+        db.session.commit()
+
+
+@jobs.task(ROLLUP_JOB)
+def rollup_job():
+    rollup()
+    apply_retention()
+    jobs.enqueue(ROLLUP_JOB, delay=current_app.config.get('ANALYTICS_ROLLUP_INTERVAL', 600))
+    db.session.commit()
+
+
+def daily_action_counts(action, since):
+    """[(day, count)] for `action` from `since` (a date) onwards."""
+    return db.session.query(DailyActionStat.day, DailyActionStat.count).filter(
+        DailyActionStat.action == action, DailyActionStat.day >= since
+    ).order_by(DailyActionStat.day).all()
+
+
+def activity_total(since):
+    return db.session.query(func.coalesce(func.sum(DailyActionStat.count), 0)).filter(
+        DailyActionStat.day >= since).scalar()
+
+
+def top_users(since=None, action=None, limit=10):
+    """[(User, count)] ordered by activity, optionally restricted to one action and a start date."""
+    total = func.sum(DailyUserStat.count).label('total')
+    query = db.session.query(User, total).join(DailyUserStat, DailyUserStat.user_id == User.id)
+    if since is not None:
+        query = query.filter(DailyUserStat.day >= since)
+    if action is not None:
+        query = query.filter(DailyUserStat.action == action)
+    return query.group_by(User.id).order_by(total.desc()).limit(limit).all()
+
+
+@analytics_cli.command('rollup')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='Rebuild from this day (YYYY-MM-DD).')
+def rollup_command(since):
+    """Build or refresh the daily rollups (backfills all history on first run)."""
+    days = rollup(since.date() if since else None)
+    click.echo(f'Rolled up {days} days')
+
+
+@analytics_cli.command('prune')
+@click.option('--days', type=int, default=None, help='Override ACTIVITY_LOG_RETENTION_DAYS.')
+def prune_command(days):
+    """Archive and delete raw activity rows past the retention period."""
+    click.echo(f'Removed {apply_retention(days)} activity log rows')
@@ -0,0 +1,373 @@
+"""Tiered archival of old chat messages and activity log rows.
+
+Rows older than ``CHAT_ARCHIVE_AFTER_DAYS`` (chat) or
+``ACTIVITY_LOG_RETENTION_DAYS`` (activity, once rolled up) are moved out
+of the database a whole calendar month at a time, into gzipped JSON-lines
+segment files under ``ARCHIVE_DIR/<table>/<YYYY-MM>/``: one per community
+(chat) or user (activity) and month, rows in time order. A segment is
+written and fsynced under a temporary name, renamed into place and never
+changed again; rows archived later for the same month get a segment of
+their own. `ArchiveSegment` rows are the manifest (partition, time and id
+bounds, row count); each is committed in the same transaction that
+deletes its rows, so a crash leaves at worst an unlisted file, which is
+ignored and overwritten when the month is archived again.
+
+`paginate` merges archived rows into keyset pages, so the chat and
+activity history pages read archived ranges without knowing about them;
+the manifest tells it which segments can hold rows for a page, and
+browsing recent history opens none. `restore` moves segments back into
+the database, which is how archival is undone (lower or turn off the age
+first, or they are archived again). ``flask archive run|list|restore``
+drive it by hand; chat archival also runs as the ``archive.run`` job.
+"""
+import gzip
+import json
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, ActivityLog, ArchiveSegment, ChatMessage, Community, Content, Job, User
+from services import jobs
+from services.pagination import KeysetPage, count_mode_arg, decode_cursor, encode_cursor, keyset_paginate, per_page_arg
+
+ARCHIVE_JOB = 'archive.run'
+
+archive_cli = AppGroup('archive', help='Archive old chat and activity rows to compressed segment files.')
+
+# parents: column -> (model, nullable); on restore, rows whose parent is gone are skipped, or the
+# column cleared if it is nullable
+Archived = namedtuple('Archived', 'model time_column partition_column parents')
+
+TABLES = {
+    'chat_message': Archived(ChatMessage, 'created_at', 'community_id',
+                             {'community_id': (Community, False), 'author_id': (User, False)}),
+    'activity_log': Archived(ActivityLog, 'timestamp', 'user_id',
+                             {'user_id': (User, False), 'content_id': (Content, True)}),
+}
+
+CHUNK_SIZE = 500
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _archive_dir():
+    return current_app.config.get('ARCHIVE_DIR')
+
+
+def _datetime_columns(spec):
+    return [c.key for c in spec.model.__table__.columns if isinstance(c.type, db.DateTime)]
+
+
+def _write_segment(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for row in rows:
+                f.write((json.dumps({key: value.isoformat() if isinstance(value, datetime) else value
+                                     for key, value in row.items()}) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+
+
+def _read_segment(spec, segment):
+    """The rows of `segment`, oldest first."""
+    dates = _datetime_columns(spec)
+    rows = []
+    with gzip.open(os.path.join(_archive_dir(), segment.path), 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            for key in dates:
+                if row.get(key):
+                    row[key] = datetime.fromisoformat(row[key])
+            rows.append(row)
+    return rows
+
+
+def _archive_partition(name, spec, partition, start, end):
+    table = spec.model.__table__
+    time_column = table.c[spec.time_column]
+    rows = [dict(row) for row in db.session.execute(
+        select(table).where(table.c[spec.partition_column] == partition, time_column >= start, time_column < end)
+        .order_by(time_column, table.c.id)).mappings()]
+    if not rows:
+        return 0
+    first, last = rows[0], rows[-1]
+    path = f'{name}/{start:%Y-%m}/{partition}-{first["id"]}-{last["id"]}.jsonl.gz'
+    full_path = os.path.join(_archive_dir(), path)
+    _write_segment(full_path, rows)
+    db.session.add(ArchiveSegment(table_name=name, partition_key=partition, month=f'{start:%Y-%m}', path=path,
+                                  row_count=len(rows), first_at=first[spec.time_column],
+                                  last_at=last[spec.time_column], first_id=first['id'], last_id=last['id']))
+    for ids in _chunks([row['id'] for row in rows]):
+        db.session.execute(table.delete().where(table.c.id.in_(ids)))
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.remove(full_path)
+        raise
+    return len(rows)
+
+
+def archive_table(name, before):
+    """Archive the rows of table `name` from the months that ended by `before`; returns the rows moved."""
+    if not _archive_dir():
+        raise RuntimeError('ARCHIVE_DIR is not set')
+    spec = TABLES[name]
+    time_column = getattr(spec.model, spec.time_column)
+    partition_column = getattr(spec.model, spec.partition_column)
+    cutoff = _month_start(before)
+    moved = 0
+    while True:
+        first = db.session.query(func.min(time_column)).filter(time_column < cutoff).scalar()
+        if first is None:
+            return moved
+        start = _month_start(first)
+        end = min(_next_month(start), cutoff)
+        partitions = [partition for (partition,) in db.session.query(partition_column).distinct()
+                      .filter(time_column >= start, time_column < end)]
+        moved_month = sum(_archive_partition(name, spec, partition, start, end) for partition in partitions)
+        if not moved_month:
+            return moved
+        moved += moved_month
+
+
+def archive_chat():
+    """Archive chat messages older than CHAT_ARCHIVE_AFTER_DAYS (0 keeps them); returns the rows moved."""
+    days = current_app.config.get('CHAT_ARCHIVE_AFTER_DAYS', 0)
+    if not days or not _archive_dir():
+        return 0
+    return archive_table('chat_message', datetime.utcnow() - timedelta(days=days))
+
+
+def _segments(name, partition):
+    return ArchiveSegment.query.filter_by(table_name=name, partition_key=partition)
+
+
+def has_segments(name, partition):
+    return db.session.query(_segments(name, partition).exists()).scalar()
+
+
+def read(name, partition, position=None, newer=False, limit=50, bound=None):
+    """Archived rows of one partition past `position` (a (time, id) pair), up to `limit` of them.
+
+    Rows are walked newest first, or oldest first with `newer` (rows after
+    `position`). Segments entirely beyond `bound`, a time the caller
+    already has enough rows before reaching, are not opened.
+    """
+    spec = TABLES[name]
+    segments = _segments(name, partition)
+    if newer:
+        if position is not None:
+            segments = segments.filter(ArchiveSegment.last_at >= position[0])
+        if bound is not None:
+            segments = segments.filter(ArchiveSegment.first_at <= bound)
+        segments = segments.order_by(ArchiveSegment.first_at.asc(), ArchiveSegment.first_id.asc())
+    else:
+        if position is not None:
+            segments = segments.filter(ArchiveSegment.first_at <= position[0])
+        if bound is not None:
+            segments = segments.filter(ArchiveSegment.last_at >= bound)
+        segments = segments.order_by(ArchiveSegment.last_at.desc(), ArchiveSegment.last_id.desc())
+
+    def key(row):
+        return row[spec.time_column], row['id']
+
+    rows = []
+    for segment in segments:
+        if len(rows) >= limit:
+            # segments overlap only if rows were archived late; stop once this one can't beat what we have
+            edge = key(rows[limit - 1])[0]
+            if (segment.first_at > edge) if newer else (segment.last_at < edge):
+                break
+        found = [row for row in _read_segment(spec, segment)
+                 if position is None or ((key(row) > tuple(position)) if newer else (key(row) < tuple(position)))]
+        rows = sorted(rows + found, key=key, reverse=not newer)
+    return rows[:limit]
+
+
+def _instance(spec, row):
+    """An archived row as a model instance, attached to the session as if loaded, so relationships still load."""
+    obj = spec.model(**row)
+    make_transient_to_detached(obj)
+    return db.session.merge(obj, load=False)
+
+
+def paginate(name, query, partition, per_page, after=None, before=None, count='none'):
+    """`keyset_paginate` over `query` (one partition of table `name`) with its archived rows merged in.
+
+    Items are model instances, newest first; cursors work across both.
+    Totals only count the rows still in the database.
+    """
+    spec = TABLES[name]
+    time_column, id_column = getattr(spec.model, spec.time_column), spec.model.id
+    page = keyset_paginate(query, time_column, id_column, per_page, after=after, before=before, count=count)
+    newer = bool(before) and not after
+    position = decode_cursor(after or before) if (after or before) else None
+    db_more = (page.prev_cursor if newer else page.next_cursor) is not None
+    bound = None
+    if db_more and page.items:
+        # archived rows beyond the furthest database row of this page can't make it in
+        bound = getattr(page.items[0] if newer else page.items[-1], spec.time_column)
+    archived = read(name, partition, position, newer, per_page + 1, bound)
+    if not archived:
+        return page
+
+    def key(obj):
+        return getattr(obj, spec.time_column), obj.id
+
+    merged = sorted(page.items + [_instance(spec, row) for row in archived], key=key, reverse=not newer)
+    more = db_more or len(merged) > per_page
+    merged = merged[:per_page]
+    if newer:
+        merged.reverse()
+
+    def cursor_for(obj):
+        return encode_cursor(getattr(obj, spec.time_column), obj.id)
+
+    next_cursor = prev_cursor = None
+    if merged:
+        if more or newer:
+            next_cursor = cursor_for(merged[-1])
+        if (more and newer) or after:
+            prev_cursor = cursor_for(merged[0])
+    return KeysetPage(merged, per_page, next_cursor, prev_cursor, page.total, page.total_is_exact)
+
+
+def paginate_request(name, query, partition, default_per_page=20, default_count='none'):
+    """`paginate` driven by the ``after``, ``before``, ``per_page`` and ``count`` query args."""
+    return paginate(name, query, partition, per_page_arg(default_per_page), after=request.args.get('after'),
+                    before=request.args.get('before'), count=count_mode_arg(default_count))
+
+
+def _restorable(spec, rows):
+    """`rows` minus those whose parent rows are gone (nullable references to a missing row are cleared)."""
+    for column, (model, nullable) in spec.parents.items():
+        wanted = list({row[column] for row in rows if row.get(column) is not None})
+        present = set()
+        for ids in _chunks(wanted):
+            present.update(parent_id for (parent_id,) in db.session.query(model.id).filter(model.id.in_(ids)))
+        kept = []
+        for row in rows:
+            if row.get(column) is None or row[column] in present:
+                kept.append(row)
+            elif nullable:
+                kept.append(dict(row, **{column: None}))
+        rows = kept
+    return rows
+
+
+def restore(name, partition=None, month=None):
+    """Move archived segments of table `name` back into the database; returns (rows restored, rows skipped)."""
+    spec = TABLES[name]
+    segments = ArchiveSegment.query.filter_by(table_name=name)
+    if partition is not None:
+        segments = segments.filter_by(partition_key=partition)
+    if month is not None:
+        segments = segments.filter_by(month=month)
+    restored = skipped = 0
+    for segment in segments.order_by(ArchiveSegment.first_at).all():
+        rows = _read_segment(spec, segment)
+        kept = _restorable(spec, rows)
+        for chunk in _chunks(kept):
+            existing = {row_id for (row_id,) in
+                        db.session.query(spec.model.id).filter(spec.model.id.in_([row['id'] for row in chunk]))}
+            fresh = [row for row in chunk if row['id'] not in existing]
+            if fresh:
+                db.session.execute(insert(spec.model), fresh)
+                restored += len(fresh)
+        skipped += len(rows) - len(kept)
+        path = os.path.join(_archive_dir(), segment.path)
+        db.session.delete(segment)
+        db.session.commit()
+        if os.path.exists(path):
+            os.remove(path)
+    return restored, skipped
+
+
+def discard(name, partition):
+    """Delete the archived rows of one partition (e.g. with the community they belong to)."""
+    segments = _segments(name, partition).all()
+    for segment in segments:
+        db.session.delete(segment)
+    db.session.commit()
+    for segment in segments:
+        path = os.path.join(_archive_dir() or '', segment.path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def ensure_scheduled():
+    """Queue the periodic chat archival job unless it is off or already pending."""
+    if not current_app.config.get('CHAT_ARCHIVE_AFTER_DAYS') or not _archive_dir():
+        return
+    pending = Job.query.filter(Job.name == ARCHIVE_JOB, Job.status.in_(('queued', 'running'))).first()
+    if pending is None:
+        jobs.enqueue(ARCHIVE_JOB)
+        db.session.commit()
+
+
+@jobs.task(ARCHIVE_JOB)
+def archive_job():
+    archive_chat()
+    jobs.enqueue(ARCHIVE_JOB, delay=current_app.config.get('ARCHIVE_INTERVAL', 86400))
+    db.session.commit()
+
+
+@archive_cli.command('run')
+@click.option('--table', type=click.Choice(sorted(TABLES)), default='chat_message')
+@click.option('--days', type=int, default=None,
+              help='Archive rows older than this many days (default: CHAT_ARCHIVE_AFTER_DAYS / ACTIVITY_LOG_RETENTION_DAYS).')
+def run_command(table, days):
+    """Archive the months older than the configured age."""
+    if not _archive_dir():
+        raise click.UsageError('Set ARCHIVE_DIR first.')
+    if days is None:
+        days = current_app.config.get('CHAT_ARCHIVE_AFTER_DAYS' if table == 'chat_message'
+                                      else 'ACTIVITY_LOG_RETENTION_DAYS', 0)
+    if not days:
+        raise click.UsageError('No age configured; pass --days.')
+    moved = archive_table(table, datetime.utcnow() - timedelta(days=days))
+    click.echo(f'Archived {moved} {table} rows')
+
+
+@archive_cli.command('list')
+@click.option('--table', type=click.Choice(sorted(TABLES)), default=None)
+def list_command(table):
+    """Summarise the archived segments per table and month."""
+    query = db.session.query(ArchiveSegment.table_name, ArchiveSegment.month, func.count(ArchiveSegment.id),
+                             func.sum(ArchiveSegment.row_count))
+    if table:
+        query = query.filter(ArchiveSegment.table_name == table)
+    for name, month, segments, rows in query.group_by(ArchiveSegment.table_name, ArchiveSegment.month) \
+            .order_by(ArchiveSegment.table_name, ArchiveSegment.month):
+        click.echo(f'{name:13} {month}  {segments:6} segments  {rows:9} rows')
+
+
+@archive_cli.command('restore')
+@click.option('--table', type=click.Choice(sorted(TABLES)), default='chat_message')
+@click.option('--partition', type=int, default=None, help='Only this community (chat) or user (activity).')
+@click.option('--month', default=None, help='Only this month (YYYY-MM).')
+def restore_command(table, partition, month):
+    """Move archived rows back into the database."""
+    restored, skipped = restore(table, partition, month)
+    click.echo(f'Restored {restored} {table} rows' + (f', skipped {skipped} whose parent rows are gone' if skipped else ''))
@@ -0,0 +1,248 @@
+"""Content-addressed, deduplicating file store.
+
+Files live under ``UPLOAD_FOLDER/blobs/ab/cd/<sha256>`` and are shared by
+every `Content` row and `LiveSession` recording with the same bytes.
+`Content.file_path` / `LiveSession.recording_path` keep the human-facing
+filename (used for download names); the bytes are found through
+`blob_sha256` / `recording_blob`. Rows without a blob still resolve to the
+legacy per-type folders until ``flask blobs migrate`` has been run.
+
+Reference counts are only changed with single ``UPDATE ... SET ref_count
+= ref_count ± 1`` statements, so concurrent uploads and deletes of the same
+bytes can't lose an update; a file is unlinked only when the decrement
+itself returned zero and, after the commit, no row for it has reappeared.
+"""
+import hashlib
+import os
+import tempfile
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, Blob, Content, LiveSession
+
+READ_BLOCK = 1024 * 1024
+
+blobs_cli = AppGroup('blobs', help='Manage the content-addressed file store.')
+
+
+def _blob_root():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs')
+
+
+def blob_path(sha256):
+    return os.path.join(_blob_root(), sha256[:2], sha256[2:4], sha256)
+
+
+def content_path(content):
+    """Absolute path of the bytes behind a `Content` row."""
+    if content.blob_sha256:
+        return blob_path(content.blob_sha256)
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], content.get_type_folder(), content.file_path)
+
+
+def recording_path(session):
+    """Absolute path of a `LiveSession` recording, or None if it has none."""
+    if session.recording_blob:
+        return blob_path(session.recording_blob)
+    if session.recording_path:
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], 'live', session.recording_path)
+    return None
+
+
+def _increment(sha256):
+    """Add a reference to an existing blob row; returns False if there is none."""
+    result = db.session.execute(update(Blob).where(Blob.sha256 == sha256)
+                                .values(ref_count=Blob.ref_count + 1)
+                                .execution_options(synchronize_session=False))
+    return result.rowcount > 0
+
+
+def _insert_if_missing(sha256, size):
+    """Insert the blob row with one reference; returns False if a concurrent upload inserted it first."""
+    values = {'sha256': sha256, 'size': size, 'ref_count': 1, 'created_at': datetime.utcnow()}
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(Blob).values(**values).on_conflict_do_nothing(index_elements=['sha256'])
+        return db.session.execute(stmt).rowcount > 0
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(Blob).values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def acquire(sha256, size):
+    """Add a reference to a blob, creating its row if needed (not committed); returns the `Blob`."""
+    while not _increment(sha256):
+        if _insert_if_missing(sha256, size):
+            break
+    return db.session.get(Blob, sha256, populate_existing=True)
+
+
+def release(sha256):
+    """Drop a reference; the file is unlinked once the session commits with no references left."""
+    remaining = db.session.execute(update(Blob).where(Blob.sha256 == sha256)
+                                   .values(ref_count=Blob.ref_count - 1).returning(Blob.ref_count)
+                                   .execution_options(synchronize_session=False)).scalar()
+    if remaining is None or remaining > 0:
+        return
+    # only the release that took the count to zero removes the row (and later the file)
+    deleted = db.session.execute(delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0)
+                                 .execution_options(synchronize_session=False))
+    if deleted.rowcount:
+        stale = db.session.identity_map.get(db.session.identity_key(Blob, sha256))
+        if stale is not None:
+            db.session.expunge(stale)
+        db.session.info.setdefault('orphaned_blobs', []).append(sha256)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_orphaned_blobs(session):
+    orphaned = session.info.pop('orphaned_blobs', [])
+    if not orphaned:
+        return
+    # an upload of the same bytes may have recreated the row (and reused the file) since
+    with db.engine.connect() as conn:
+        recreated = set(conn.execute(select(Blob.sha256).where(Blob.sha256.in_(orphaned))).scalars())
+    for sha256 in orphaned:
+        if sha256 in recreated:
+            continue
+        try:
+            os.remove(blob_path(sha256))
+        except OSError:
+            pass
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_orphaned_blobs(session):
+    session.info.pop('orphaned_blobs', None)
+
+
+def _place(tmp, sha256, size):
+    dest = blob_path(sha256)
+    if os.path.exists(dest):
+        os.remove(tmp)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp, dest)
+    return acquire(sha256, size)
+
+
+def store_stream(stream):
+    """Copy a readable stream into the store, hashing it on the way in; returns the acquired `Blob`."""
+    tmp_dir = os.path.join(_blob_root(), 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for block in iter(lambda: stream.read(READ_BLOCK), b''):
+                h.update(block)
+                out.write(block)
+                size += len(block)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return _place(tmp, h.hexdigest(), size)
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def store_file(path, sha256=None):
+    """Move an existing file into the store (deleting it if the blob already exists)."""
+    sha256 = sha256 or _hash_file(path)
+    return _place(path, sha256, os.path.getsize(path))
+
+
+@blobs_cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='Report what would be deduplicated without moving files.')
+def migrate_command(dry_run):
+    """Move legacy per-type upload files into the blob store."""
+    moved = {}
+    stored = reused = missing = 0
+    saved = 0
+
+    def adopt(path):
+        nonlocal stored, reused, missing, saved
+        if path in moved:
+            return moved[path]
+        if not os.path.isfile(path):
+            missing += 1
+            click.echo(f'missing: {path}', err=True)
+            return None
+        sha256 = _hash_file(path)
+        size = os.path.getsize(path)
+        if os.path.exists(blob_path(sha256)) or sha256 in moved.values():
+            reused += 1
+            saved += size
+        else:
+            stored += 1
+        if not dry_run:
+            if os.path.exists(blob_path(sha256)):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path(sha256)), exist_ok=True)
+                os.replace(path, blob_path(sha256))
+        moved[path] = sha256
+        return sha256
+
+    for content in Content.query.filter(Content.blob_sha256.is_(None)).all():
+        sha256 = adopt(os.path.join(current_app.config['UPLOAD_FOLDER'], content.get_type_folder(), content.file_path))
+        if sha256 and not dry_run:
+            content.blob_sha256 = sha256
+    for session in LiveSession.query.filter(LiveSession.recording_blob.is_(None),
+                                            LiveSession.recording_path.isnot(None)).all():
+        sha256 = adopt(recording_path(session))
+        if sha256 and not dry_run:
+            session.recording_blob = sha256
+
+    if not dry_run:
+        for sha256 in set(moved.values()):
+            if sha256 and db.session.get(Blob, sha256) is None:
+                db.session.add(Blob(sha256=sha256, size=os.path.getsize(blob_path(sha256)), ref_count=0))
+        db.session.flush()
+        _recount()
+        db.session.commit()
+    prefix = 'would store' if dry_run else 'stored'
+    click.echo(f'{prefix} {stored} blobs, deduplicated {reused} files ({saved} bytes), {missing} missing')
+
+
+def _recount():
+    counts = {}
+    for sha256, n in db.session.query(Content.blob_sha256, func.count(Content.id)).filter(
+            Content.blob_sha256.isnot(None)).group_by(Content.blob_sha256):
+        counts[sha256] = counts.get(sha256, 0) + n
+    for sha256, n in db.session.query(LiveSession.recording_blob, func.count(LiveSession.id)).filter(
+            LiveSession.recording_blob.isnot(None)).group_by(LiveSession.recording_blob):
+        counts[sha256] = counts.get(sha256, 0) + n
+    for blob in Blob.query.all():
+        blob.ref_count = counts.get(blob.sha256, 0)
+        if blob.ref_count == 0:
+            db.session.delete(blob)
+            db.session.info.setdefault('orphaned_blobs', []).append(blob.sha256)
+
+
+@blobs_cli.command('recount')
+def recount_command():
+    """Recompute reference counts from Content / LiveSession rows and drop unreferenced blobs."""
+    _recount()
+    db.session.commit()
+    click.echo(f'{Blob.query.count()} blobs referenced')
@@ -0,0 +1,143 @@
+"""A small cache for data shared by every user, such as dashboard blocks.
+
+Values must be JSON-serialisable (datetimes are allowed). With
+``app.redis`` configured they are stored in Redis, so all workers share one
+copy and an invalidation is seen everywhere at once. Otherwise each process
+keeps an LRU of at most ``CACHE_MAX_ENTRIES`` entries; an invalidation then
+only reaches the process that made the change and the others catch up
+when their copy expires, so keep TTLs short. Redis errors are treated as
+cache misses.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+KEY_PREFIX = 'cache:'
+
+
+class LocalCache:
+    """Thread-safe in-process LRU cache with a TTL per entry."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = LocalCache()
+
+
+def _encode(value):
+    return json.dumps(value, default=lambda o: {'dt': o.isoformat()} if isinstance(o, datetime) else str(o))
+
+
+def _decode(text):
+    return json.loads(text, object_hook=lambda d: datetime.fromisoformat(d['dt']) if d.keys() == {'dt'} else d)
+
+
+def _redis():
+    return getattr(current_app, 'redis', None) if has_app_context() else None
+
+
+def get(key):
+    """The cached value for `key`, or None."""
+    r = _redis()
+    if r:
+        try:
+            text = r.get(KEY_PREFIX + key)
+        except Exception:
+            current_app.logger.warning('Cache read failed for %s', key, exc_info=True)
+            return None
+    else:
+        text = _local.get(key)
+    return _decode(text) if text is not None else None
+
+
+def get_many(keys):
+    """{key: value} for the cached ones among `keys`, in one round-trip."""
+    keys = list(keys)
+    r = _redis()
+    if r and keys:
+        try:
+            texts = r.mget([KEY_PREFIX + key for key in keys])
+        except Exception:
+            current_app.logger.warning('Cache read failed for %d keys', len(keys), exc_info=True)
+            return {}
+    else:
+        texts = [_local.get(key) for key in keys]
+    return {key: _decode(text) for key, text in zip(keys, texts) if text is not None}
+
+
+def set(key, value, ttl=None):
+    set_many({key: value}, ttl)
+
+
+def set_many(values, ttl=None):
+    if ttl is None:
+        ttl = current_app.config.get('CACHE_DEFAULT_TTL', 60) if has_app_context() else 60
+    texts = {key: _encode(value) for key, value in values.items()}
+    r = _redis()
+    if r:
+        try:
+            pipe = r.pipeline(transaction=False)
+            for key, text in texts.items():
+                pipe.setex(KEY_PREFIX + key, ttl, text)
+            pipe.execute()
+        except Exception:
+            current_app.logger.warning('Cache write failed for %s', list(texts), exc_info=True)
+        return
+    if has_app_context():
+        _local.max_entries = current_app.config.get('CACHE_MAX_ENTRIES', 512)
+    for key, text in texts.items():
+        _local.set(key, text, ttl)
+
+
+def delete(*keys):
+    _local.delete(*keys)
+    r = _redis()
+    if r and keys:
+        try:
+            r.delete(*(KEY_PREFIX + key for key in keys))
+        except Exception:
+            current_app.logger.warning('Cache invalidation failed for %s', keys, exc_info=True)
+
+
+def cached(key, build, ttl=None):
+    """Return the cached value for `key`, calling `build()` and caching its result on a miss."""
+    value = get(key)
+    if value is None:
+        value = build()
+        set(key, value, ttl)
+    return value
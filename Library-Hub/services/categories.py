@@ -0,0 +1,63 @@
+"""The category catalogue with item counts, cached in `services.cache`.
+
+Every page that lists categories (browse filters, upload/edit forms, the
+categories pages, the dashboard and ``/api/categories``) reads the same
+list of ``{'id', 'name', 'description', 'content_count'}`` dicts, built by
+one grouped query instead of a ``COUNT`` per category. It is dropped after
+any commit that adds, renames or deletes a category, or adds, deletes or
+re-categorises content.
+"""
+from flask import current_app
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Category, Content
+from services import cache
+
+KEY = 'categories:catalogue'
+
+
+def _build():
+    rows = (db.session.query(Category.id, Category.name, Category.description, func.count(Content.id))
+            .outerjoin(Content, Content.category_id == Category.id)
+            .group_by(Category.id, Category.name, Category.description)
+            .order_by(Category.id))
+    return [{'id': cid, 'name': name, 'description': description, 'content_count': n}
+            for cid, name, description, n in rows]
+
+
+def catalogue():
+    """All categories, with the number of content items in each."""
+    return cache.cached(KEY, _build, current_app.config.get('CATEGORY_CACHE_TTL', 300))
+
+
+def invalidate():
+    cache.delete(KEY)
+
+
+def _affects_catalogue(session):
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, (Category, Content)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, Category) or (
+                isinstance(obj, Content) and inspect(obj).attrs.category_id.history.has_changes()):
+            return True
+    return False
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    if _affects_catalogue(session):
+        session.info['categories_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('categories_stale', False):
+        invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('categories_stale', None)
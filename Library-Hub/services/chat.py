@@ -0,0 +1,419 @@
+"""Write-behind persistence for community chat messages.
+
+`post()` gives a message a Snowflake id (milliseconds, worker id and a
+sequence number, so no database round-trip), appends it to this process's
+journal file, queues it and returns the payload to broadcast straight
+away. A daemon thread inserts queued messages in batches of up to
+``CHAT_BATCH_SIZE`` every ``CHAT_FLUSH_INTERVAL`` seconds.
+
+Delivery to the database is at least once. Inserts skip ids that are
+already stored, so writing a message twice is harmless; the journal is
+only emptied once everything in it has been written, and it is replayed
+when the writer starts (picking up what a crashed predecessor with the
+same worker id left behind), after a batch fails, and by
+``flask chat replay``. Lines are flushed to the OS per message, which
+survives the process dying; ``CHAT_JOURNAL_FSYNC`` also survives power
+loss, at the cost of an fsync per message.
+
+The worker id (0-1023) keeps ids unique and names the journal, and a
+process holds an exclusive lock on its journal for as long as it runs, so
+no two live processes share one. Without ``CHAT_WORKER_ID`` a process
+claims the lowest id whose journal is free, which is unique among the
+processes sharing ``CHAT_JOURNAL_DIR``; processes on other hosts must be
+given distinct ids. If no id can be claimed (the configured one is taken,
+or there's no ``fcntl`` to lock with) write-behind doesn't start. Then, as
+with ``CHAT_WRITE_BEHIND`` off and under TESTING, each message is inserted
+before it is broadcast, and an id that clashes with another process's is
+replaced rather than dropped.
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ChatMessage
+
+try:
+    import fcntl
+except ImportError:  # Windows: journals can't be locked, so CHAT_WORKER_ID must be set
+    fcntl = None
+
+chat_cli = AppGroup('chat', help='Inspect and replay the chat message journal.')
+
+# Snowflake layout: 41 bits of milliseconds since EPOCH_MS, 10 bits of worker id, 12 bits of sequence
+EPOCH_MS = 1767225600000  # 2026-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+_queue = None
+_journal = None
+_generator = None
+_lock = threading.Lock()
+_thread = None
+_refused = False
+_stats = {'queued': 0, 'written': 0, 'overflowed': 0, 'failed': 0, 'replayed': 0}
+
+
+class Snowflake:
+    """Generator of 64-bit ids that sort by creation time."""
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < 1 << WORKER_BITS:
+            raise ValueError(f'Worker id must be between 0 and {(1 << WORKER_BITS) - 1}')
+        self.worker_id = worker_id
+        self._last = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            now = max(int(time.time() * 1000), self._last)  # never go back if the clock does
+            if now == self._last:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # sequence exhausted for this millisecond: borrow the next one
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+def created_at(message_id):
+    """The creation time encoded in a Snowflake id."""
+    seconds = ((message_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS) / 1000
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+class JournalLocked(Exception):
+    """Another running process holds the journal, and with it the worker id."""
+
+
+class Journal:
+    """Append-only JSONL file of messages not yet known to be in the database.
+
+    Lines appended since the file was last emptied belong to the current
+    `generation`; the file is emptied when all of them have been written.
+    Opening it takes an exclusive lock, held until `close`; raises
+    `JournalLocked` if another process has it.
+    """
+
+    def __init__(self, path, worker_id=None, fsync=False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.worker_id = worker_id
+        self.fsync = fsync
+        self.generation = 0
+        self.pending = 0
+        self.failed = False
+        self._file = open(path, 'a', encoding='utf-8')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._file.close()
+                raise JournalLocked(path)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._file.close()
+
+    def append(self, row):
+        """Journal `row`; returns the generation to pass to `written`."""
+        line = json.dumps(dict(row, created_at=row['created_at'].isoformat())) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.pending += 1
+            return self.generation
+
+    def written(self, generations):
+        """Note that rows journaled in `generations` are stored; empties the file once all are."""
+        with self._lock:
+            self.pending -= sum(1 for generation in generations if generation == self.generation)
+            if self.pending <= 0:
+                self._reset()
+
+    def _reset(self):
+        self._file.truncate(0)
+        self.generation += 1
+        self.pending = 0
+        self.failed = False
+
+    def replay(self, batch_size):
+        """Write everything in the file (skipping stored ids) and empty it; returns the rows inserted."""
+        with self._lock:
+            self._file.flush()
+            inserted = sum(_insert_new(batch) for batch in _chunks(read_journal(self.path), batch_size))
+            self._reset()
+            return inserted
+
+
+def read_journal(path):
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash was never acknowledged
+                continue
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+            rows.append(row)
+    return rows
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _insert_new(rows):
+    """Insert the rows whose id is not stored yet and commit; returns how many were inserted."""
+    existing = {message_id for (message_id,) in
+                db.session.query(ChatMessage.id).filter(ChatMessage.id.in_([row['id'] for row in rows]))}
+    fresh = [row for row in rows if row['id'] not in existing]
+    if fresh:
+        db.session.execute(insert(ChatMessage), fresh)
+    db.session.commit()
+    return len(fresh)
+
+
+def _insert_one(app, row, attempts=3):
+    """Insert a message and commit; an id already taken by another process's message is replaced."""
+    for attempt in range(attempts):
+        try:
+            db.session.execute(insert(ChatMessage), [row])
+            db.session.commit()
+            return row
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+            row['id'] = _id_generator(app).next_id()
+            row['created_at'] = created_at(row['id'])
+
+
+def journal_path(app, worker_id):
+    return os.path.join(app.config['CHAT_JOURNAL_DIR'], f'chat-journal-{worker_id}.jsonl')
+
+
+def _open_journal(app):
+    """Claim a worker id by locking its journal; None if none can be claimed safely."""
+    fsync = app.config.get('CHAT_JOURNAL_FSYNC', False)
+    worker_id = app.config.get('CHAT_WORKER_ID')
+    if worker_id is not None:
+        try:
+            return Journal(journal_path(app, worker_id), worker_id, fsync=fsync)
+        except JournalLocked:
+            app.logger.error('CHAT_WORKER_ID %d is in use by another process; chat write-behind is off', worker_id)
+            return None
+    if fcntl is None:
+        app.logger.error('CHAT_WORKER_ID is not set and journals cannot be locked here; chat write-behind is off')
+        return None
+    for worker_id in range(1 << WORKER_BITS):
+        try:
+            return Journal(journal_path(app, worker_id), worker_id, fsync=fsync)
+        except JournalLocked:
+            continue
+    app.logger.error('Every chat worker id in %s is taken; chat write-behind is off', app.config['CHAT_JOURNAL_DIR'])
+    return None
+
+
+def _write_behind(app):
+    return app.config.get('CHAT_WRITE_BEHIND') and not app.config.get('TESTING')
+
+
+def _id_generator(app):
+    global _generator
+    if _generator is None:
+        with _lock:
+            if _generator is None:
+                # the writer, if it started, set it to the worker id its journal claimed
+                _generator = Snowflake(app.config.get('CHAT_WORKER_ID') or 0)
+    return _generator
+
+
+def post(community_id, author_id, text):
+    """Store a chat message (now or shortly) and return its payload for broadcasting."""
+    app = current_app._get_current_object()
+    q, journal = _ensure_writer(app) if _write_behind(app) else (None, None)
+    message_id = _id_generator(app).next_id()
+    row = {'id': message_id, 'community_id': community_id, 'author_id': author_id, 'message': text,
+           'is_moderated': False, 'created_at': created_at(message_id)}
+    if q is None:
+        _insert_one(app, row)
+    else:
+        generation = journal.append(row)
+        try:
+            q.put((generation, row), timeout=app.config.get('CHAT_PUT_TIMEOUT', 0.05))
+            _stats['queued'] += 1
+        except queue.Full:
+            _stats['overflowed'] += 1
+            _write_batch(app, journal, [(generation, row)])
+    # ids exceed the integers JavaScript can represent exactly
+    return {'id': str(row['id']), 'community_id': community_id, 'author_id': author_id, 'message': text,
+            'created_at': row['created_at'].isoformat()}
+
+
+def _write_batch(app, journal, batch, attempts=3):
+    """Insert a batch of (generation, row); on failure the rows stay journaled for replay."""
+    for attempt in range(attempts):
+        try:
+            _insert_new([row for _, row in batch])
+            journal.written([generation for generation, _ in batch])
+            _stats['written'] += len(batch)
+            return True
+        except Exception:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                _stats['failed'] += len(batch)
+                journal.failed = True
+                app.logger.exception('Writing %d chat messages failed; they stay in %s for replay',
+                                     len(batch), journal.path)
+                return False
+            time.sleep(0.5 * 2 ** attempt)
+        finally:
+            db.session.remove()
+
+
+def _replay(app, journal):
+    try:
+        _stats['replayed'] += journal.replay(app.config.get('CHAT_BATCH_SIZE', 200))
+    except Exception:
+        db.session.rollback()
+        journal.failed = True
+        app.logger.exception('Replaying the chat journal %s failed', journal.path)
+    finally:
+        db.session.remove()
+
+
+def _take_batch(q, batch_size, wait):
+    """The next batch of queued messages, or None if none arrived within `wait` seconds."""
+    try:
+        batch = [q.get(timeout=wait)]
+    except queue.Empty:
+        return None
+    deadline = time.monotonic() + wait
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(q.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _writer_main(app, q, journal):
+    batch_size = app.config.get('CHAT_BATCH_SIZE', 200)
+    wait = app.config.get('CHAT_FLUSH_INTERVAL', 0.2)
+    with app.app_context():
+        # whatever the last process with this worker id left unwritten (the journal lock says it has exited)
+        _replay(app, journal)
+        while True:
+            batch = _take_batch(q, batch_size, wait)
+            if batch is None:
+                if journal.failed:
+                    _replay(app, journal)
+                continue
+            _write_batch(app, journal, batch)
+            for _ in batch:
+                q.task_done()
+
+
+def drain(app=None):
+    """Write everything still queued from the calling thread; returns the number of messages written."""
+    app = app or current_app._get_current_object()
+    q, journal = _queue, _journal
+    if q is None:
+        return 0
+    written = 0
+    with app.app_context():
+        while True:
+            batch = []
+            while len(batch) < app.config.get('CHAT_BATCH_SIZE', 200):
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            if _write_batch(app, journal, batch, attempts=1):
+                written += len(batch)
+            for _ in batch:
+                q.task_done()
+    return written
+
+
+def _ensure_writer(app):
+    """The writer's queue and journal, starting it on first use; (None, None) if it can't start."""
+    global _queue, _journal, _thread, _generator, _refused
+    if _queue is not None or _refused:
+        return _queue, _journal
+    with _lock:
+        if _queue is None and not _refused:
+            journal = _open_journal(app)
+            if journal is None:
+                _refused = True
+                return None, None
+            _generator = Snowflake(journal.worker_id)
+            q = queue.Queue(maxsize=app.config.get('CHAT_QUEUE_SIZE', 10000))
+            _thread = threading.Thread(target=_writer_main, args=(app, q, journal), name='chat-writer', daemon=True)
+            _thread.start()
+            atexit.register(drain, app)
+            _journal, _queue = journal, q
+    return _queue, _journal
+
+
+def stats():
+    """Counters since process start plus the current queue depth."""
+    return dict(_stats, pending=_queue.qsize() if _queue is not None else 0)
+
+
+@chat_cli.command('replay')
+@click.option('--worker', type=int, default=None,
+              help='Journal of this worker id (default: CHAT_WORKER_ID, or every journal if it is not set).')
+@click.option('--truncate', is_flag=True, help='Empty the journals afterwards (skipping those of running workers).')
+def replay_command(worker, truncate):
+    """Write the messages in chat journals that are missing from the database."""
+    app = current_app._get_current_object()
+    worker = app.config.get('CHAT_WORKER_ID') if worker is None else worker
+    if worker is not None:
+        paths = [journal_path(app, worker)]
+    else:
+        paths = sorted(glob.glob(os.path.join(app.config['CHAT_JOURNAL_DIR'], 'chat-journal-*.jsonl')))
+    for path in paths:
+        try:
+            # holding the lock keeps a worker from claiming the journal while it is replayed
+            journal = Journal(path)
+        except JournalLocked:
+            journal = None
+        try:
+            rows = read_journal(path)
+            inserted = sum(_insert_new(batch) for batch in _chunks(rows, app.config.get('CHAT_BATCH_SIZE', 200)))
+            click.echo(f'{os.path.basename(path)}: {len(rows)} journaled messages, '
+                       f'{inserted} were missing and have been written')
+            if truncate:
+                if journal is None:
+                    click.echo(f'{os.path.basename(path)} belongs to a running worker; left as it is')
+                else:
+                    journal._reset()
+        finally:
+            if journal is not None:
+                journal.close()
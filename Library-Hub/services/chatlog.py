@@ -0,0 +1,190 @@
+"""Recent chat messages and scroll-back history.
+
+Opening a community's chat reads its newest ``CHAT_RECENT_LENGTH``
+messages from a ring buffer instead of the database: each entry is the
+message already denormalized for the client (id, author id and name,
+text, time), newest first, trimmed to the length on every push. The
+first read of a community seeds its buffer from the database with one
+query; after that `push` adds each message as it is broadcast, which is
+before `services.chat` has written it.
+
+With ``app.redis`` the buffers are Redis lists shared by every worker;
+otherwise each process keeps its own, which suits chat served by the one
+``socketio.run`` process. The buffers don't expire, since a reseed can't
+see messages other processes haven't written yet. Older messages are read
+by `history` with keyset cursors (``before=``), from the database and,
+past it, from `services.archive`.
+"""
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, ChatMessage, User
+from services import archive
+from services.pagination import encode_cursor
+
+HISTORY_PAGE_SIZE = 50
+
+
+def message_payload(community_id, message_id, author_id, author, text, created_at):
+    """The client's view of a message; ids are strings because Snowflake ids exceed JavaScript's integers."""
+    return {'id': str(message_id), 'community_id': community_id, 'author_id': author_id, 'author': author,
+            'message': text, 'created_at': created_at.isoformat() if created_at else None}
+
+
+def cursor(payload):
+    """The ``before=`` cursor for the messages older than `payload`."""
+    return encode_cursor(datetime.fromisoformat(payload['created_at']), int(payload['id']))
+
+
+class RedisBuffers:
+    """Ring buffers in Redis lists, newest first; a marker key tells an empty buffer from a missing one."""
+
+    def __init__(self, r):
+        self.r = r
+
+    @staticmethod
+    def _keys(community_id):
+        return f'chat:{community_id}:loaded', f'chat:{community_id}:recent'
+
+    def recent(self, community_id):
+        loaded, recent = self._keys(community_id)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.exists(loaded)
+        pipe.lrange(recent, 0, -1)
+        exists, entries = pipe.execute()
+        return [json.loads(entry) for entry in entries] if exists else None
+
+    def store(self, community_id, payloads, length):
+        loaded, recent = self._keys(community_id)
+        pipe = self.r.pipeline()
+        pipe.delete(recent)
+        if payloads:
+            pipe.rpush(recent, *(json.dumps(payload) for payload in payloads[:length]))
+        pipe.set(loaded, 1)
+        pipe.execute()
+
+    def push(self, community_id, payload, length):
+        loaded, recent = self._keys(community_id)
+        if not self.r.exists(loaded):
+            return False
+        pipe = self.r.pipeline()
+        pipe.lpush(recent, json.dumps(payload))
+        pipe.ltrim(recent, 0, length - 1)
+        pipe.execute()
+        return True
+
+    def forget(self, community_id):
+        self.r.delete(*self._keys(community_id))
+
+
+class LocalBuffers:
+    """The same buffers in this process, for when Redis isn't configured."""
+
+    def __init__(self):
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def recent(self, community_id):
+        with self._lock:
+            entries = self._buffers.get(community_id)
+            return list(entries) if entries is not None else None
+
+    def store(self, community_id, payloads, length):
+        with self._lock:
+            self._buffers[community_id] = deque(payloads, maxlen=length)
+
+    def push(self, community_id, payload, length):
+        with self._lock:
+            entries = self._buffers.get(community_id)
+            if entries is None:
+                return False
+            if entries.maxlen != length:
+                entries = self._buffers[community_id] = deque(entries, maxlen=length)
+            entries.appendleft(payload)
+            return True
+
+    def forget(self, community_id):
+        with self._lock:
+            self._buffers.pop(community_id, None)
+
+
+_local = LocalBuffers()
+
+
+def _store():
+    r = getattr(current_app, 'redis', None)
+    return RedisBuffers(r) if r else _local
+
+
+def _length():
+    return current_app.config.get('CHAT_RECENT_LENGTH', 100)
+
+
+def _messages(community_id):
+    return (db.session.query(ChatMessage.id, ChatMessage.author_id, User.name, ChatMessage.message,
+                             ChatMessage.created_at)
+            .join(User, User.id == ChatMessage.author_id)
+            .filter(ChatMessage.community_id == community_id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()))
+
+
+def _payloads(community_id, rows):
+    return [message_payload(community_id, *row) for row in rows]
+
+
+def _seed(community_id):
+    payloads = _payloads(community_id, _messages(community_id).limit(_length()))
+    _store().store(community_id, payloads, _length())
+    return payloads
+
+
+def recent(community_id):
+    """The newest messages of a community, oldest first."""
+    try:
+        payloads = _store().recent(community_id)
+        if payloads is None:
+            payloads = _seed(community_id)
+    except Exception:
+        current_app.logger.warning('Reading the chat buffer of community %s failed', community_id, exc_info=True)
+        payloads = _payloads(community_id, _messages(community_id).limit(_length()))
+    return payloads[::-1]
+
+
+def push(payload):
+    """Add a just-posted message (a `message_payload`) to its community's buffer."""
+    community_id = payload['community_id']
+    try:
+        if not _store().push(community_id, payload, _length()):
+            # the first message since the buffer was lost; it is already in the seed if it was written
+            if payload['id'] not in {seeded['id'] for seeded in _seed(community_id)}:
+                _store().push(community_id, payload, _length())
+    except Exception:
+        current_app.logger.warning('Updating the chat buffer of community %s failed', community_id, exc_info=True)
+
+
+def forget(community_id):
+    """Drop a community's buffer (e.g. after deleting the community)."""
+    _store().forget(community_id)
+
+
+def has_history(community_id, recent_payloads):
+    """Whether there are messages older than the buffered `recent_payloads` (oldest first)."""
+    return bool(recent_payloads) and (len(recent_payloads) >= _length()
+                                      or archive.has_segments('chat_message', community_id))
+
+
+def history(community_id, before, per_page=HISTORY_PAGE_SIZE):
+    """Messages older than the `before` cursor, oldest first, and the cursor for the ones before them (or None).
+
+    Raises `InvalidCursor` for a bad cursor.
+    """
+    page = archive.paginate('chat_message', ChatMessage.query.filter_by(community_id=community_id), community_id,
+                            per_page, after=before)
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_({m.author_id for m in page.items})))
+    payloads = [message_payload(community_id, m.id, m.author_id, names.get(m.author_id), m.message, m.created_at)
+                for m in page.items]
+    return payloads[::-1], page.next_cursor
@@ -0,0 +1,226 @@
+"""Write-behind view and download counters.
+
+`increment()` only bumps an in-memory tally (or a Redis hash when
+``app.redis`` is configured, so every worker process shares one buffer).
+A daemon thread flushes the tallies every ``COUNTER_FLUSH_INTERVAL``
+seconds as one ``UPDATE content SET view_count = view_count + n`` per
+content row in a single transaction, and again when the process exits.
+Counts shown on pages may therefore lag by up to one interval.
+
+Each buffer is written as soon as it has been taken, and put back if the
+write fails. The Redis hash is renamed to a ``:flushing:<ns>`` key that is
+only deleted once its counts are committed; keys older than
+``STALE_FLUSH_SECONDS`` were left by a process that died mid-flush, and
+are merged back into the live hash when the flusher starts (a death
+between the commit and the delete counts those increments twice).
+"""
+import atexit
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, func
+
+from models import db, Content
+
+# counter name -> Content column
+COUNTERS = {'view': 'view_count', 'download': 'download_count'}
+REDIS_KEY = 'counters:content:{}'
+FLUSHING_KEY = REDIS_KEY + ':flushing:{}'
+# no flush takes this long, so an older flushing key has no live owner
+STALE_FLUSH_SECONDS = 600
+
+counters_cli = AppGroup('counters', help='Inspect and flush buffered view/download counters.')
+
+_pending = {name: Counter() for name in COUNTERS}
+_lock = threading.Lock()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _redis():
+    return getattr(current_app, 'redis', None)
+
+
+def increment(name, content_id, amount=1):
+    """Record `amount` more views/downloads of a content item without touching the database."""
+    if name not in COUNTERS:
+        raise KeyError(f'Unknown counter {name!r}')
+    r = _redis()
+    if r:
+        try:
+            r.hincrby(REDIS_KEY.format(name), content_id, amount)
+            _ensure_flusher(current_app._get_current_object())
+            return
+        except Exception:
+            pass
+    with _lock:
+        _pending[name][content_id] += amount
+    _ensure_flusher(current_app._get_current_object())
+
+
+def _take_local(name):
+    with _lock:
+        taken = _pending[name]
+        _pending[name] = Counter()
+    return taken
+
+
+def _restore_local(name, counts):
+    with _lock:
+        _pending[name].update(counts)
+
+
+def _take_redis(r, name):
+    """Atomically move the shared hash aside so increments arriving meanwhile start a fresh one.
+
+    Returns the key it was moved to (None if nothing was buffered) and its counts; the caller
+    deletes the key once the counts are committed.
+    """
+    flushing = FLUSHING_KEY.format(name, time.time_ns())
+    try:
+        r.rename(REDIS_KEY.format(name), flushing)
+    except Exception:
+        # nothing buffered (RENAME fails on a missing key)
+        return None, Counter()
+    return flushing, Counter({int(k): int(v) for k, v in r.hgetall(flushing).items()})
+
+
+def _restore_redis(r, name, flushing, counts):
+    """Merge a taken hash back into the live one and drop it, in one transaction."""
+    pipe = r.pipeline()
+    for content_id, n in counts.items():
+        pipe.hincrby(REDIS_KEY.format(name), content_id, n)
+    pipe.delete(flushing)
+    pipe.execute()
+
+
+def recover_redis(r):
+    """Put back the counts of flushing keys left by processes that died mid-flush; returns how many."""
+    recovered = 0
+    cutoff = time.time_ns() - STALE_FLUSH_SECONDS * 10 ** 9
+    for name in COUNTERS:
+        for stale in list(r.scan_iter(match=FLUSHING_KEY.format(name, '*'))):
+            if int(stale.rsplit(':', 1)[1]) > cutoff:
+                continue
+            # claim it first, so two processes starting together don't both merge it
+            claimed = FLUSHING_KEY.format(name, time.time_ns())
+            try:
+                r.rename(stale, claimed)
+            except Exception:
+                continue
+            counts = Counter({int(k): int(v) for k, v in r.hgetall(claimed).items()})
+            _restore_redis(r, name, claimed, counts)
+            recovered += sum(counts.values())
+    return recovered
+
+
+def _apply(name, counts):
+    column = COUNTERS[name]
+    table = Content.__table__
+    stmt = table.update().where(table.c.id == bindparam('content_id')).values(
+        {column: func.coalesce(table.c[column], 0) + bindparam('amount')})
+    db.session.execute(stmt, [{'content_id': cid, 'amount': n} for cid, n in counts.items() if n])
+    db.session.commit()
+
+
+def flush():
+    """Write all buffered increments to the database; returns the number of increments written.
+
+    On failure the taken counts are put back into the buffer so they are retried.
+    """
+    written = 0
+    r = _redis()
+    for name in COUNTERS:
+        counts = _take_local(name)
+        if counts:
+            try:
+                _apply(name, counts)
+            except Exception:
+                db.session.rollback()
+                _restore_local(name, counts)
+                raise
+            written += sum(counts.values())
+        if not r:
+            continue
+        try:
+            flushing, counts = _take_redis(r, name)
+        except Exception:
+            current_app.logger.exception('Reading buffered %s counters from Redis failed', name)
+            continue
+        if flushing is None:
+            continue
+        if counts:
+            try:
+                _apply(name, counts)
+            except Exception:
+                db.session.rollback()
+                # if this fails too, the flushing key is recovered when a flusher next starts
+                _restore_redis(r, name, flushing, counts)
+                raise
+            written += sum(counts.values())
+        r.delete(flushing)
+    return written
+
+
+def pending_count():
+    """Increments buffered in this process (not counting Redis)."""
+    with _lock:
+        return sum(sum(c.values()) for c in _pending.values())
+
+
+def _recover(app):
+    r = getattr(app, 'redis', None)
+    if not r:
+        return
+    try:
+        recovered = recover_redis(r)
+    except Exception:
+        app.logger.exception('Recovering abandoned view/download counters from Redis failed')
+        return
+    if recovered:
+        app.logger.warning('Recovered %d view/download increments from an interrupted flush', recovered)
+
+
+def _flusher_main(app):
+    interval = app.config.get('COUNTER_FLUSH_INTERVAL', 5)
+    _recover(app)
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                app.logger.exception('Flushing view/download counters failed')
+            finally:
+                db.session.remove()
+
+
+def _flush_at_exit(app):
+    with app.app_context():
+        try:
+            flush()
+        except Exception:
+            app.logger.exception('Flushing view/download counters at shutdown failed')
+
+
+def _ensure_flusher(app):
+    global _thread
+    if _thread is not None or app.config.get('TESTING'):
+        return
+    with _thread_lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_flusher_main, args=(app,), name='counter-flusher', daemon=True)
+        _thread.start()
+        atexit.register(_flush_at_exit, app)
+
+
+@counters_cli.command('flush')
+def flush_command():
+    """Write buffered counters (including those of interrupted flushes) to the database now."""
+    _recover(current_app._get_current_object())
+    click.echo(f'Flushed {flush()} increments')
@@ -0,0 +1,86 @@
+"""Shared dashboard blocks, served from `services.cache`.
+
+Recent and popular content and the content stats are the same for every
+user, so they are built as plain dicts (one query per block) and cached
+for ``DASHBOARD_CACHE_TTL`` seconds; category counts come from the cached
+`services.categories` catalogue. Any commit that adds, changes or deletes
+a `Content` or `Category` through the ORM (upload, edit, delete, publish
+toggle, category admin) drops them; view and download counters are written in bulk outside
+the ORM, so popularity changes show up when the blocks expire.
+"""
+from flask import current_app
+from sqlalchemy import case, desc, event, func
+from sqlalchemy.orm import Session, joinedload
+
+from models import db, Category, Content
+from services import cache, categories
+
+KEYS = {
+    'recent_content': 'dashboard:recent',
+    'popular_content': 'dashboard:popular',
+    'stats': 'dashboard:stats',
+}
+
+
+def _card(content):
+    return {
+        'id': content.id,
+        'title': content.title,
+        'author': content.author,
+        'content_type': content.content_type,
+        'icon': content.get_type_icon(),
+        'category': {'id': content.category.id, 'name': content.category.name} if content.category else None,
+        'view_count': content.view_count or 0,
+        'created_at': content.created_at,
+    }
+
+
+def _listing(order_by):
+    return [_card(c) for c in Content.query.filter_by(is_public=True).options(joinedload(Content.category))
+            .order_by(desc(order_by)).limit(8)]
+
+
+def _stats():
+    total, pdfs, videos, audio = db.session.query(
+        func.count(Content.id),
+        func.sum(case((Content.content_type == 'pdf', 1), else_=0)),
+        func.sum(case((Content.content_type == 'video', 1), else_=0)),
+        func.sum(case((Content.content_type == 'audio', 1), else_=0)),
+    ).one()
+    return {'total_content': total, 'total_pdfs': pdfs or 0, 'total_videos': videos or 0, 'total_audio': audio or 0}
+
+
+BUILDERS = {
+    'recent_content': lambda: _listing(Content.created_at),
+    'popular_content': lambda: _listing(Content.view_count),
+    'stats': _stats,
+}
+
+
+def blocks():
+    """The shared dashboard template context: recent_content, popular_content, stats, categories."""
+    ttl = current_app.config.get('DASHBOARD_CACHE_TTL', 60)
+    context = {name: cache.cached(KEYS[name], BUILDERS[name], ttl) for name in KEYS}
+    context['categories'] = categories.catalogue()
+    return context
+
+
+def invalidate():
+    cache.delete(*KEYS.values())
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    if any(isinstance(obj, (Content, Category)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['dashboard_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('dashboard_stale', False):
+        invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('dashboard_stale', None)
@@ -0,0 +1,206 @@
+"""File delivery for library content.
+
+Answers conditional requests (If-None-Match / If-Modified-Since) from a
+single ``os.stat`` so a 304 never opens the file, and serves single and
+multi-part byte ranges (206) so players can seek without re-downloading.
+
+When ``FILE_DELIVERY_BACKEND`` is ``x-accel`` (nginx) or ``x-sendfile``
+(lighttpd / Apache mod_xsendfile) the bytes are not sent from Python at
+all: the view does its permission checks and logging, then hands the file
+back to the fronting server through an internal-redirect header.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request, send_file
+from werkzeug.http import is_resource_modified, parse_range_header
+
+CHUNK_SIZE = 64 * 1024
+# Requests asking for more ranges than this get the whole file instead;
+# it keeps a hostile Range header from turning one request into thousands of seeks.
+MAX_RANGES = 16
+
+
+class FileValidators:
+    """Stat-derived validators for a stored file."""
+
+    def __init__(self, path, size, mtime_ns, tag=None, digest=None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        prefix = f'{tag}-' if tag is not None else ''
+        # a content hash survives copies and restores; fall back to size + mtime
+        self.etag = f'{prefix}{digest}' if digest else f'{prefix}{size:x}-{mtime_ns:x}'
+        self.last_modified = datetime.fromtimestamp(mtime_ns // 1_000_000_000, tz=timezone.utc)
+
+
+def file_validators(path, tag=None, digest=None):
+    """Return `FileValidators` for `path`. Raises OSError if it is missing."""
+    st = os.stat(path)
+    return FileValidators(path, st.st_size, st.st_mtime_ns, tag=tag, digest=digest)
+
+
+def is_not_modified(validators):
+    """True when the client's cached copy (per request headers) is still current."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return not is_resource_modified(request.environ, etag=validators.etag,
+                                    last_modified=validators.last_modified)
+
+
+def is_continuation_request():
+    """True for range requests that do not start at byte zero (seeks / resumes)."""
+    rng = parse_range_header(request.headers.get('Range'))
+    if not rng or not rng.ranges:
+        return False
+    return rng.ranges[0][0] != 0
+
+
+def _apply_validators(resp, validators):
+    resp.set_etag(validators.etag)
+    resp.last_modified = validators.last_modified
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.cache_control.private = True
+    resp.cache_control.max_age = current_app.config.get('CONTENT_FILE_MAX_AGE', 0)
+    return resp
+
+
+def not_modified_response(validators):
+    return _apply_validators(Response(status=304), validators)
+
+
+def _if_range_matches(validators):
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == validators.etag
+    if if_range.date:
+        return validators.last_modified <= if_range.date
+    return True
+
+
+def _requested_ranges(validators):
+    """Return a list of (start, stop) byte ranges, [] if unsatisfiable, None to send everything."""
+    rng = parse_range_header(request.headers.get('Range'))
+    if not rng or rng.units != 'bytes' or not _if_range_matches(validators):
+        return None
+    size = validators.size
+    spans = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append((start, stop))
+    if len(spans) > MAX_RANGES:
+        return None
+    # merge overlapping / adjacent spans so each byte is sent once
+    spans.sort()
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _read_span(path, start, stop):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _multipart_body(path, spans, size, mimetype, boundary):
+    for start, stop in spans:
+        yield _part_header(boundary, mimetype, start, stop, size)
+        yield from _read_span(path, start, stop)
+    yield f'\r\n--{boundary}--\r\n'.encode('latin-1')
+
+
+def _part_header(boundary, mimetype, start, stop, size):
+    return (f'\r\n--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode('latin-1')
+
+
+def _set_disposition(resp, as_attachment, download_name):
+    if not as_attachment:
+        return
+    try:
+        download_name.encode('ascii')
+        resp.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    except UnicodeEncodeError:
+        resp.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+
+def _offloaded_response(backend, validators, mimetype, as_attachment, download_name):
+    """Build an empty response telling the front server which file to send, or None."""
+    path = os.path.abspath(validators.path)
+    resp = Response(status=200, mimetype=mimetype)
+    if backend == 'x-accel':
+        base = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+        if os.path.commonpath([base, path]) != base:
+            return None
+        prefix = current_app.config.get('FILE_DELIVERY_INTERNAL_PREFIX', '/_protected/')
+        rel = os.path.relpath(path, base).replace(os.sep, '/')
+        resp.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(rel)
+    else:
+        resp.headers['X-Sendfile'] = path
+    _set_disposition(resp, as_attachment, download_name)
+    return _apply_validators(resp, validators)
+
+
+def send_content_file(validators, mimetype=None, as_attachment=False, download_name=None):
+    """Send the file described by `validators`, honouring Range / If-Range.
+
+    Callers are expected to have answered conditional requests with
+    `is_not_modified` first so 304s never reach this point. With an
+    offloading backend configured the front server handles ranges itself.
+    """
+    path = validators.path
+    size = validators.size
+    download_name = download_name or os.path.basename(path)
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    backend = current_app.config.get('FILE_DELIVERY_BACKEND', 'python')
+    if backend in ('x-accel', 'x-sendfile'):
+        resp = _offloaded_response(backend, validators, mimetype, as_attachment, download_name)
+        if resp is not None:
+            return resp
+
+    spans = _requested_ranges(validators) if request.method in ('GET', 'HEAD') else None
+
+    if spans is None:
+        resp = send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=download_name, conditional=False, etag=False)
+        return _apply_validators(resp, validators)
+
+    if not spans:
+        resp = Response(status=416)
+        resp.headers['Content-Range'] = f'bytes */{size}'
+        return _apply_validators(resp, validators)
+
+    if len(spans) == 1:
+        start, stop = spans[0]
+        resp = Response(_read_span(path, start, stop), status=206, mimetype=mimetype, direct_passthrough=True)
+        resp.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        resp.content_length = stop - start
+    else:
+        boundary = os.urandom(12).hex()
+        length = sum(len(_part_header(boundary, mimetype, a, b, size)) + (b - a) for a, b in spans)
+        length += len(f'\r\n--{boundary}--\r\n')
+        resp = Response(_multipart_body(path, spans, size, mimetype, boundary), status=206,
+                        direct_passthrough=True)
+        resp.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+        resp.content_length = length
+    _set_disposition(resp, as_attachment, download_name)
+    return _apply_validators(resp, validators)
@@ -0,0 +1,108 @@
+"""Community feed assembly.
+
+A community's timeline is its non-deleted, unpinned posts newest first,
+paged with keyset cursors; pinned posts are listed separately above it.
+Posts come with their authors joined, and `attach_comments` loads the
+comments of a whole page in one query (or, for previews, the last few per
+post plus the counts in two), so the cost of a page doesn't grow with the
+number of posts or comments.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+
+from models import db, Comment, Post
+from services.pagination import keyset_paginate
+
+PAGE_SIZE = 20
+COMMENT_PREVIEW = 3
+
+
+def _posts(community_id):
+    return Post.query.filter_by(community_id=community_id, is_deleted=False).options(joinedload(Post.author))
+
+
+def pinned(community_id):
+    return _posts(community_id).filter_by(is_pinned=True).order_by(Post.created_at.desc(), Post.id.desc()).all()
+
+
+def timeline(community_id, per_page=PAGE_SIZE, after=None, before=None):
+    """A `KeysetPage` of the community's unpinned posts, newest first."""
+    return keyset_paginate(_posts(community_id).filter_by(is_pinned=False), Post.created_at, Post.id, per_page,
+                           after=after, before=before)
+
+
+def posts_since(community_id, post_id, limit=PAGE_SIZE):
+    """Unpinned posts newer than `post_id`, newest first."""
+    return (_posts(community_id).filter(Post.is_pinned == False, Post.id > post_id)
+            .order_by(Post.created_at.desc(), Post.id.desc()).limit(limit).all())
+
+
+def posts_by_id(community_id, post_ids):
+    return _posts(community_id).filter(Post.id.in_(post_ids)).order_by(Post.created_at.desc(), Post.id.desc()).all()
+
+
+def attach_comments(posts, preview=None):
+    """Set ``comments_list`` (oldest first) and ``comment_count`` on each post.
+
+    With `preview`, only the last `preview` comments of each post are loaded.
+    """
+    post_ids = [p.id for p in posts]
+    query = Comment.query.filter(Comment.post_id.in_(post_ids)).options(joinedload(Comment.author))
+    counts = None
+    if preview is not None and post_ids:
+        ranked = (select(Comment.id, func.row_number().over(
+            partition_by=Comment.post_id, order_by=(Comment.created_at.desc(), Comment.id.desc())).label('rank'))
+            .where(Comment.post_id.in_(post_ids)).subquery())
+        query = query.join(ranked, ranked.c.id == Comment.id).filter(ranked.c.rank <= preview)
+        counts = dict(db.session.query(Comment.post_id, func.count(Comment.id))
+                      .filter(Comment.post_id.in_(post_ids)).group_by(Comment.post_id))
+    comments = {}
+    if post_ids:
+        for c in query.order_by(Comment.created_at.asc(), Comment.id.asc()):
+            comments.setdefault(c.post_id, []).append(c)
+    for p in posts:
+        p.comments_list = comments.get(p.id, [])
+        p.comment_count = counts.get(p.id, 0) if counts is not None else len(p.comments_list)
+    return posts
+
+
+def _comment_payload(comment):
+    return {
+        'id': comment.id,
+        'author': {'id': comment.author_id, 'name': comment.author.name},
+        'body': comment.body,
+        'created_at': comment.created_at.isoformat() if comment.created_at else None,
+    }
+
+
+def post_payload(post):
+    """JSON-ready dict for a post that went through `attach_comments`."""
+    return {
+        'id': post.id,
+        'title': post.title,
+        'body': post.body,
+        'author': {'id': post.author_id, 'name': post.author.name},
+        'is_pinned': bool(post.is_pinned),
+        'created_at': post.created_at.isoformat() if post.created_at else None,
+        'updated_at': post.updated_at.isoformat() if post.updated_at else None,
+        'comment_count': post.comment_count,
+        'comments': [_comment_payload(c) for c in post.comments_list],
+    }
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def post_view(payload):
+    """A `post_payload` dict with the attributes the post card templates read from a `Post`."""
+    comments = [SimpleNamespace(id=c['id'], author=SimpleNamespace(**c['author']), body=c['body'],
+                                created_at=_timestamp(c['created_at'])) for c in payload['comments']]
+    return SimpleNamespace(id=payload['id'], title=payload['title'], body=payload['body'],
+                           author_id=payload['author']['id'], author=SimpleNamespace(**payload['author']),
+                           is_pinned=payload['is_pinned'], created_at=_timestamp(payload['created_at']),
+                           updated_at=_timestamp(payload['updated_at']), comment_count=payload['comment_count'],
+                           comments_list=comments)
@@ -0,0 +1,71 @@
+"""Cached user loader for Flask-Login.
+
+`load_user` runs on every authenticated request and Socket.IO event. It
+keeps each user's column values (never the password hash) in
+`services.cache` for ``USER_CACHE_TTL`` seconds and rebuilds the `User`
+from them without a query: the instance is merged into the session as
+already loaded, so relationships and the password hash still load lazily
+if a view needs them, and changes to it are saved as usual.
+
+Any commit that changes or deletes a user (profile edits, admin edits,
+role changes, deactivation, new photos) drops that user's entry.
+Deactivated users get None, which logs them out on their next request;
+without Redis other worker processes notice within the TTL.
+"""
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, User
+from services import cache
+
+CACHED_COLUMNS = [c.key for c in User.__table__.columns if c.key != 'password_hash']
+
+
+def _key(user_id):
+    return f'user:{user_id}'
+
+
+def _from_cache(data):
+    user = User(**data)
+    # treat the values as freshly loaded from the database
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_user(user_id):
+    """The active `User` with id `user_id`, or None."""
+    ttl = current_app.config.get('USER_CACHE_TTL', 60)
+    data = cache.get(_key(user_id)) if ttl else None
+    if data is not None:
+        user = _from_cache(data)
+    else:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        if ttl:
+            cache.set(_key(user_id), {key: getattr(user, key) for key in CACHED_COLUMNS}, ttl)
+    return user if user.is_active else None
+
+
+def invalidate(*user_ids):
+    cache.delete(*(_key(user_id) for user_id in user_ids))
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    changed = {obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault('users_changed', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    changed = session.info.pop('users_changed', None)
+    if changed:
+        invalidate(*changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('users_changed', None)
@@ -0,0 +1,112 @@
+"""Responsive image variants for profile and community photos.
+
+Originals are kept exactly as uploaded. The job worker decodes each photo
+once and writes downscaled WebP and JPEG copies at ``IMAGE_VARIANT_WIDTHS``
+into a ``variants/`` folder next to it; `User.profile_photo_path` and
+`Community.photo_path` pick the right one and fall back to the original
+until the variants exist. Needs Pillow; without it the job fails and is
+visible under /admin/jobs, while pages keep showing the original.
+"""
+import os
+
+from flask import current_app
+
+from models import db, Community, User, image_variant_name
+from services import jobs
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+READ_BLOCK = 64 * 1024
+
+# kind -> (model, upload sub-folder, photo column, variants column)
+PHOTO_KINDS = {
+    'community': (Community, 'communities', 'photo', 'photo_variants'),
+    'profile': (User, 'profiles', 'profile_photo', 'profile_photo_variants'),
+}
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def allowed_image(filename):
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def save_capped(stream, dest, max_bytes):
+    """Copy an upload stream to `dest` without ever holding more than one block in memory.
+
+    Raises `ImageTooLarge` (and removes the partial file) past `max_bytes`.
+    """
+    written = 0
+    with open(dest, 'wb') as out:
+        for block in iter(lambda: stream.read(READ_BLOCK), b''):
+            written += len(block)
+            if written > max_bytes:
+                break
+            out.write(block)
+    if written > max_bytes:
+        os.remove(dest)
+        raise ImageTooLarge(dest)
+    return written
+
+
+def build_variants(folder, filename):
+    """Write WebP and JPEG variants of uploads/<folder>/<filename>; returns the widths produced."""
+    from PIL import Image, ImageOps
+
+    widths = sorted(current_app.config.get('IMAGE_VARIANT_WIDTHS', (80, 160, 320, 640)), reverse=True)
+    base = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
+    os.makedirs(os.path.join(base, 'variants'), exist_ok=True)
+
+    with Image.open(os.path.join(base, filename)) as img:
+        # let the JPEG decoder skip detail we are about to throw away
+        img.draft('RGB', (widths[0], widths[0]))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        current = img
+        for width in widths:
+            if current.width > width:
+                # resize from the previous (larger) variant rather than the full-size original
+                current = current.resize((width, max(1, round(current.height * width / current.width))),
+                                         Image.LANCZOS)
+            current.save(os.path.join(base, image_variant_name(filename, width, 'webp')),
+                         'WEBP', quality=80, method=4)
+            current.convert('RGB').save(os.path.join(base, image_variant_name(filename, width, 'jpg')),
+                                        'JPEG', quality=82, optimize=True, progressive=True)
+    return sorted(widths)
+
+
+def remove_variants(folder, filename):
+    base = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
+    for width in current_app.config.get('IMAGE_VARIANT_WIDTHS', (80, 160, 320, 640)):
+        for fmt in ('webp', 'jpg'):
+            try:
+                os.remove(os.path.join(base, image_variant_name(filename, width, fmt)))
+            except OSError:
+                pass
+
+
+def _smallest_at_least(widths, width):
+    return next((w for w in widths if w >= width), widths[-1])
+
+
+@jobs.task('images.variants')
+def generate_variants(kind, object_id):
+    model, folder, photo_attr, variants_attr = PHOTO_KINDS[kind]
+    obj = db.session.get(model, object_id)
+    filename = getattr(obj, photo_attr) if obj else None
+    if not filename:
+        return
+    widths = build_variants(folder, filename)
+    # the photo may have been replaced while the job ran
+    db.session.refresh(obj)
+    if getattr(obj, photo_attr) != filename:
+        return
+    setattr(obj, variants_attr, ','.join(str(w) for w in widths))
+    if kind == 'community':
+        # keep the legacy thumbnail columns pointing at suitable variants
+        w, _ = current_app.config.get('COMMUNITY_PHOTO_THUMB_SIZE', (300, 300))
+        obj.photo_thumbnail = image_variant_name(filename, _smallest_at_least(widths, w), 'jpg')
+        obj.photo_thumbnail_2x = image_variant_name(filename, _smallest_at_least(widths, w * 2), 'jpg')
+    db.session.commit()
@@ -0,0 +1,229 @@
+"""Background jobs for work that should not hold up a request.
+
+Jobs are rows in the `job` table, so they survive restarts and need no
+broker; when ``app.redis`` is configured it is only used to wake workers
+up instead of polling. Jobs are picked up by:
+
+- ``flask jobs worker``, a separate process (recommended in production), or
+- an in-process daemon thread, started with the app (so jobs still queued
+  from a previous run are picked up) and on the first enqueue, when
+  ``JOBS_IN_PROCESS_WORKER`` is on (the default, so ``python app.py`` works
+  without extra setup). ``flask`` commands other than ``run`` don't start
+  it.
+
+Tests and scripts can call `run_pending()` to execute due jobs synchronously.
+Tasks are plain functions registered with `@task('name')`; failures are
+retried with exponential backoff up to the task's `max_attempts`.
+"""
+import json
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Job
+
+TASKS = {}
+WAKEUP_KEY = 'jobs:wakeup'
+
+jobs_cli = AppGroup('jobs', help='Run and inspect background jobs.')
+
+_wakeup = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def task(name, max_attempts=3):
+    """Register a function as the handler for jobs called `name`."""
+    def decorator(f):
+        TASKS[name] = (f, max_attempts)
+        return f
+    return decorator
+
+
+def enqueue(name, delay=0, **payload):
+    """Queue `name(**payload)`; the job is committed together with the caller's session."""
+    if name not in TASKS:
+        raise KeyError(f'Unknown job {name!r}')
+    job = Job(name=name, payload=json.dumps(payload), max_attempts=TASKS[name][1],
+              run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_workers(session):
+    if not session.info.pop('jobs_enqueued', False):
+        return
+    _wakeup.set()
+    if not has_app_context():
+        return
+    r = getattr(current_app, 'redis', None)
+    if r:
+        try:
+            r.lpush(WAKEUP_KEY, '1')
+            r.ltrim(WAKEUP_KEY, 0, 99)
+        except Exception:
+            pass
+    _ensure_in_process_worker(current_app._get_current_object())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+def _claim_next():
+    """Atomically move one due job from queued to running; returns it or None."""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(
+        Job.status == 'queued', Job.run_at <= now
+    ).order_by(Job.run_at, Job.id).limit(10).all()
+    for (job_id,) in candidates:
+        # the status guard makes the claim safe across concurrent workers
+        claimed = Job.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'started_at': now, 'attempts': Job.attempts + 1},
+            synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    db.session.rollback()
+    return None
+
+
+def _execute(job):
+    func_, _ = TASKS.get(job.name, (None, None))
+    job_id = job.id
+    try:
+        if func_ is None:
+            raise LookupError(f'No handler registered for job {job.name!r}')
+        func_(**json.loads(job.payload or '{}'))
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.last_error = traceback.format_exc(limit=5)
+        if job.attempts < job.max_attempts:
+            base = current_app.config.get('JOB_RETRY_BASE_SECONDS', 30)
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=base * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return False
+    job = db.session.get(Job, job_id)
+    job.status = 'done'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def requeue_stale():
+    """Put back jobs left 'running' by a worker that died mid-job."""
+    timeout = current_app.config.get('JOB_TIMEOUT_SECONDS', 900)
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+    count = Job.query.filter(Job.status == 'running', Job.started_at < cutoff).update(
+        {'status': 'queued', 'run_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def run_pending(limit=None):
+    """Run due jobs synchronously in this process; returns how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        job = _claim_next()
+        if job is None:
+            break
+        _execute(job)
+        ran += 1
+    return ran
+
+
+def _wait_for_work(timeout):
+    r = getattr(current_app, 'redis', None)
+    if r:
+        try:
+            r.blpop(WAKEUP_KEY, timeout=max(int(timeout), 1))
+            return
+        except Exception:
+            pass
+    _wakeup.wait(timeout)
+    _wakeup.clear()
+
+
+def run_worker(stop_event=None):
+    """Process jobs until `stop_event` is set (forever if None). Needs an app context."""
+    poll = current_app.config.get('JOB_POLL_INTERVAL', 2)
+    requeue_stale()
+    while stop_event is None or not stop_event.is_set():
+        try:
+            if not run_pending(limit=50):
+                _wait_for_work(poll)
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Job worker iteration failed')
+            _wait_for_work(poll)
+        finally:
+            db.session.remove()
+
+
+def _worker_thread_main(app):
+    with app.app_context():
+        run_worker()
+
+
+def _ensure_in_process_worker(app):
+    global _thread
+    if not app.config.get('JOBS_IN_PROCESS_WORKER') or app.config.get('TESTING'):
+        return
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_worker_thread_main, args=(app,), name='job-worker', daemon=True)
+        _thread.start()
+
+
+def init_app(app):
+    """Start the in-process worker if the app is being served (not loaded for another ``flask`` command)."""
+    command = click.get_current_context(silent=True)
+    if command is None or command.info_name == 'run':
+        _ensure_in_process_worker(app)
+
+
+def retry(job):
+    """Re-queue a failed job for immediate execution with a fresh attempt budget."""
+    job.status = 'queued'
+    job.attempts = 0
+    job.run_at = datetime.utcnow()
+    db.session.info['jobs_enqueued'] = True
+
+
+def status_counts():
+    return dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+
+
+@jobs_cli.command('worker')
+def worker_command():
+    """Run a job worker in the foreground."""
+    click.echo('Job worker started; press Ctrl+C to stop.')
+    run_worker()
+
+
+@jobs_cli.command('run')
+def run_command():
+    """Run every due job once and exit."""
+    click.echo(f'Ran {run_pending()} jobs')
+
+
+@jobs_cli.command('status')
+def status_command():
+    """Show job counts by status."""
+    for status, count in sorted(status_counts().items()):
+        click.echo(f'{status}: {count}')
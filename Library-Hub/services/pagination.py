@@ -0,0 +1,145 @@
+"""Keyset (cursor) pagination.
+
+Pages are addressed by an opaque, signed cursor holding the sort key and
+id of the last (``after=``) or first (``before=``) row of the neighbouring
+page, so fetching page N costs the same as page 1: an index range scan of
+``per_page + 1`` rows, with no OFFSET and no COUNT(*). Totals are only
+computed when asked for, either exactly or capped at
+``PAGINATION_COUNT_CAP`` rows.
+
+The sort key may be a model column or any labelled expression (e.g. a
+search rank); it is expected to be non-null (rows with a NULL sort key are
+skipped after the first page).
+"""
+from datetime import datetime
+
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, func, or_, select
+from werkzeug.exceptions import BadRequest
+
+COUNT_MODES = ('none', 'estimate', 'exact')
+
+
+class InvalidCursor(BadRequest):
+    description = 'Invalid pagination cursor.'
+
+
+class KeysetPage:
+    """One page of results plus the cursors for its neighbours."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_is_exact=True):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_exact = total_is_exact
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        data = {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+        }
+        if self.total is not None:
+            data['total'] = self.total
+            data['total_is_exact'] = self.total_is_exact
+        return data
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='pagination-cursor')
+
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime):
+        sort_value = {'dt': sort_value.isoformat()}
+    return _serializer().dumps([sort_value, row_id])
+
+
+def decode_cursor(token):
+    try:
+        sort_value, row_id = _serializer().loads(token)
+    except (BadSignature, TypeError, ValueError):
+        raise InvalidCursor()
+    if isinstance(sort_value, dict) and 'dt' in sort_value:
+        sort_value = datetime.fromisoformat(sort_value['dt'])
+    return sort_value, row_id
+
+
+def per_page_arg(default=20):
+    """`per_page` from the query string, clamped to 1..PAGINATION_MAX_PER_PAGE."""
+    per_page = request.args.get('per_page', default, type=int) or default
+    return max(1, min(per_page, current_app.config.get('PAGINATION_MAX_PER_PAGE', 100)))
+
+
+def count_mode_arg(default='none'):
+    mode = request.args.get('count', default)
+    return mode if mode in COUNT_MODES else default
+
+
+def _count(query, mode, id_column):
+    if mode == 'exact':
+        return query.order_by(None).count(), True
+    cap = current_app.config.get('PAGINATION_COUNT_CAP', 1000)
+    capped = query.order_by(None).with_entities(id_column).limit(cap + 1).subquery()
+    n = query.session.execute(select(func.count()).select_from(capped)).scalar()
+    return min(n, cap), n <= cap
+
+
+def keyset_paginate(query, sort_column, id_column, per_page, after=None, before=None, count='none'):
+    """Return a `KeysetPage` of `query` ordered by (`sort_column`, `id_column`) descending.
+
+    `after` / `before` are cursors from a previous page; raises `InvalidCursor` for a bad one.
+    """
+    page_query = query
+    reverse = False
+    if after:
+        value, row_id = decode_cursor(after)
+        page_query = page_query.filter(or_(sort_column < value, and_(sort_column == value, id_column < row_id)))
+    elif before:
+        value, row_id = decode_cursor(before)
+        page_query = page_query.filter(or_(sort_column > value, and_(sort_column == value, id_column > row_id)))
+        reverse = True
+    if reverse:
+        page_query = page_query.order_by(sort_column.asc(), id_column.asc())
+    else:
+        page_query = page_query.order_by(sort_column.desc(), id_column.desc())
+    # select the sort key alongside each row so the cursor can be built for computed keys too
+    rows = page_query.add_columns(sort_column).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor(row[1], getattr(row[0], id_column.key))
+
+    next_cursor = prev_cursor = None
+    if rows:
+        # walking backwards, there is always a next page (the one we came from)
+        if more or reverse:
+            next_cursor = cursor_for(rows[-1])
+        if (more and reverse) or after:
+            prev_cursor = cursor_for(rows[0])
+
+    total, exact = (None, True) if count == 'none' else _count(query, count, id_column)
+    return KeysetPage([row[0] for row in rows], per_page, next_cursor, prev_cursor, total, exact)
+
+
+def paginate_request(query, sort_column, id_column, default_per_page=20, default_count='none'):
+    """`keyset_paginate` driven by the ``after``, ``before``, ``per_page`` and ``count`` query args."""
+    return keyset_paginate(query, sort_column, id_column, per_page_arg(default_per_page),
+                           after=request.args.get('after'), before=request.args.get('before'),
+                           count=count_mode_arg(default_count))
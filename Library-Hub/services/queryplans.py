@@ -0,0 +1,169 @@
+"""Query-plan regression check for the hot query shapes.
+
+``flask queryplans check`` builds the schema from the models in a scratch
+in-memory SQLite database, runs ``EXPLAIN QUERY PLAN`` on each query below
+and exits non-zero if any of them reads a table with a full scan. Add an
+entry here whenever a new listing or lookup query lands on a hot path, and
+an index next to the model it filters.
+
+``flask queryplans requests`` counts the SQL statements that GET requests
+to some pages issue for a signed-in user, with and without the user cache.
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g
+from flask.cli import AppGroup
+from sqlalchemy import and_, create_engine, desc, event, func, or_, select, text
+
+from models import (db, ActivityLog, ArchiveSegment, ChatMessage, Comment, Content, Job, LiveSession, Membership, Notification, Post, User,
+                    content_tags)
+
+queryplans_cli = AppGroup('queryplans', help='Check that hot queries are served by indexes.')
+
+# name -> function building the query, shaped like the route that runs it
+HOT_QUERIES = {
+    'dashboard recent content': lambda: Content.query.filter_by(is_public=True)
+        .order_by(desc(Content.created_at)).limit(8),
+    'dashboard popular content': lambda: Content.query.filter_by(is_public=True)
+        .order_by(desc(Content.view_count)).limit(8),
+    'browse by category': lambda: Content.query.filter_by(is_public=True, category_id=1)
+        .order_by(desc(Content.created_at)).limit(12),
+    'browse by tag': lambda: Content.query.filter_by(is_public=True).filter(
+        Content.id.in_(select(content_tags.c.content_id).where(content_tags.c.tag_id == 1)))
+        .order_by(desc(Content.created_at)).limit(12),
+    'user activity history': lambda: ActivityLog.query.filter_by(user_id=1)
+        .order_by(desc(ActivityLog.timestamp)).limit(20),
+    'admin activity by action': lambda: ActivityLog.query.filter_by(action='view')
+        .order_by(desc(ActivityLog.timestamp)).limit(50),
+    'admin recent activity': lambda: ActivityLog.query.order_by(desc(ActivityLog.timestamp)).limit(20),
+    'activity for one day': lambda: db.session.query(func.count(ActivityLog.id)).filter(
+        ActivityLog.timestamp >= datetime(2026, 1, 1), ActivityLog.timestamp < datetime(2026, 1, 2)),
+    'activity for content': lambda: ActivityLog.query.filter_by(content_id=1),
+    'community timeline': lambda: Post.query.filter_by(community_id=1, is_deleted=False, is_pinned=False)
+        .order_by(Post.created_at.desc(), Post.id.desc()).limit(21),
+    'pinned posts': lambda: Post.query.filter_by(community_id=1, is_deleted=False, is_pinned=True)
+        .order_by(Post.created_at.desc(), Post.id.desc()),
+    'feed comments': lambda: Comment.query.filter(Comment.post_id.in_([1, 2, 3]))
+        .order_by(Comment.created_at.asc(), Comment.id.asc()),
+    'community members': lambda: Membership.query.filter_by(community_id=1)
+        .order_by(Membership.joined_at.desc(), Membership.id.desc()).limit(51),
+    'member posts': lambda: Post.query.filter_by(author_id=1, community_id=1)
+        .order_by(Post.created_at.desc()).limit(20),
+    'recent chat': lambda: ChatMessage.query.filter_by(community_id=1)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(100),
+    'chat history': lambda: ChatMessage.query.filter_by(community_id=1)
+        .filter(or_(ChatMessage.created_at < datetime(2026, 1, 1),
+                    and_(ChatMessage.created_at == datetime(2026, 1, 1), ChatMessage.id < 1)))
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(51),
+    'archive segments': lambda: ArchiveSegment.query.filter_by(table_name='chat_message', partition_key=1)
+        .filter(ArchiveSegment.first_at <= datetime(2026, 1, 1), ArchiveSegment.last_at >= datetime(2025, 1, 1))
+        .order_by(ArchiveSegment.last_at.desc(), ArchiveSegment.last_id.desc()),
+    'unread notifications': lambda: Notification.query.filter(
+        (Notification.recipient_id == 1) | (Notification.is_global == True)
+    ).filter_by(is_read=False).order_by(desc(Notification.created_at)).limit(5),
+    'recent live sessions': lambda: LiveSession.query.order_by(LiveSession.started_at.desc()).limit(20),
+    'due jobs': lambda: db.session.query(Job.id).filter(
+        Job.status == 'queued', Job.run_at <= datetime.utcnow() + timedelta(seconds=1)
+    ).order_by(Job.run_at, Job.id).limit(10),
+}
+
+
+def _scratch_engine():
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    return engine
+
+
+def explain(engine, query):
+    """Plan rows (the `detail` column) for a Flask-SQLAlchemy query on a SQLite engine."""
+    sql = query.statement.compile(engine, compile_kwargs={'literal_binds': True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    """Plan steps that read a whole table rather than an index ('SCAN post' vs 'SCAN post USING INDEX ...')."""
+    return [step for step in plan if step.startswith('SCAN ') and ' USING ' not in step]
+
+
+def check(show=False):
+    """Returns {name: [full-scan steps]} for every hot query that regressed."""
+    engine = _scratch_engine()
+    failures = {}
+    for name, build in HOT_QUERIES.items():
+        plan = explain(engine, build())
+        if show:
+            click.echo(f'{name}:')
+            for step in plan:
+                click.echo(f'    {step}')
+        scans = full_scans(plan)
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+@queryplans_cli.command('check')
+@click.option('--show', is_flag=True, help='Print every query plan.')
+def check_command(show):
+    """Fail if any hot query is planned as a full table scan."""
+    failures = check(show)
+    for name, scans in failures.items():
+        click.echo(f'FULL SCAN in {name!r}: {"; ".join(scans)}', err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo(f'{len(HOT_QUERIES)} query plans OK')
+
+
+def count_request_queries(paths, user, repeat=3):
+    """{path: statements per request} for warm GET requests to `paths` signed in as `user`."""
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    def get(path):
+        # requests made from a CLI share its app context: start each one with an
+        # empty identity map and without the user Flask-Login kept on `g`
+        db.session.remove()
+        g.pop('_login_user', None)
+        client.get(path)
+
+    results = {}
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        for path in paths:
+            get(path)
+            statements[0] = 0
+            for _ in range(repeat):
+                get(path)
+            results[path] = statements[0] / repeat
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return results
+
+
+@queryplans_cli.command('requests')
+@click.argument('paths', nargs=-1)
+@click.option('--email', help='Sign in as this user (default: the first admin).')
+def requests_command(paths, email):
+    """Count SQL statements per GET request, with and without the user cache."""
+    paths = paths or ('/dashboard', '/browse', '/categories', '/api/categories')
+    user = User.query.filter_by(email=email).first() if email else User.query.filter_by(role='admin').first()
+    if user is None:
+        raise click.ClickException('No such user')
+    ttl = current_app.config.get('USER_CACHE_TTL', 60)
+    try:
+        current_app.config['USER_CACHE_TTL'] = 0
+        uncached = count_request_queries(paths, user)
+        current_app.config['USER_CACHE_TTL'] = ttl or 60
+        cached = count_request_queries(paths, user)
+    finally:
+        current_app.config['USER_CACHE_TTL'] = ttl
+    for path in paths:
+        click.echo(f'{path:30} {uncached[path]:5.1f} queries without user cache, {cached[path]:5.1f} with')
@@ -0,0 +1,235 @@
+"""Resumable, chunked uploads.
+
+Protocol: create a session (filename, size, optional sha256), PUT the bytes
+in order with ``Content-Range: bytes start-end/total`` (or ``?offset=``),
+GET the session to learn where to resume after a dropped connection, then
+finalize. Chunk bodies are streamed from the request straight into
+``uploads/tmp/<id>.part``. Each session's file is locked exclusively while
+a chunk is checked and written (and while it is finalized), so concurrent
+PUTs of the same chunk can't both pass the offset check and append twice.
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, UploadSession
+from services import blobstore
+
+READ_BLOCK = 1024 * 1024
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are only serialized within this process
+    fcntl = None
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UploadError(Exception):
+    """A protocol violation; `code` is returned to the client with `status`."""
+
+    def __init__(self, code, status=400, **extra):
+        super().__init__(code)
+        self.code = code
+        self.status = status
+        self.extra = extra
+
+    def to_dict(self):
+        return dict({'error': self.code}, **self.extra)
+
+
+def _tmp_dir():
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def part_path(session):
+    return os.path.join(_tmp_dir(), f'{session.id}.part')
+
+
+def load_metadata(session):
+    return json.loads(session.upload_metadata) if session.upload_metadata else {}
+
+
+def session_status(session):
+    return {
+        'upload_id': session.id,
+        'offset': session.received_size or 0,
+        'size': session.total_size,
+        'chunk_size': current_app.config.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+    }
+
+
+def create_session(user_id, target, filename, total_size, checksum=None, content_type=None,
+                   live_session_id=None, metadata=None):
+    max_size = current_app.config.get('MAX_CONTENT_LENGTH')
+    if total_size <= 0:
+        raise UploadError('invalid-size')
+    if max_size and total_size > max_size:
+        raise UploadError('too-large', 413, max_size=max_size)
+    purge_stale_sessions()
+    session = UploadSession(
+        id=secrets.token_hex(16),
+        user_id=user_id,
+        target=target,
+        live_session_id=live_session_id,
+        filename=filename,
+        content_type=content_type,
+        total_size=total_size,
+        received_size=0,
+        checksum=checksum.lower() if checksum else None,
+        upload_metadata=json.dumps(metadata or {}),
+    )
+    open(part_path(session), 'wb').close()
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+
+def requested_offset(headers, args):
+    """Offset the client claims this chunk starts at, from Content-Range or ``?offset=``."""
+    content_range = headers.get('Content-Range')
+    if content_range:
+        m = _CONTENT_RANGE.match(content_range.strip())
+        if not m:
+            raise UploadError('invalid-content-range')
+        return int(m.group(1))
+    offset = args.get('offset', type=int)
+    if offset is None:
+        raise UploadError('offset-required')
+    return offset
+
+
+@contextmanager
+def _locked(session):
+    """Hold the session's exclusive lock and yield its part file (opened r+b) with the session refreshed."""
+    with open(part_path(session), 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            lock = None
+        else:
+            with _locks_guard:
+                lock = _locks.setdefault(session.id, threading.Lock())
+            lock.acquire()
+        try:
+            # another request may have moved the offset while we waited
+            db.session.refresh(session)
+            yield f
+        finally:
+            if lock is not None:
+                lock.release()
+
+
+def sync_offset(session):
+    """Clamp `received_size` to what actually reached disk (e.g. after a crash)."""
+    try:
+        on_disk = os.path.getsize(part_path(session))
+    except OSError:
+        on_disk = 0
+    if on_disk < (session.received_size or 0):
+        session.received_size = on_disk
+        db.session.commit()
+    return session.received_size
+
+
+def write_chunk(session, offset, stream):
+    """Append the request body at `offset`; returns the new offset.
+
+    Progress is committed even when the client disconnects mid-chunk, so
+    the next attempt resumes from the last byte that was written.
+    """
+    with _locked(session) as f:
+        received = sync_offset(session)
+        if offset != received:
+            raise UploadError('offset-mismatch', 409, offset=received)
+        remaining = session.total_size - offset
+        written = 0
+        try:
+            f.seek(offset)
+            f.truncate()
+            while True:
+                data = stream.read(READ_BLOCK)
+                if not data:
+                    break
+                if written + len(data) > remaining:
+                    raise UploadError('too-large', 413, offset=offset + written)
+                f.write(data)
+                written += len(data)
+            f.flush()
+        finally:
+            session.received_size = offset + written
+            db.session.commit()
+        return session.received_size
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def finalize(session, checksum=None):
+    """Verify the upload is complete and matches its checksum; returns the sha256 hex digest.
+
+    On a checksum mismatch the partial file is discarded and the session
+    restarts from offset 0.
+    """
+    with _locked(session) as f:
+        if sync_offset(session) != session.total_size:
+            raise UploadError('incomplete', 409, offset=session.received_size)
+        digest = _sha256_file(part_path(session))
+        expected = (checksum or session.checksum or '').lower()
+        if expected and expected != digest:
+            f.truncate(0)
+            session.received_size = 0
+            db.session.commit()
+            raise UploadError('checksum-mismatch', 422, offset=0)
+        return digest
+
+
+def store_as_blob(session, digest):
+    """Move the finished upload into the blob store and drop the session (committed by the caller).
+
+    Returns the acquired `Blob`; identical files already stored are shared.
+    """
+    blob = blobstore.store_file(part_path(session), digest)
+    _locks.pop(session.id, None)
+    db.session.delete(session)
+    return blob
+
+
+def abort_session(session):
+    _locks.pop(session.id, None)
+    try:
+        os.remove(part_path(session))
+    except OSError:
+        pass
+    db.session.delete(session)
+    db.session.commit()
+
+
+def purge_stale_sessions():
+    """Remove sessions (and their temp files) untouched for UPLOAD_SESSION_TTL_HOURS."""
+    hours = current_app.config.get('UPLOAD_SESSION_TTL_HOURS', 24)
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for session in stale:
+        try:
+            os.remove(part_path(session))
+        except OSError:
+            pass
+        db.session.delete(session)
+    if stale:
+        db.session.commit()
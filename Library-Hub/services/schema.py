@@ -0,0 +1,92 @@
+"""Database schema at startup.
+
+The schema is owned by the Alembic revisions in ``migrations/``
+(``flask db upgrade``). When the app starts, `init_app`:
+
+- builds an empty database from the models and stamps it with the newest
+  revision, so later revisions apply to it;
+- otherwise upgrades the database to the newest revision when
+  ``DB_AUTO_UPGRADE`` is on (the default, so ``python app.py`` keeps
+  working after a pull). Deployments running several processes should turn
+  it off and run ``flask db upgrade`` once before starting them.
+
+Databases created before the migrations could run have no revision, or
+one this tree doesn't have. They are stamped with the revision that
+matches their ``live_session`` table first, whether or not the app then
+upgrades them.
+
+`init_app` returns whether the schema is current. If it isn't, the app
+still loads, so ``flask db`` commands work, but startup work that reads
+the tables is skipped. ``flask db`` commands never upgrade implicitly.
+"""
+import os
+
+import click
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from alembic.util import CommandError
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect
+
+from models import db
+
+# revisions a pre-migration database's live_session table corresponds to
+LIVE_SESSION_REVISION = '20251228_add_live_session'
+LIVE_FIELDS_REVISION = '20251228_add_live_fields'
+
+
+def _directory(app):
+    return os.path.join(app.root_path, 'migrations')
+
+
+def _running_db_command():
+    command = click.get_current_context(silent=True)
+    while command is not None:
+        if command.info_name == 'db':
+            return True
+        command = command.parent
+    return False
+
+
+def _legacy_revision(conn):
+    """The revision a database without a known one matches, or None to upgrade from the start."""
+    inspector = inspect(conn)
+    if 'live_session' not in inspector.get_table_names():
+        return None
+    columns = {column['name'] for column in inspector.get_columns('live_session')}
+    return LIVE_FIELDS_REVISION if 'stream_key' in columns else LIVE_SESSION_REVISION
+
+
+def _known(script, revision):
+    try:
+        return script.get_revision(revision) is not None
+    except CommandError:
+        return False
+
+
+def init_app(app):
+    """Create, stamp or upgrade the database as described above; returns whether it is current.
+
+    Call inside an app context.
+    """
+    directory = _directory(app)
+    script = ScriptDirectory.from_config(app.extensions['migrate'].migrate.get_config(directory))
+    head = script.get_current_head()
+    with db.engine.connect() as conn:
+        tables = inspect(conn).get_table_names()
+        current = MigrationContext.configure(conn).get_current_revision()
+        legacy = _legacy_revision(conn)
+    if not tables:
+        db.create_all()
+        stamp(directory, head)
+        return True
+    if current == head:
+        return True
+    if current is None or not _known(script, current):
+        # only rewrites alembic_version, so `flask db upgrade` can start from it
+        stamp(directory, legacy or 'base', purge=True)
+    if _running_db_command() or not app.config.get('DB_AUTO_UPGRADE'):
+        app.logger.warning('The database is not at revision %s; run `flask db upgrade`', head)
+        return False
+    upgrade(directory)
+    return True
@@ -0,0 +1,396 @@
+"""Full-text search over the catalogue.
+
+Each `Content` row is indexed with its title, author, description, tag
+names and category name, and each `ContentPage` (text extracted from PDFs
+and EPUBs, see `services.textextract`) on its own:
+
+- SQLite: FTS5 tables ``content_fts`` (rowid = content id) and
+  ``content_page_fts`` (rowid = page id), porter stemming, ranked with
+  weighted bm25.
+- PostgreSQL: ``content_search`` / ``content_page_search`` tables holding a
+  ``tsvector`` per content / page behind GIN indexes, ranked with
+  ``ts_rank_cd``.
+
+A content item matches if its metadata or any one of its pages does; page
+matches count for ``BODY_WEIGHT`` of a metadata match, and
+`matching_pages` finds the best page to deep-link to.
+
+The index is updated in the same transaction as the change, from an
+``after_flush`` hook, whenever indexed fields, tags or a category name
+change, and rows are removed when content is deleted. On other databases
+search falls back to ILIKE. ``flask search reindex`` rebuilds the index and
+``flask search benchmark`` compares it with ILIKE on synthetic catalogues.
+"""
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import (bindparam, column, create_engine, delete, event, func, inspect, literal_column, or_, select,
+                        table, text, union_all)
+from sqlalchemy.orm import Session
+
+from models import db, Category, Content, ContentPage
+
+search_cli = AppGroup('search', help='Maintain and benchmark the full-text search index.')
+
+# fields whose change requires re-indexing a content row
+INDEXED_FIELDS = ('title', 'author', 'description', 'category_id', 'tags')
+# bm25 weights, in content_fts column order: title, author, description, tags, category
+BM25_WEIGHTS = (10.0, 4.0, 1.0, 4.0, 2.0)
+# score of a match in extracted document text relative to a metadata match
+BODY_WEIGHT = 0.5
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5("
+    "title, author, description, tags, category, tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS content_page_fts USING fts5("
+    "body, tokenize='porter unicode61 remove_diacritics 2')",
+]
+_POSTGRES_DDL = [
+    'CREATE TABLE IF NOT EXISTS content_search ('
+    'content_id INTEGER PRIMARY KEY REFERENCES content (id) ON DELETE CASCADE, '
+    'document TSVECTOR NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_content_search_document ON content_search USING GIN (document)',
+    'CREATE TABLE IF NOT EXISTS content_page_search ('
+    'page_id INTEGER PRIMARY KEY REFERENCES content_page (id) ON DELETE CASCADE, '
+    'document TSVECTOR NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_content_page_search_document ON content_page_search USING GIN (document)',
+]
+
+_DOCUMENT_SQL = {
+    'sqlite': (
+        "INSERT INTO content_fts (rowid, title, author, description, tags, category) "
+        "SELECT c.id, c.title, COALESCE(c.author, ''), COALESCE(c.description, ''), "
+        "COALESCE((SELECT group_concat(t.name, ' ') FROM content_tags ct JOIN tag t ON t.id = ct.tag_id "
+        "WHERE ct.content_id = c.id), ''), "
+        "COALESCE((SELECT cat.name FROM category cat WHERE cat.id = c.category_id), '') "
+        "FROM content c"
+    ),
+    'postgresql': (
+        "INSERT INTO content_search (content_id, document) "
+        "SELECT c.id, "
+        "setweight(to_tsvector('english', COALESCE(c.title, '')), 'A') || "
+        "setweight(to_tsvector('english', COALESCE(c.author, '')), 'B') || "
+        "setweight(to_tsvector('english', COALESCE((SELECT string_agg(t.name, ' ') FROM content_tags ct "
+        "JOIN tag t ON t.id = ct.tag_id WHERE ct.content_id = c.id), '')), 'B') || "
+        "setweight(to_tsvector('english', COALESCE((SELECT cat.name FROM category cat "
+        "WHERE cat.id = c.category_id), '')), 'C') || "
+        "setweight(to_tsvector('english', COALESCE(c.description, '')), 'D') "
+        "FROM content c"
+    ),
+}
+_DELETE_SQL = {
+    'sqlite': 'DELETE FROM content_fts',
+    'postgresql': 'DELETE FROM content_search',
+}
+_ID_COLUMN = {'sqlite': 'rowid', 'postgresql': 'content_id'}
+
+_PAGE_DOCUMENT_SQL = {
+    'sqlite': 'INSERT INTO content_page_fts (rowid, body) SELECT p.id, p.text FROM content_page p',
+    'postgresql': ("INSERT INTO content_page_search (page_id, document) "
+                   "SELECT p.id, to_tsvector('english', p.text) FROM content_page p"),
+}
+_PAGE_DELETE_SQL = {
+    'sqlite': 'DELETE FROM content_page_fts',
+    'postgresql': 'DELETE FROM content_page_search',
+}
+_PAGE_ID_COLUMN = {'sqlite': 'rowid', 'postgresql': 'page_id'}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def supported(dialect_name):
+    return dialect_name in _DOCUMENT_SQL
+
+
+def create_index(conn):
+    """Create the index structures for `conn`'s database if missing; returns True if they were created."""
+    name = conn.dialect.name
+    if not supported(name):
+        return False
+    tables = ('content_fts', 'content_page_fts') if name == 'sqlite' else ('content_search', 'content_page_search')
+    existed = all(inspect(conn).has_table(t) for t in tables)
+    for statement in _SQLITE_DDL if name == 'sqlite' else _POSTGRES_DDL:
+        conn.execute(text(statement))
+    return not existed
+
+
+def reindex(conn, ids=None):
+    """(Re)build index entries for content `ids`, or for everything when `ids` is None."""
+    name = conn.dialect.name
+    if ids is None:
+        conn.execute(text(_DELETE_SQL[name]))
+        conn.execute(text(_DOCUMENT_SQL[name]))
+        reindex_pages(conn)
+        return
+    ids = list(ids)
+    if not ids:
+        return
+    param = bindparam('ids', expanding=True)
+    conn.execute(text(f'{_DELETE_SQL[name]} WHERE {_ID_COLUMN[name]} IN :ids').bindparams(param), {'ids': ids})
+    conn.execute(text(f'{_DOCUMENT_SQL[name]} WHERE c.id IN :ids').bindparams(param), {'ids': ids})
+
+
+def reindex_pages(conn, content_ids=None):
+    """(Re)build the page index for content `content_ids`, or for every page when None."""
+    name = conn.dialect.name
+    if content_ids is None:
+        conn.execute(text(_PAGE_DELETE_SQL[name]))
+        conn.execute(text(_PAGE_DOCUMENT_SQL[name]))
+        return
+    content_ids = list(content_ids)
+    if not content_ids:
+        return
+    param = bindparam('ids', expanding=True)
+    conn.execute(text(f'{_PAGE_DELETE_SQL[name]} WHERE {_PAGE_ID_COLUMN[name]} IN '
+                      f'(SELECT id FROM content_page WHERE content_id IN :ids)').bindparams(param),
+                 {'ids': content_ids})
+    conn.execute(text(f'{_PAGE_DOCUMENT_SQL[name]} WHERE p.content_id IN :ids').bindparams(param),
+                 {'ids': content_ids})
+
+
+def remove_pages(conn, content_ids):
+    """Delete the extracted pages of `content_ids` and their index entries."""
+    content_ids = list(content_ids)
+    if not content_ids:
+        return
+    name = conn.dialect.name
+    if supported(name):
+        conn.execute(text(f'{_PAGE_DELETE_SQL[name]} WHERE {_PAGE_ID_COLUMN[name]} IN '
+                          f'(SELECT id FROM content_page WHERE content_id IN :ids)')
+                     .bindparams(bindparam('ids', expanding=True)), {'ids': content_ids})
+    conn.execute(delete(ContentPage).where(ContentPage.content_id.in_(content_ids)))
+
+
+def init_app(app):
+    """Create (and on first run, fill) the index; call inside an app context after `db.create_all()`."""
+    with db.engine.begin() as conn:
+        if not supported(conn.dialect.name):
+            app.extensions['search'] = None
+            return
+        if create_index(conn):
+            reindex(conn)
+    app.extensions['search'] = db.engine.dialect.name
+
+
+def _backend():
+    return current_app.extensions.get('search') if has_app_context() else None
+
+
+def _changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_index(session, flush_context):
+    # new/dirty/deleted still describe what this flush wrote
+    if not _backend():
+        removed = [obj.id for obj in session.deleted if isinstance(obj, Content)]
+        if removed:
+            remove_pages(session.connection(), removed)
+        return
+    stale, removed, categories = set(), set(), set()
+    for obj in session.new:
+        if isinstance(obj, Content):
+            stale.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Content) and _changed(obj):
+            stale.add(obj.id)
+        elif isinstance(obj, Category) and inspect(obj).attrs.name.history.has_changes():
+            categories.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Content):
+            removed.add(obj.id)
+        elif isinstance(obj, Category):
+            categories.add(obj.id)
+    if not (stale or removed or categories):
+        return
+    conn = session.connection()
+    if categories:
+        stale.update(conn.execute(select(Content.id).where(Content.category_id.in_(categories))).scalars())
+    if removed:
+        name = conn.dialect.name
+        conn.execute(text(f'{_DELETE_SQL[name]} WHERE {_ID_COLUMN[name]} IN :ids')
+                     .bindparams(bindparam('ids', expanding=True)), {'ids': list(removed)})
+        remove_pages(conn, removed)
+    reindex(conn, stale - removed)
+
+
+def _tokens(q):
+    return _TOKEN.findall(q.lower())[:12]
+
+
+def _page_matches(dialect_name, tokens):
+    """Select of (content_id, page_number, score) for pages matching all tokens."""
+    pages = ContentPage.__table__
+    if dialect_name == 'sqlite':
+        fts = literal_column('content_page_fts')
+        joined = table('content_page_fts').join(pages, pages.c.id == literal_column('content_page_fts.rowid'))
+        # the `rank` column (plain bm25) rather than bm25(), which SQLite rejects once this is aggregated
+        score = -literal_column('content_page_fts.rank')
+        return (select(pages.c.content_id, pages.c.page_number, score.label('score'))
+                .select_from(joined).where(fts.op('MATCH')(_fts_expression(tokens))))
+    search = table('content_page_search', column('page_id'), column('document'))
+    query = _tsquery(tokens)
+    return (select(pages.c.content_id, pages.c.page_number, func.ts_rank_cd(search.c.document, query).label('score'))
+            .select_from(search.join(pages, pages.c.id == search.c.page_id))
+            .where(search.c.document.op('@@')(query)))
+
+
+def _fts_expression(tokens):
+    return ' '.join(f'"{t}"' for t in tokens) + '*'
+
+
+def _tsquery(tokens):
+    return func.to_tsquery('english', ' & '.join(tokens) + ':*')
+
+
+def _match_subquery(dialect_name, tokens):
+    """Subquery of (content_id, score) for content whose metadata or one page matches all tokens.
+
+    The last token matches as a prefix.
+    """
+    if dialect_name == 'sqlite':
+        fts = literal_column('content_fts')
+        score = -func.bm25(fts, *BM25_WEIGHTS)
+        metadata = (select(literal_column('content_fts.rowid').label('content_id'), score.label('score'))
+                    .select_from(table('content_fts')).where(fts.op('MATCH')(_fts_expression(tokens))))
+    else:
+        search = table('content_search', column('content_id'), column('document'))
+        query = _tsquery(tokens)
+        metadata = (select(search.c.content_id, func.ts_rank_cd(search.c.document, query).label('score'))
+                    .where(search.c.document.op('@@')(query)))
+    pages = _page_matches(dialect_name, tokens).subquery()
+    body = (select(pages.c.content_id, (func.max(pages.c.score) * BODY_WEIGHT).label('score'))
+            .group_by(pages.c.content_id))
+    both = union_all(metadata, body).subquery()
+    return (select(both.c.content_id, func.sum(both.c.score).label('score'))
+            .group_by(both.c.content_id).subquery())
+
+
+def filter_query(query, q):
+    """Restrict a `Content` query to matches for `q`.
+
+    Returns ``(query, score)`` where `score` orders results by relevance (higher is better),
+    or is None when the database has no search index and ILIKE was used instead.
+    """
+    backend = _backend()
+    tokens = _tokens(q)
+    if not backend or not tokens:
+        like = f'%{q}%'
+        return query.filter(or_(Content.title.ilike(like), Content.author.ilike(like),
+                                Content.description.ilike(like))), None
+    matches = _match_subquery(backend, tokens)
+    return query.join(matches, matches.c.content_id == Content.id), matches.c.score
+
+
+def matching_pages(content_ids, q):
+    """{content_id: page_number} of the best-matching extracted page for each of `content_ids`."""
+    backend = _backend()
+    tokens = _tokens(q)
+    content_ids = list(content_ids)
+    if not backend or not tokens or not content_ids:
+        return {}
+    pages = _page_matches(backend, tokens).subquery()
+    rows = db.session.execute(select(pages.c.content_id, pages.c.page_number)
+                              .where(pages.c.content_id.in_(content_ids))
+                              .order_by(pages.c.score.desc(), pages.c.page_number))
+    best = {}
+    for content_id, page_number in rows:
+        best.setdefault(content_id, page_number)
+    return best
+
+
+def _synthetic_rows(n, rng, vocabulary, created_at):
+    # Zipf-like word frequencies, so there are both very common and rare terms
+    cum_weights, total = [], 0.0
+    for rank in range(len(vocabulary)):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+
+    def words(k):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=k))
+
+    for i in range(n):
+        yield {
+            'id': i + 1,
+            'title': words(rng.randint(3, 6)).title(),
+            'author': words(2).title(),
+            'description': words(40),
+            'content_type': 'pdf',
+            'file_path': f'{i}.pdf',
+            'uploaded_by': 1,
+            'is_public': True,
+            'view_count': 0,
+            'download_count': 0,
+            'created_at': created_at - timedelta(minutes=i),
+        }
+
+
+def _time(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+@search_cli.command('reindex')
+def reindex_command():
+    """Rebuild the search index from the content table."""
+    with db.engine.begin() as conn:
+        if not supported(conn.dialect.name):
+            click.echo(f'No search index for {conn.dialect.name}; ILIKE is used.')
+            return
+        create_index(conn)
+        reindex(conn)
+    click.echo(f'Indexed {Content.query.count()} content items')
+
+
+@search_cli.command('benchmark')
+@click.option('--rows', 'sizes', type=int, multiple=True, help='Catalogue sizes to test (default 10k, 100k, 1M).')
+@click.option('--repeat', type=int, default=5, help='Runs per query.')
+def benchmark_command(sizes, repeat):
+    """Compare ILIKE and FTS5 search times on scratch SQLite catalogues."""
+    sizes = sizes or (10000, 100000, 1000000)
+    rng = random.Random(42)
+    vocabulary = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(4, 9))) for _ in range(5000)]
+    # a very common word, a rare one, a prefix and a word that never occurs
+    terms = [vocabulary[0], vocabulary[3000], vocabulary[10][:3], 'qqqqzz']
+    content = Content.__table__
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            created_at = datetime.utcnow()
+            db.metadata.create_all(engine, tables=[content, Category.__table__, db.metadata.tables['tag'],
+                                                   db.metadata.tables['content_tags'], ContentPage.__table__])
+            build = time.perf_counter()
+            with engine.begin() as conn:
+                rows = _synthetic_rows(size, rng, vocabulary, created_at)
+                while True:
+                    batch = [row for _, row in zip(range(10000), rows)]
+                    if not batch:
+                        break
+                    conn.execute(content.insert(), batch)
+                create_index(conn)
+                reindex(conn)
+            click.echo(f'{size} rows (built in {time.perf_counter() - build:.1f}s)')
+            with engine.connect() as conn:
+                for term in terms:
+                    like = f'%{term}%'
+                    ilike = (select(content.c.id).where(content.c.is_public == True, or_(
+                        content.c.title.ilike(like), content.c.author.ilike(like), content.c.description.ilike(like)))
+                        .order_by(content.c.created_at.desc()).limit(20))
+                    matches = _match_subquery('sqlite', [term])
+                    fts = (select(content.c.id).join(matches, matches.c.content_id == content.c.id)
+                           .where(content.c.is_public == True).order_by(matches.c.score.desc()).limit(20))
+                    t_like = _time(lambda: conn.execute(ilike).all(), repeat)
+                    t_fts = _time(lambda: conn.execute(fts).all(), repeat)
+                    click.echo(f'  {term!r:14} ILIKE {t_like:9.2f} ms   FTS5 {t_fts:9.2f} ms')
+            engine.dispose()
@@ -0,0 +1,150 @@
+"""Per-connection context for the Socket.IO handlers.
+
+Chat events arrive many times a minute on every connection, so the
+handlers in `routes.community` don't resolve `current_user` or query
+memberships per event. On connect the user's name and community roles are
+loaded once into a `SocketContext` kept per ``request.sid``. Mutes are
+not cached here: they change from any process and expire on their own, so
+`routes.community` looks them up per message (one Redis TTL call).
+
+A commit that changes the user (deactivation included) or adds, changes
+or deletes one of their memberships marks their contexts stale, and the
+next event reloads them. Contexts live in the process holding the
+connection; with Redis the commit also bumps the user's generation
+counter there, which every event compares against (one GET), so other
+processes reload on their next event too. Without Redis, changes made by
+other processes, and bulk deletes that bypass the ORM anywhere, are picked
+up when a context is older than ``SOCKET_CONTEXT_TTL`` seconds.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Membership, User
+from services import identity
+
+
+class SocketContext:
+    """The signed-in user behind one Socket.IO connection."""
+
+    def __init__(self, sid, user_id):
+        self.sid = sid
+        self.user_id = user_id
+        self.name = None
+        self.active = False
+        self.roles = {}  # community_id -> role
+        self.rooms = set()  # communities joined on this connection
+        self.left = set()  # joined communities the user is no longer a member of
+        self.generation = None  # the user's generation in Redis when loaded
+        self.loaded_at = 0.0
+        self.stale = True
+
+    def load(self, generation=None):
+        self.generation = generation
+        user = identity.load_user(self.user_id)
+        self.active = user is not None
+        self.name = user.name if user else None
+        self.roles = dict(db.session.query(Membership.community_id, Membership.role)
+                          .filter_by(user_id=self.user_id)) if user else {}
+        self.left |= self.rooms - self.roles.keys()
+        self.rooms &= self.roles.keys()
+        self.loaded_at = time.monotonic()
+        self.stale = False
+
+    def role(self, community_id):
+        """The user's role in the community, or None if they aren't a member."""
+        return self.roles.get(community_id)
+
+
+_contexts = {}
+_lock = threading.Lock()
+
+
+def _generation_key(user_id):
+    return f'socket_user:{user_id}:generation'
+
+
+def _generation(user_id):
+    """The user's generation counter in Redis, or None without Redis."""
+    r = getattr(current_app, 'redis', None)
+    if r is None:
+        return None
+    try:
+        return r.get(_generation_key(user_id))
+    except Exception:
+        return None
+
+
+def connect(sid, user_id):
+    context = SocketContext(sid, user_id)
+    with _lock:
+        _contexts[sid] = context
+    return context
+
+
+def disconnect(sid):
+    with _lock:
+        _contexts.pop(sid, None)
+
+
+def get(sid):
+    """The up-to-date context of connection `sid`, or None if it isn't signed in or the user was deactivated."""
+    context = _contexts.get(sid)
+    if context is None:
+        return None
+    generation = _generation(context.user_id)
+    if (context.stale or generation != context.generation
+            or time.monotonic() - context.loaded_at > current_app.config.get('SOCKET_CONTEXT_TTL', 300)):
+        context.load(generation)
+    return context if context.active else None
+
+
+def _for_users(user_ids):
+    with _lock:
+        return [context for context in _contexts.values() if context.user_id in user_ids]
+
+
+def invalidate(*user_ids):
+    """Mark the users' contexts stale here, and in other processes through Redis."""
+    for context in _for_users(set(user_ids)):
+        context.stale = True
+    r = getattr(current_app, 'redis', None)
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for user_id in user_ids:
+            key = _generation_key(user_id)
+            pipe.incr(key)
+            # an expired counter reads as a change, so this only bounds how long idle keys stay
+            pipe.expire(key, 24 * 3600)
+        pipe.execute()
+    except Exception:
+        current_app.logger.exception('Could not publish socket context invalidation')
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    changed = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Membership):
+            changed.add(obj.user_id)
+        elif isinstance(obj, User):
+            changed.add(obj.id)
+    if changed:
+        session.info.setdefault('socket_users_changed', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    changed = session.info.pop('socket_users_changed', None)
+    if changed:
+        invalidate(*changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('socket_users_changed', None)
@@ -0,0 +1,224 @@
+"""In-memory typeahead suggestions for public content.
+
+Every word position of a title, the author's name and each tag name is
+stored as a normalised key in one sorted list, so a prefix lookup is two
+bisects plus a short scan; no database access happens on the request path.
+
+The index is built when the app starts and patched after each commit that
+touches `Content` in this process. Other worker processes pick changes up
+within ``SUGGEST_SYNC_INTERVAL`` seconds: a lookup that finds the index
+older than that first applies rows whose ``updated_at`` moved on, and
+rebuilds from scratch if the number of public items no longer matches
+(e.g. after a delete elsewhere).
+
+`SuggestionIndex.version` is a digest of the indexed rows (the XOR of a
+hash per row, kept up to date as rows are put and removed), so workers
+holding the same data report the same version whatever order they
+applied it in.
+"""
+import bisect
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Content, Tag, content_tags
+
+# weight of a match by where the prefix was found
+TITLE_START, TITLE_WORD, AUTHOR, TAG = 3, 2, 1, 1
+SCAN_LIMIT = 256
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(_WORD.findall(text.lower()))
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self._keys = []       # sorted [(key, content_id, weight)]
+        self._items = {}      # content_id -> (title, author, content_type, popularity, [keys], digest)
+        self._digest = 0
+        self._lock = threading.Lock()
+        self.synced_at = None
+        self.checked_at = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def version(self):
+        return f'{self._digest:016x}'
+
+    @staticmethod
+    def _row_digest(row):
+        return int.from_bytes(hashlib.sha1(repr(row).encode('utf-8')).digest()[:8], 'big')
+
+    @staticmethod
+    def _keys_for(content_id, title, author, tags):
+        keys = []
+        words = normalize(title).split()
+        for i in range(len(words)):
+            keys.append((' '.join(words[i:]), content_id, TITLE_START if i == 0 else TITLE_WORD))
+        for name in [author] + list(tags):
+            if not name:
+                continue
+            words = normalize(name).split()
+            weight = AUTHOR if name is author else TAG
+            for i in range(len(words)):
+                keys.append((' '.join(words[i:]), content_id, weight))
+        return keys
+
+    def _remove_locked(self, content_id):
+        item = self._items.pop(content_id, None)
+        if item is None:
+            return
+        self._digest ^= item[5]
+        for key in item[4]:
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def _put_locked(self, row):
+        content_id, title, author, content_type, popularity, tags = row
+        self._remove_locked(content_id)
+        keys = self._keys_for(content_id, title, author, tags)
+        for key in keys:
+            bisect.insort(self._keys, key)
+        digest = self._row_digest((content_id, title, author, content_type, popularity or 0, sorted(tags)))
+        self._items[content_id] = (title, author, content_type, popularity or 0, keys, digest)
+        self._digest ^= digest
+
+    def replace(self, rows):
+        """Swap in a freshly built index from (id, title, author, type, popularity, tags) rows."""
+        fresh = SuggestionIndex()
+        for content_id, title, author, content_type, popularity, tags in rows:
+            keys = self._keys_for(content_id, title, author, tags)
+            fresh._keys.extend(keys)
+            digest = self._row_digest((content_id, title, author, content_type, popularity or 0, sorted(tags)))
+            fresh._items[content_id] = (title, author, content_type, popularity or 0, keys, digest)
+            fresh._digest ^= digest
+        fresh._keys.sort()
+        with self._lock:
+            self._keys, self._items, self._digest = fresh._keys, fresh._items, fresh._digest
+
+    def apply(self, upserts=(), removals=()):
+        with self._lock:
+            for content_id in removals:
+                self._remove_locked(content_id)
+            for row in upserts:
+                self._put_locked(row)
+
+    def lookup(self, prefix, limit=8):
+        """[(id, title, author, type)] best matches for a normalised `prefix`."""
+        keys = self._keys
+        start = bisect.bisect_left(keys, (prefix,))
+        end = bisect.bisect_left(keys, (prefix + '\uffff',), start, min(len(keys), start + SCAN_LIMIT))
+        best = {}
+        for _, content_id, weight in keys[start:end]:
+            if weight > best.get(content_id, 0):
+                best[content_id] = weight
+        items = self._items
+        ranked = sorted((cid for cid in best if cid in items),
+                        key=lambda cid: (-best[cid], -items[cid][3], cid))[:limit]
+        return [(cid,) + items[cid][:3] for cid in ranked]
+
+
+index = SuggestionIndex()
+
+
+def _tag_names(ids=None):
+    query = db.session.query(content_tags.c.content_id, Tag.name).join(Tag, Tag.id == content_tags.c.tag_id)
+    if ids is not None:
+        query = query.filter(content_tags.c.content_id.in_(ids))
+    names = {}
+    for content_id, name in query:
+        names.setdefault(content_id, []).append(name)
+    return names
+
+
+def _public_rows(query):
+    rows = query.with_entities(Content.id, Content.title, Content.author, Content.content_type,
+                               Content.view_count).all()
+    tags = _tag_names([r[0] for r in rows]) if len(rows) < 500 else _tag_names()
+    return [tuple(r) + (tags.get(r[0], []),) for r in rows]
+
+
+def rebuild():
+    started = datetime.utcnow()
+    index.replace(_public_rows(Content.query.filter(Content.is_public == True)))
+    index.synced_at = started
+    index.checked_at = time.monotonic()
+
+
+def _sync_if_stale():
+    interval = current_app.config.get('SUGGEST_SYNC_INTERVAL', 30)
+    if index.synced_at is None:
+        rebuild()
+        return
+    if time.monotonic() - index.checked_at < interval:
+        return
+    index.checked_at = time.monotonic()
+    started = datetime.utcnow()
+    changed = Content.query.filter(Content.updated_at >= index.synced_at)
+    rows = changed.with_entities(Content.id, Content.is_public).all()
+    public_ids = [cid for cid, is_public in rows if is_public]
+    upserts = _public_rows(Content.query.filter(Content.id.in_(public_ids))) if public_ids else []
+    index.apply(upserts, [cid for cid, is_public in rows if not is_public])
+    index.synced_at = started
+    public_total = Content.query.filter(Content.is_public == True).with_entities(func.count(Content.id)).scalar()
+    if public_total != len(index):
+        rebuild()
+
+
+def suggest(q, limit=8):
+    prefix = normalize(q)
+    if len(prefix) < 2:
+        return prefix, []
+    _sync_if_stale()
+    return prefix, index.lookup(prefix, limit)
+
+
+def init_app(app):
+    """Build the index; call inside an app context once the tables exist."""
+    rebuild()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault('suggest_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Content):
+            if obj.is_public:
+                pending[obj.id] = (obj.id, obj.title, obj.author, obj.content_type, obj.view_count,
+                                   [t.name for t in obj.tags])
+            else:
+                pending[obj.id] = None
+    for obj in session.deleted:
+        if isinstance(obj, Content):
+            pending[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop('suggest_changes', None)
+    if pending and index.synced_at is not None:
+        index.apply([row for row in pending.values() if row],
+                    [cid for cid, row in pending.items() if row is None])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('suggest_changes', None)
@@ -0,0 +1,213 @@
+"""Text extraction from uploaded PDFs and EPUBs for full-text search.
+
+Uploading a PDF or EPUB queues a ``content.extract_text`` job. The job
+hands the file to a process pool of ``TEXT_EXTRACT_PROCESSES`` workers, so
+parsing never blocks a request, runs beside the job worker rather than
+under its GIL, and a crashing parser only takes down a pool process. The
+worker reads the file page by page (PDF pages through pypdf, which seeks
+in the open file; EPUB chapters one zip member at a time) and returns the
+text per page, capped at ``TEXT_EXTRACT_MAX_CHARS`` per document. Pages are
+stored as `ContentPage` rows and indexed by `services.search`.
+
+PDF extraction uses pypdf (a project dependency); if it is missing the job
+fails and is visible under /admin/jobs. ``flask search extract`` backfills
+existing uploads.
+"""
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from html.parser import HTMLParser
+from urllib.parse import unquote
+
+import click
+from flask import current_app
+from sqlalchemy import insert, select
+
+from models import db, Content, ContentPage
+from services import blobstore, jobs, search
+from services.search import search_cli
+
+EXTRACT_JOB = 'content.extract_text'
+EXTRACTABLE_TYPES = ('pdf', 'ebook')
+
+_CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+_OPF_NS = '{http://www.idpf.org/2007/opf}'
+
+_pool = None
+
+
+class _TextCollector(HTMLParser):
+    SKIP = ('script', 'style', 'head')
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def _html_text(data):
+    collector = _TextCollector()
+    collector.feed(data.decode('utf-8', errors='replace'))
+    collector.close()
+    return ' '.join(collector.parts)
+
+
+def iter_pdf_pages(path):
+    from pypdf import PdfReader
+
+    # pass an open file: given a path, PdfReader reads the whole file into memory
+    with open(path, 'rb') as f:
+        for page in PdfReader(f).pages:
+            yield page.extract_text() or ''
+
+
+def _epub_spine(archive):
+    try:
+        container = ET.fromstring(archive.read('META-INF/container.xml'))
+        opf_path = container.find(f'.//{_CONTAINER_NS}rootfile').get('full-path')
+        opf = ET.fromstring(archive.read(opf_path))
+    except (KeyError, AttributeError, ET.ParseError):
+        # no usable package document: fall back to the HTML files in name order
+        return sorted(n for n in archive.namelist() if n.lower().endswith(('.xhtml', '.html', '.htm')))
+    base = posixpath.dirname(opf_path)
+    manifest = {item.get('id'): item.get('href') for item in opf.iter(f'{_OPF_NS}item')}
+    names = []
+    for ref in opf.iter(f'{_OPF_NS}itemref'):
+        href = manifest.get(ref.get('idref'))
+        if href:
+            names.append(posixpath.normpath(posixpath.join(base, unquote(href.split('#')[0]))))
+    return names
+
+
+def iter_epub_pages(path):
+    """Text of each spine document (chapter) of an EPUB, in reading order."""
+    with zipfile.ZipFile(path) as archive:
+        for name in _epub_spine(archive):
+            try:
+                data = archive.read(name)
+            except KeyError:
+                continue
+            yield _html_text(data)
+
+
+PAGE_READERS = {'.pdf': iter_pdf_pages, '.epub': iter_epub_pages}
+
+
+def _extension(content):
+    # blobs are stored without an extension, so go by the uploaded name
+    return os.path.splitext(content.file_path or '')[1].lower()
+
+
+def extractable(content):
+    return content.content_type in EXTRACTABLE_TYPES and _extension(content) in PAGE_READERS
+
+
+def extract_pages(path, extension, max_chars):
+    """Whitespace-normalised text per page of the PDF/EPUB at `path`. Runs in a pool process."""
+    pages, total = [], 0
+    for page in PAGE_READERS[extension](path):
+        page = ' '.join(page.split())[:max_chars - total]
+        pages.append(page)
+        total += len(page)
+        if total >= max_chars:
+            break
+    return pages
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=current_app.config.get('TEXT_EXTRACT_PROCESSES', 2))
+    return _pool
+
+
+def _reset_executor():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+def _submit(content):
+    return _executor().submit(extract_pages, blobstore.content_path(content), _extension(content),
+                              current_app.config.get('TEXT_EXTRACT_MAX_CHARS', 2000000))
+
+
+def store_pages(content_id, pages):
+    """Replace the stored pages of `content_id` and re-index them; the caller commits."""
+    conn = db.session.connection()
+    search.remove_pages(conn, [content_id])
+    rows, offset = [], 0
+    for number, page in enumerate(pages, 1):
+        rows.append({'content_id': content_id, 'page_number': number, 'start_offset': offset, 'text': page})
+        offset += len(page) + 1
+    if rows:
+        db.session.execute(insert(ContentPage), rows)
+        if current_app.extensions.get('search'):
+            search.reindex_pages(conn, [content_id])
+
+
+def queue_extraction(content):
+    """Queue text extraction for `content` if it is a PDF/EPUB; commits with the caller's session."""
+    if extractable(content):
+        jobs.enqueue(EXTRACT_JOB, content_id=content.id)
+
+
+@jobs.task(EXTRACT_JOB)
+def extract_content_text(content_id):
+    content = db.session.get(Content, content_id)
+    if content is None or not extractable(content):
+        return
+    try:
+        pages = _submit(content).result(timeout=current_app.config.get('TEXT_EXTRACT_TIMEOUT', 300))
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+    store_pages(content_id, pages)
+    db.session.commit()
+
+
+@search_cli.command('extract')
+@click.option('--all', 'everything', is_flag=True, help='Re-extract documents that already have text.')
+def extract_command(everything):
+    """Extract text from PDF/EPUB uploads into the search index."""
+    query = Content.query.filter(Content.content_type.in_(EXTRACTABLE_TYPES))
+    if not everything:
+        query = query.filter(~select(ContentPage.id).where(ContentPage.content_id == Content.id).exists())
+    todo = [c for c in query.order_by(Content.id) if extractable(c)]
+    # keep at most two documents per pool process in flight
+    limit = 2 * current_app.config.get('TEXT_EXTRACT_PROCESSES', 2)
+    pending, done, failed = {}, 0, 0
+    while todo or pending:
+        while todo and len(pending) < limit:
+            content = todo.pop(0)
+            pending[_submit(content)] = content.id
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            content_id = pending.pop(future)
+            try:
+                store_pages(content_id, future.result())
+                db.session.commit()
+                done += 1
+            except Exception as e:
+                db.session.rollback()
+                if isinstance(e, BrokenProcessPool):
+                    _reset_executor()
+                failed += 1
+                click.echo(f'content {content_id}: {e!r}', err=True)
+    click.echo(f'Extracted text from {done} documents ({failed} failed)')
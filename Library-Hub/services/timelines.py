@@ -0,0 +1,409 @@
+"""Fan-out-on-write cache of community timelines.
+
+Once a community's timeline is cached, reading a page of it (the posts
+API) costs no SQL: its newest ``FEED_TIMELINE_LENGTH`` unpinned post ids
+are kept in a sorted set scored by creation time, its pinned post ids in
+another, and each post's JSON payload (with comment previews) in
+`services.cache`. Committed changes are applied through session hooks as
+they are written: a new post is added to its community's timeline,
+pinning, unpinning and deleting move or remove it, and any change to a
+post or its comments drops its payload, which is rebuilt on the next read.
+
+A timeline is loaded on its first read. Every placement bumps the
+community's version counter, even while no timeline is cached, and a load
+reads the counter before its snapshot of the database and again once it
+has stored the timeline. A change means a post was committed after the
+snapshot and was placed before the timeline existed, so the load is
+repeated. After ``BUILD_ATTEMPTS`` tries the timeline is dropped instead.
+
+With ``app.redis`` the timelines live in Redis and every worker shares
+them; otherwise each process keeps its own in memory and sees other
+processes' writes once its copy expires after ``FEED_CACHE_TTL`` seconds.
+Pages past the cached window, ``before=`` cursors and cursors for posts no
+longer in the timeline are read from the database, as is everything when
+Redis fails. ``flask feed rebuild`` rebuilds the cache and ``flask feed
+benchmark`` compares cached and database reads under concurrent readers.
+"""
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, Comment, Community, Post
+from services import cache, feed
+from services.pagination import KeysetPage, decode_cursor, encode_cursor
+
+feed_cli = AppGroup('feed', help='Maintain and benchmark the community timeline cache.')
+
+EPOCH = datetime(1970, 1, 1)
+BUILD_ATTEMPTS = 3
+
+
+def score(created_at):
+    """Sort score for a post: its creation time in microseconds (exact in a Redis double)."""
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def _payload_key(post_id):
+    return f'feed:post:{post_id}'
+
+
+class RedisTimelines:
+    """Timelines in Redis sorted sets; members are zero-padded ids so equal scores sort by id."""
+
+    def __init__(self, r):
+        self.r = r
+
+    @staticmethod
+    def _keys(community_id):
+        return tuple(f'feed:{community_id}:{name}' for name in ('meta', 'timeline', 'pinned'))
+
+    @staticmethod
+    def _version_key(community_id):
+        # kept apart from the timeline keys, which `store` replaces
+        return f'feed:{community_id}:version'
+
+    @staticmethod
+    def _member(post_id):
+        return f'{post_id:012d}'
+
+    def version(self, community_id):
+        return self.r.get(self._version_key(community_id))
+
+    def store(self, community_id, timeline, pinned, complete, ttl):
+        meta, timeline_key, pinned_key = keys = self._keys(community_id)
+        pipe = self.r.pipeline()
+        pipe.delete(*keys)
+        if timeline:
+            pipe.zadd(timeline_key, {self._member(post_id): s for post_id, s in timeline})
+        if pinned:
+            pipe.zadd(pinned_key, {self._member(post_id): s for post_id, s in pinned})
+        pipe.hset(meta, 'complete', int(complete))
+        for key in keys:
+            pipe.expire(key, ttl)
+        pipe.execute()
+
+    def page(self, community_id, after_id, count, with_pinned):
+        meta, timeline_key, pinned_key = self._keys(community_id)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hget(meta, 'complete')
+        if after_id is None:
+            pipe.zrevrange(timeline_key, 0, count)
+        else:
+            pipe.zrevrank(timeline_key, self._member(after_id))
+        if with_pinned:
+            pipe.zrevrange(pinned_key, 0, -1)
+        complete, result, *pinned = pipe.execute()
+        pinned = pinned[0] if pinned else []
+        if complete is None:
+            return None
+        if after_id is None:
+            ids = result
+        elif result is None:
+            return {'found': False}
+        else:
+            ids = self.r.zrevrange(timeline_key, result + 1, result + 1 + count)
+        return {'found': True, 'complete': complete == '1', 'ids': [int(i) for i in ids],
+                'pinned': [int(i) for i in pinned]}
+
+    def place(self, community_id, post_id, s, pinned, length, ttl):
+        meta, timeline_key, pinned_key = self._keys(community_id)
+        version = self._version_key(community_id)
+        pipe = self.r.pipeline()
+        pipe.incr(version)
+        pipe.expire(version, ttl)
+        pipe.exists(meta)
+        if not pipe.execute()[-1]:
+            return
+        member = self._member(post_id)
+        pipe = self.r.pipeline()
+        pipe.zrem(timeline_key, member)
+        pipe.zrem(pinned_key, member)
+        if s is not None:
+            pipe.zadd(pinned_key if pinned else timeline_key, {member: s})
+            # keep the newest `length` posts; the rest are read from the database
+            pipe.zremrangebyrank(timeline_key, 0, -(length + 1))
+        trimmed = pipe.execute()[-1] if s is not None else 0
+        if trimmed:
+            self.r.hset(meta, 'complete', 0)
+
+    def forget(self, community_id):
+        self.r.delete(*self._keys(community_id))
+
+
+class _LocalTimeline:
+    def __init__(self, timeline, pinned, complete, expires):
+        self.keys = sorted((s, post_id) for post_id, s in timeline)  # oldest first
+        self.scores = dict(timeline)
+        self.pinned = dict(pinned)
+        self.complete = complete
+        self.expires = expires
+
+
+class LocalTimelines:
+    """The same structures in this process, for when Redis isn't configured."""
+
+    def __init__(self):
+        self._timelines = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _get(self, community_id):
+        entry = self._timelines.get(community_id)
+        if entry is not None and entry.expires < time.monotonic():
+            del self._timelines[community_id]
+            return None
+        return entry
+
+    def store(self, community_id, timeline, pinned, complete, ttl):
+        with self._lock:
+            self._timelines[community_id] = _LocalTimeline(timeline, pinned, complete, time.monotonic() + ttl)
+
+    def version(self, community_id):
+        with self._lock:
+            return self._versions.get(community_id, 0)
+
+    def page(self, community_id, after_id, count, with_pinned):
+        with self._lock:
+            entry = self._get(community_id)
+            if entry is None:
+                return None
+            end = len(entry.keys)
+            if after_id is not None:
+                if after_id not in entry.scores:
+                    return {'found': False}
+                end = bisect.bisect_left(entry.keys, (entry.scores[after_id], after_id))
+            ids = [post_id for _, post_id in reversed(entry.keys[max(0, end - count - 1):end])]
+            pinned = sorted(entry.pinned, key=lambda post_id: (entry.pinned[post_id], post_id),
+                            reverse=True) if with_pinned else []
+            return {'found': True, 'complete': entry.complete, 'ids': ids, 'pinned': pinned}
+
+    def place(self, community_id, post_id, s, pinned, length, ttl):
+        with self._lock:
+            self._versions[community_id] = self._versions.get(community_id, 0) + 1
+            entry = self._get(community_id)
+            if entry is None:
+                return
+            entry.pinned.pop(post_id, None)
+            if post_id in entry.scores:
+                entry.keys.remove((entry.scores.pop(post_id), post_id))
+            if s is None:
+                return
+            if pinned:
+                entry.pinned[post_id] = s
+                return
+            bisect.insort(entry.keys, (s, post_id))
+            entry.scores[post_id] = s
+            if len(entry.keys) > length:
+                for _, dropped in entry.keys[:len(entry.keys) - length]:
+                    del entry.scores[dropped]
+                del entry.keys[:len(entry.keys) - length]
+                entry.complete = False
+
+    def forget(self, community_id):
+        with self._lock:
+            self._timelines.pop(community_id, None)
+
+
+_local = LocalTimelines()
+
+
+def _store():
+    r = getattr(current_app, 'redis', None)
+    return RedisTimelines(r) if r else _local
+
+
+def _ttl():
+    return current_app.config.get('FEED_CACHE_TTL', 300)
+
+
+def _length():
+    return current_app.config.get('FEED_TIMELINE_LENGTH', 500)
+
+
+def build(community_id):
+    """Load a community's timeline from the database into the cache."""
+    store, length = _store(), _length()
+    posts = select(Post.id, Post.created_at).where(Post.community_id == community_id, Post.is_deleted == False)
+    for _ in range(BUILD_ATTEMPTS):
+        version = store.version(community_id)
+        # a connection of its own: the snapshot must start after `version` was read, and the
+        # request's transaction may have started before
+        with db.engine.connect() as conn:
+            timeline = conn.execute(posts.where(Post.is_pinned == False)
+                                    .order_by(Post.created_at.desc(), Post.id.desc()).limit(length + 1)).all()
+            pinned = conn.execute(posts.where(Post.is_pinned == True)).all()
+        store.store(community_id, [(post_id, score(created_at or EPOCH)) for post_id, created_at in timeline[:length]],
+                    [(post_id, score(created_at or EPOCH)) for post_id, created_at in pinned],
+                    len(timeline) <= length, _ttl())
+        if store.version(community_id) == version:
+            return
+    store.forget(community_id)
+
+
+def forget(community_id):
+    """Drop a community's cached timeline (e.g. after deleting the community)."""
+    _store().forget(community_id)
+
+
+def _payloads(community_id, post_ids):
+    """{post id: payload} for `post_ids`, building and caching the missing ones."""
+    cached = cache.get_many(_payload_key(post_id) for post_id in post_ids)
+    payloads = {post_id: cached[_payload_key(post_id)] for post_id in post_ids if _payload_key(post_id) in cached}
+    missing = [post_id for post_id in post_ids if post_id not in payloads]
+    if missing:
+        posts = feed.attach_comments(feed.posts_by_id(community_id, missing), preview=feed.COMMENT_PREVIEW)
+        built = {p.id: feed.post_payload(p) for p in posts}
+        cache.set_many({_payload_key(post_id): payload for post_id, payload in built.items()}, _ttl())
+        payloads.update(built)
+    return payloads
+
+
+def _cursor(payload):
+    return encode_cursor(datetime.fromisoformat(payload['created_at']), payload['id'])
+
+
+def _cached_page(community_id, per_page, after_id):
+    store = _store()
+    result = store.page(community_id, after_id, per_page, with_pinned=after_id is None)
+    if result is None:
+        build(community_id)
+        result = store.page(community_id, after_id, per_page, with_pinned=after_id is None)
+    if result is None or not result['found']:
+        return None
+    more = len(result['ids']) > per_page
+    if not more and not result['complete']:
+        # the page runs past the cached window
+        return None
+    ids = result['ids'][:per_page]
+    payloads = _payloads(community_id, result['pinned'] + ids)
+    pinned = [payloads[post_id] for post_id in result['pinned'] if post_id in payloads]
+    items = [payloads[post_id] for post_id in ids if post_id in payloads]
+    page = KeysetPage(items, per_page,
+                      next_cursor=_cursor(items[-1]) if more and items else None,
+                      prev_cursor=_cursor(items[0]) if after_id is not None and items else None)
+    return pinned, items, page
+
+
+def posts_page(community_id, per_page=feed.PAGE_SIZE, after=None, before=None, use_cache=True):
+    """One page of the posts API: ``(pinned, posts, page)``.
+
+    `pinned` and `posts` are `feed.post_payload` dicts (pinned posts on the
+    first page only) and `page` the `KeysetPage` with the cursors. Raises
+    `InvalidCursor` for a bad cursor.
+    """
+    if use_cache and not before:
+        after_id = decode_cursor(after)[1] if after else None
+        try:
+            result = _cached_page(community_id, per_page, after_id)
+        except Exception:
+            current_app.logger.warning('Reading the timeline of community %s from the cache failed',
+                                       community_id, exc_info=True)
+            result = None
+        if result is not None:
+            return result
+    timeline = feed.timeline(community_id, per_page, after=after, before=before)
+    pinned = feed.pinned(community_id) if not (after or before) else []
+    feed.attach_comments(pinned + timeline.items, preview=feed.COMMENT_PREVIEW)
+    return [feed.post_payload(p) for p in pinned], [feed.post_payload(p) for p in timeline.items], timeline
+
+
+def _apply(changes, stale):
+    store, length, ttl = _store(), _length(), _ttl()
+    for post_id, (community_id, s, pinned) in changes.items():
+        store.place(community_id, post_id, s, pinned, length, ttl)
+    cache.delete(*(_payload_key(post_id) for post_id in set(changes) | stale))
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    changes, stale = {}, set()
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Post):
+            s = None if obj.is_deleted else score(obj.created_at or EPOCH)
+            changes[obj.id] = (obj.community_id, s, bool(obj.is_pinned))
+        elif isinstance(obj, Comment):
+            stale.add(obj.post_id)
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            changes[obj.id] = (obj.community_id, None, False)
+        elif isinstance(obj, Comment):
+            stale.add(obj.post_id)
+    if changes:
+        session.info.setdefault('timeline_changes', {}).update(changes)
+    if stale:
+        session.info.setdefault('timeline_stale_posts', set()).update(stale)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_after_commit(session):
+    changes = session.info.pop('timeline_changes', None) or {}
+    stale = session.info.pop('timeline_stale_posts', None) or set()
+    if not (changes or stale) or not has_app_context():
+        return
+    try:
+        _apply(changes, stale)
+    except Exception:
+        # the timelines catch up when they expire
+        current_app.logger.warning('Updating cached community timelines failed', exc_info=True)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('timeline_changes', None)
+    session.info.pop('timeline_stale_posts', None)
+
+
+@feed_cli.command('rebuild')
+@click.option('--community', 'community_ids', type=int, multiple=True, help='Only this community (repeatable).')
+def rebuild_command(community_ids):
+    """Reload cached timelines from the database and drop cached post payloads."""
+    community_ids = community_ids or [community_id for (community_id,) in db.session.query(Community.id)]
+    for community_id in community_ids:
+        build(community_id)
+        post_ids = [post_id for (post_id,) in db.session.query(Post.id).filter_by(community_id=community_id)]
+        cache.delete(*(_payload_key(post_id) for post_id in post_ids))
+    click.echo(f'Rebuilt {len(community_ids)} timelines')
+
+
+@feed_cli.command('benchmark')
+@click.argument('community_id', type=int)
+@click.option('--readers', type=int, default=8, help='Concurrent reader threads.')
+@click.option('--reads', type=int, default=200, help='Reads per reader.')
+@click.option('--per-page', type=int, default=feed.PAGE_SIZE)
+def benchmark_command(community_id, readers, reads, per_page):
+    """Read the first page of a community's timeline from concurrent threads, from the database and the cache."""
+    app = current_app._get_current_object()
+    build(community_id)
+    posts_page(community_id, per_page)
+    executed = []
+
+    def count(*args):
+        executed.append(1)
+
+    def reader(use_cache):
+        with app.app_context():
+            for _ in range(reads):
+                posts_page(community_id, per_page, use_cache=use_cache)
+            db.session.remove()
+
+    total = readers * reads
+    for label, use_cache in (('database', False), ('cache', True)):
+        del executed[:]
+        threads = [threading.Thread(target=reader, args=(use_cache,)) for _ in range(readers)]
+        event.listen(db.engine, 'before_cursor_execute', count)
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        event.remove(db.engine, 'before_cursor_execute', count)
+        click.echo(f'{label:9} {total / elapsed:8.0f} reads/s  {elapsed / total * 1000:7.2f} ms/read  '
+                   f'{len(executed) / total:.1f} SQL statements/read')
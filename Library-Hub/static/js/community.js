@@ -6,15 +6,45 @@
   const chatInput = document.getElementById('chatInput');
   const sendBtn = document.getElementById('sendBtn');
 
-  function appendMessage(data){
+  const historyBtn = document.getElementById('chatHistory');
+
+  function messageNode(data){
     const node = document.createElement('div');
     node.className = 'chat-msg';
     const time = new Date(data.created_at || Date.now()).toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
     node.innerHTML = `<strong>${escapeHtml(data.author)}</strong> <span class="time muted">${time}</span><div class="text">${escapeHtml(data.message)}</div>`;
-    chatWindow.appendChild(node);
+    return node;
+  }
+
+  function appendMessage(data){
+    chatWindow.appendChild(messageNode(data));
     chatWindow.scrollTop = chatWindow.scrollHeight;
   }
 
+  function loadHistory(){
+    historyBtn.disabled = true;
+    const url = `${historyBtn.dataset.url}?before=${encodeURIComponent(historyBtn.dataset.before)}`;
+    fetch(url, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+      .then(r => r.json())
+      .then(res => {
+        if(!res.success) return;
+        // keep the messages in view where they are while older ones are added above
+        const height = chatWindow.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        res.data.forEach(m => fragment.appendChild(messageNode(m)));
+        historyBtn.after(fragment);
+        chatWindow.scrollTop += chatWindow.scrollHeight - height;
+        if(res.before){
+          historyBtn.dataset.before = res.before;
+        } else {
+          historyBtn.remove();
+        }
+      })
+      .finally(() => { historyBtn.disabled = false; });
+  }
+
+  if(historyBtn) historyBtn.addEventListener('click', loadHistory);
+
   function escapeHtml(s){ return String(s).replace(/[&<>"']/g, function(c){ return {'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":"&#39;"}[c]; }); }
 
   socket.on('connect', ()=>{
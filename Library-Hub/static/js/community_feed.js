@@ -17,13 +17,111 @@ document.addEventListener('DOMContentLoaded', function () {
   });
 
   // Improve keyboard accessibility for card actions
-  document.querySelectorAll('.btn-icon').forEach(function (btn) {
-    btn.setAttribute('tabindex', '0');
-    btn.addEventListener('keydown', function (e) {
-      if (e.key === 'Enter' || e.key === ' ') {
-        e.preventDefault();
-        btn.click();
-      }
+  function enhance(root) {
+    root.querySelectorAll('.btn-icon').forEach(function (btn) {
+      btn.setAttribute('tabindex', '0');
+      btn.addEventListener('keydown', function (e) {
+        if (e.key === 'Enter' || e.key === ' ') {
+          e.preventDefault();
+          btn.click();
+        }
+      });
+    });
+  }
+  enhance(document);
+
+  // Incremental updates: after posting or commenting, and on socket events,
+  // fetch only the affected cards and patch them into the page
+  const feed = document.querySelector('.feed[data-fragment-url]');
+  if (!feed) return;
+  const cards = feed.querySelector('.cards');
+  const fragmentUrl = feed.dataset.fragmentUrl;
+
+  function fetchCards(params) {
+    return fetch(fragmentUrl + '?' + new URLSearchParams(params), { credentials: 'same-origin' })
+      .then(function (res) {
+        if (!res.ok) throw new Error('Feed request failed: ' + res.status);
+        return res.text().then(function (html) {
+          const tpl = document.createElement('template');
+          tpl.innerHTML = html;
+          return { cards: Array.from(tpl.content.querySelectorAll('article.card')), next: res.headers.get('X-Next-Cursor') };
+        });
+      });
+  }
+
+  function latestPostId() {
+    let latest = 0;
+    cards.querySelectorAll('article.card[id^="post-"]').forEach(function (el) {
+      latest = Math.max(latest, parseInt(el.id.slice(5), 10) || 0);
+    });
+    return latest;
+  }
+
+  function place(card, where) {
+    const existing = document.getElementById(card.id);
+    if (existing) existing.replaceWith(card);
+    else if (where === 'top') cards.prepend(card);
+    else if (where === 'bottom') cards.appendChild(card);
+    else return;
+    enhance(card);
+  }
+
+  function loadNew() {
+    // newest first: prepend the oldest one first
+    return fetchCards({ since: latestPostId() }).then(function (res) {
+      res.cards.reverse().forEach(function (card) { place(card, 'top'); });
+    });
+  }
+
+  function refresh(postId) {
+    if (!document.getElementById('post-' + postId)) return Promise.resolve();
+    return fetchCards({ ids: postId }).then(function (res) {
+      res.cards.forEach(function (card) { place(card, null); });
     });
+  }
+
+  document.addEventListener('submit', function (e) {
+    const form = e.target;
+    const isPost = form.classList.contains('composer-form');
+    if (!isPost && !form.classList.contains('comment-form')) return;
+    e.preventDefault();
+    fetch(form.action, { method: 'POST', body: new FormData(form), headers: { 'Accept': 'application/json' }, credentials: 'same-origin' })
+      .then(function (res) { return res.json(); })
+      .then(function (data) {
+        if (!data.success) {
+          alert(data.error || 'Could not save.');
+          return;
+        }
+        form.reset();
+        return isPost ? loadNew() : refresh(data.post_id);
+      })
+      .catch(function () { form.submit(); });
   });
+
+  feed.addEventListener('click', function (e) {
+    const more = e.target.closest('.all-comments');
+    if (more) {
+      refresh(more.dataset.postId);
+      return;
+    }
+    const link = e.target.closest('.load-more');
+    if (!link) return;
+    e.preventDefault();
+    fetchCards({ after: link.dataset.cursor }).then(function (res) {
+      res.cards.forEach(function (card) { place(card, 'bottom'); });
+      if (res.next) link.dataset.cursor = res.next;
+      else link.remove();
+    }).catch(function () { window.location = link.href; });
+  });
+
+  if (window.io && typeof COMMUNITY_ID !== 'undefined') {
+    const socket = io();
+    socket.on('connect', function () { socket.emit('join', { community_id: COMMUNITY_ID }); });
+    socket.on('post_created', function () { loadNew(); });
+    socket.on('comment_added', function (data) { refresh(data.post_id); });
+    socket.on('post_deleted', function (data) {
+      const el = document.getElementById('post-' + data.post_id);
+      if (el) el.remove();
+    });
+  }
 });
\ No newline at end of file
@@ -147,30 +147,56 @@ document.addEventListener('DOMContentLoaded', function() {
         searchInput.addEventListener('input', function() {
             clearTimeout(searchTimeout);
             
-            const query = this.value.trim();
+            const query = normalizeSuggestQuery(this.value);
             if (query.length >= 2) {
                 searchTimeout = setTimeout(function() {
                     fetchSearchSuggestions(query);
-                }, 300);
+                }, 150);
             }
         });
     }
     
+    // Same normalisation as the server, so equal prefixes share one cached response
+    function normalizeSuggestQuery(value) {
+        return value.normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase()
+            .replace(/[^\p{L}\p{N}_]+/gu, ' ').trim();
+    }
+    
+    const suggestionCache = new Map();
+    let suggestionRequest = null;
+    
     function fetchSearchSuggestions(query) {
-        fetch('/api/search?q=' + encodeURIComponent(query))
+        if (suggestionCache.has(query)) {
+            showSearchSuggestions(suggestionCache.get(query));
+            return;
+        }
+        if (suggestionRequest) {
+            suggestionRequest.abort();
+        }
+        suggestionRequest = new AbortController();
+        fetch('/api/suggest?q=' + encodeURIComponent(query), { signal: suggestionRequest.signal })
             .then(function(response) {
                 return response.json();
             })
             .then(function(data) {
-                if (data.success && data.data.length > 0) {
-                    console.log('Search suggestions:', data.data);
+                if (data.success) {
+                    suggestionCache.set(data.q, data.data);
+                    showSearchSuggestions(data.data);
                 }
             })
             .catch(function(error) {
-                console.error('Search error:', error);
+                if (error.name !== 'AbortError') {
+                    console.error('Search error:', error);
+                }
             });
     }
     
+    function showSearchSuggestions(suggestions) {
+        if (suggestions.length > 0) {
+            console.log('Search suggestions:', suggestions);
+        }
+    }
+    
     const contentCards = document.querySelectorAll('.content-card');
     contentCards.forEach(function(card) {
         card.addEventListener('click', function(e) {
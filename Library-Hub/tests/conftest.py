@@ -0,0 +1,74 @@
+import io
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# Importing `app` also builds the module-level app: keep it off the development
+# database and without a job worker.
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='library-hub-import-'), 'app.db')
+os.environ['JOBS_IN_PROCESS_WORKER'] = '0'
+
+from app import create_app  # noqa: E402
+from models import db, Content, User  # noqa: E402
+from services import blobstore  # noqa: E402
+
+ADMIN_EMAIL = 'admin@dlcf.org'
+ADMIN_PASSWORD = 'admin123'
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    base = tmp_path_factory.mktemp('library-hub')
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{base / 'test.db'}",
+        'UPLOAD_FOLDER': str(base / 'uploads'),
+        'CHAT_JOURNAL_DIR': str(base / 'chat-journal'),
+    })
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(client):
+    """A test client signed in as the default admin."""
+    client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+    return client
+
+
+@pytest.fixture
+def make_content(app):
+    """Factory storing `data` in the blob store as a public content item; returns its id."""
+    def make(data, filename='clip.mp4', content_type='video'):
+        with app.app_context():
+            admin = User.query.filter_by(email=ADMIN_EMAIL).one()
+            blob = blobstore.store_stream(io.BytesIO(data))
+            content = Content(title=f'Test {filename}', content_type=content_type,
+                              file_path=f'{admin.id}_1_{filename}', file_size=blob.size,
+                              blob_sha256=blob.sha256, uploaded_by=admin.id, is_public=True)
+            db.session.add(content)
+            db.session.commit()
+            return content.id
+    return make
+
+
+@pytest.fixture
+def count_queries(app):
+    """Calls a function and returns how many SQL statements it ran."""
+    def count(f):
+        statements = []
+        with app.app_context():
+            engine = db.engine
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            f()
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        return len(statements)
+    return count
@@ -0,0 +1,47 @@
+import itertools
+
+from models import db, Category, Content, Tag
+
+_names = itertools.count()
+
+
+def tag_contents(app, content_ids):
+    """Gives each content item its own category and two tags of its own."""
+    with app.app_context():
+        for content_id in content_ids:
+            n = next(_names)
+            content = db.session.get(Content, content_id)
+            content.category = Category(name=f'API category {n}')
+            content.tags = [Tag(name=f'api-a-{n}'), Tag(name=f'api-b-{n}')]
+        db.session.commit()
+
+
+def test_content_listing_queries_do_not_grow_with_rows(app, admin_client, make_content, count_queries):
+    url = '/api/content?per_page=100'
+    tag_contents(app, [make_content(b'api listing', f'few-{i}.pdf', 'pdf') for i in range(2)])
+    admin_client.get(url)
+    few = count_queries(lambda: admin_client.get(url))
+
+    tag_contents(app, [make_content(b'api listing', f'many-{i}.pdf', 'pdf') for i in range(10)])
+    admin_client.get(url)
+    many = count_queries(lambda: admin_client.get(url))
+    assert many == few
+
+
+def test_content_listing_without_cursor_keeps_page_fields(admin_client, make_content):
+    for i in range(3):
+        make_content(b'api pages', f'pages-{i}.pdf', 'pdf')
+    pagination = admin_client.get('/api/content?per_page=2').get_json()['pagination']
+    assert pagination['page'] == 1
+    assert pagination['total'] >= 3
+    assert pagination['pages'] == -(-pagination['total'] // 2)
+    assert pagination['has_next'] and not pagination['has_prev']
+
+    pagination = admin_client.get(f"/api/content?per_page=2&after={pagination['next_cursor']}").get_json()['pagination']
+    assert 'page' not in pagination and 'total' not in pagination
+    assert pagination['has_prev']
+
+
+def test_history_without_cursor_keeps_page_fields(admin_client):
+    pagination = admin_client.get('/api/user/history').get_json()['pagination']
+    assert {'page', 'pages', 'total'} <= pagination.keys()
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from models import db, Content
+from services import counters
+
+
+def _counts(app, content_id):
+    with app.app_context():
+        content = db.session.get(Content, content_id)
+        return content.view_count or 0, content.download_count or 0
+
+
+@pytest.fixture
+def content_id(app, make_content):
+    content_id = make_content(b'counted')
+    with app.app_context():
+        counters.flush()
+    return content_id
+
+
+def test_views_are_buffered_until_flushed(app, admin_client, content_id):
+    admin_client.get(f'/content/view/{content_id}')
+    assert _counts(app, content_id) == (0, 0)
+    assert counters.pending_count() == 1
+    with app.app_context():
+        assert counters.flush() == 1
+    assert _counts(app, content_id) == (1, 0)
+
+
+def test_concurrent_increments_are_not_lost(app, content_id):
+    threads, per_thread = 8, 250
+    stop = threading.Event()
+    errors = []
+
+    def increment():
+        with app.app_context():
+            for _ in range(per_thread):
+                counters.increment('view', content_id)
+                counters.increment('download', content_id)
+
+    def flush_repeatedly():
+        while not stop.is_set():
+            with app.app_context():
+                try:
+                    counters.flush()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+    flusher = threading.Thread(target=flush_repeatedly)
+    flusher.start()
+    workers = [threading.Thread(target=increment) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stop.set()
+    flusher.join()
+    with app.app_context():
+        counters.flush()
+    assert errors == []
+    assert _counts(app, content_id) == (threads * per_thread, threads * per_thread)
+
+
+def test_failed_flush_keeps_the_counts(app, content_id, monkeypatch):
+    with app.app_context():
+        counters.increment('view', content_id, 3)
+
+        def fail(name, counts):
+            raise RuntimeError('database unavailable')
+
+        with monkeypatch.context() as m:
+            m.setattr(counters, '_apply', fail)
+            with pytest.raises(RuntimeError):
+                counters.flush()
+        assert counters.pending_count() == 3
+        assert counters.flush() == 3
+    assert _counts(app, content_id) == (3, 0)
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+from models import db, Content
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def file_url(make_content):
+    return f'/content/file/{make_content(DATA)}'
+
+
+def test_full_response_advertises_ranges(admin_client, file_url):
+    resp = admin_client.get(file_url)
+    assert resp.status_code == 200
+    assert resp.data == DATA
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers['ETag']
+
+
+def test_single_range(admin_client, file_url):
+    resp = admin_client.get(file_url, headers={'Range': 'bytes=100-199'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert resp.content_length == 100
+    assert resp.data == DATA[100:200]
+
+
+def test_suffix_and_open_ended_ranges(admin_client, file_url):
+    resp = admin_client.get(file_url, headers={'Range': 'bytes=-10'})
+    assert resp.status_code == 206
+    assert resp.data == DATA[-10:]
+    resp = admin_client.get(file_url, headers={'Range': 'bytes=10000-'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 10000-{len(DATA) - 1}/{len(DATA)}'
+    assert resp.data == DATA[10000:]
+
+
+def test_multiple_ranges(admin_client, file_url):
+    resp = admin_client.get(file_url, headers={'Range': 'bytes=0-9,20-29'})
+    assert resp.status_code == 206
+    assert resp.mimetype == 'multipart/byteranges'
+    assert resp.content_length == len(resp.data)
+    assert f'Content-Range: bytes 0-9/{len(DATA)}'.encode() in resp.data
+    assert DATA[20:30] in resp.data
+
+
+def test_if_range_with_current_etag_gets_the_range(admin_client, file_url):
+    etag = admin_client.get(file_url).headers['ETag']
+    resp = admin_client.get(file_url, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert resp.status_code == 206
+    assert resp.data == DATA[:10]
+
+
+def test_if_range_with_stale_etag_gets_the_whole_file(admin_client, file_url):
+    resp = admin_client.get(file_url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert resp.status_code == 200
+    assert resp.data == DATA
+
+
+def test_unsatisfiable_range(admin_client, file_url):
+    resp = admin_client.get(file_url, headers={'Range': f'bytes={len(DATA)}-{len(DATA) + 100}'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == f'bytes */{len(DATA)}'
+    assert resp.data == b''
+
+
+def test_if_none_match_is_not_modified(admin_client, file_url):
+    etag = admin_client.get(file_url).headers['ETag']
+    resp = admin_client.get(file_url, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+
+
+@pytest.fixture
+def offload(app, monkeypatch):
+    def use(backend):
+        monkeypatch.setitem(app.config, 'FILE_DELIVERY_BACKEND', backend)
+    return use
+
+
+def test_x_accel_redirect_hands_the_file_to_nginx(app, admin_client, make_content, offload):
+    content_id = make_content(DATA)
+    offload('x-accel')
+    resp = admin_client.get(f'/content/file/{content_id}', headers={'Range': 'bytes=0-9'})
+    with app.app_context():
+        sha256 = db.session.get(Content, content_id).blob_sha256
+    # nginx answers the Range itself
+    assert resp.status_code == 200
+    assert resp.data == b''
+    assert resp.headers['X-Accel-Redirect'] == f'/_protected/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+    assert resp.headers['ETag']
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_x_accel_download_keeps_the_download_name(admin_client, make_content, offload):
+    content_id = make_content(DATA, filename='lecture notes.pdf', content_type='pdf')
+    offload('x-accel')
+    resp = admin_client.get(f'/content/download/{content_id}')
+    assert resp.headers['X-Accel-Redirect'].startswith('/_protected/blobs/')
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="lecture notes.pdf"'
+    assert resp.mimetype == 'application/pdf'
+
+
+def test_x_accel_serves_uploads(app, client, offload):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles', 'offload-test.png')
+    with open(path, 'wb') as f:
+        f.write(b'png')
+    offload('x-accel')
+    resp = client.get('/uploads/profiles/offload-test.png')
+    assert resp.headers['X-Accel-Redirect'] == '/_protected/profiles/offload-test.png'
+    assert resp.data == b''
+
+
+def test_x_sendfile_sends_the_absolute_path(app, admin_client, make_content, offload):
+    content_id = make_content(DATA)
+    offload('x-sendfile')
+    resp = admin_client.get(f'/content/file/{content_id}')
+    assert os.path.isabs(resp.headers['X-Sendfile'])
+    assert resp.headers['X-Sendfile'].startswith(os.path.abspath(app.config['UPLOAD_FOLDER']))
+    assert resp.data == b''
+
+
+def test_not_modified_is_answered_before_offloading(admin_client, file_url, offload):
+    etag = admin_client.get(file_url).headers['ETag']
+    offload('x-accel')
+    resp = admin_client.get(file_url, headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert 'X-Accel-Redirect' not in resp.headers
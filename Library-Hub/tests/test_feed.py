@@ -0,0 +1,86 @@
+import itertools
+
+import pytest
+
+from models import db, Comment, Community, Membership, Post, User
+from services import feed, timelines
+
+_slugs = itertools.count()
+
+
+@pytest.fixture
+def community_id(app):
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@dlcf.org').one()
+        community = Community(name='Feed test', slug=f'feed-test-{next(_slugs)}')
+        db.session.add(community)
+        db.session.flush()
+        db.session.add(Membership(user_id=admin.id, community_id=community.id, role='admin'))
+        db.session.commit()
+        return community.id
+
+
+def add_posts(app, community_id, posts, comments_per_post, pinned=False):
+    with app.app_context():
+        admin = User.query.filter_by(email='admin@dlcf.org').one()
+        for i in range(posts):
+            post = Post(community_id=community_id, author_id=admin.id, title=f'Post {i}', body='Body',
+                        is_pinned=pinned)
+            db.session.add(post)
+            db.session.flush()
+            for j in range(comments_per_post):
+                db.session.add(Comment(post_id=post.id, author_id=admin.id, body=f'Comment {j}'))
+        db.session.commit()
+
+
+def test_feed_page_queries_do_not_grow_with_posts_or_comments(app, admin_client, community_id, count_queries):
+    url = f'/community/{community_id}'
+    add_posts(app, community_id, 2, 1)
+    add_posts(app, community_id, 1, 1, pinned=True)
+    admin_client.get(url)
+    small = count_queries(lambda: admin_client.get(url))
+
+    add_posts(app, community_id, 40, 6)
+    add_posts(app, community_id, 3, 6, pinned=True)
+    admin_client.get(url)
+    large = count_queries(lambda: admin_client.get(url))
+    assert large == small
+    assert small <= 6
+
+
+def test_database_page_assembly_is_constant(app, community_id, count_queries):
+    def read_page():
+        with app.app_context():
+            pinned, posts, page = timelines.posts_page(community_id, use_cache=False)
+            return posts
+
+    add_posts(app, community_id, 3, 2)
+    small = count_queries(read_page)
+    add_posts(app, community_id, feed.PAGE_SIZE * 2, 5)
+    add_posts(app, community_id, 2, 5, pinned=True)
+    large = count_queries(read_page)
+    assert large == small
+    # the page, the pinned posts, the comment previews and the comment counts
+    assert small == 4
+
+
+def test_older_pages_fragment_is_constant(app, admin_client, community_id, count_queries):
+    add_posts(app, community_id, feed.PAGE_SIZE * 3, 4)
+    first = admin_client.get(f'/community/{community_id}/posts').get_json()
+    cursor = first['pagination']['next_cursor']
+    url = f'/community/{community_id}/posts/fragment?after={cursor}'
+    admin_client.get(url)
+    fragment = count_queries(lambda: admin_client.get(url))
+
+    add_posts(app, community_id, feed.PAGE_SIZE, 8)
+    admin_client.get(url)
+    assert count_queries(lambda: admin_client.get(url)) == fragment
+
+
+def test_feed_page_matches_the_database(app, admin_client, community_id):
+    add_posts(app, community_id, 3, feed.COMMENT_PREVIEW + 2)
+    add_posts(app, community_id, 1, 0, pinned=True)
+    html = admin_client.get(f'/community/{community_id}').get_data(as_text=True)
+    assert 'No pinned posts.' not in html
+    assert html.count('class="card" id="post-') == 3
+    assert f'View all {feed.COMMENT_PREVIEW + 2} comments' in html
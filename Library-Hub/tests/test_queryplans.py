@@ -0,0 +1,30 @@
+import pytest
+from sqlalchemy import desc
+
+from models import Content
+from services import queryplans
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return queryplans._scratch_engine()
+
+
+@pytest.mark.parametrize('name', sorted(queryplans.HOT_QUERIES))
+def test_hot_query_uses_an_index(app, engine, name):
+    with app.app_context():
+        plan = queryplans.explain(engine, queryplans.HOT_QUERIES[name]())
+    assert queryplans.full_scans(plan) == [], plan
+
+
+def test_full_scans_are_detected(app, engine):
+    # no index covers the description
+    with app.app_context():
+        plan = queryplans.explain(engine, Content.query.filter_by(description='x').order_by(desc(Content.id)))
+    assert queryplans.full_scans(plan)
+
+
+def test_check_command_passes(app):
+    result = app.test_cli_runner().invoke(args=['queryplans', 'check'])
+    assert result.exit_code == 0, result.output
+    assert f'{len(queryplans.HOT_QUERIES)} query plans OK' in result.output
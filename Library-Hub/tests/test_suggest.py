@@ -0,0 +1,29 @@
+from services import suggest
+
+ROWS = [
+    (1, 'Pilgrim’s Progress', 'John Bunyan', 'ebook', 4, ['classics']),
+    (2, 'Ἐν ἀρχῇ', 'Anon', 'pdf', 0, []),
+]
+
+
+def test_version_depends_only_on_indexed_rows():
+    built = suggest.SuggestionIndex()
+    built.replace(ROWS)
+    patched = suggest.SuggestionIndex()
+    patched.apply(ROWS[::-1])
+    patched.apply([(3, 'Extra', None, 'pdf', 0, [])])
+    patched.apply(removals=[3])
+    assert patched.version == built.version
+
+    patched.apply([ROWS[0][:4] + (5,) + ROWS[0][5:]])
+    assert patched.version != built.version
+
+
+def test_non_latin_prefix_is_revalidated(admin_client):
+    response = admin_client.get('/api/suggest?q=ἐν ἀρχ')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.isascii()
+
+    response = admin_client.get('/api/suggest?q=ἐν ἀρχ', headers={'If-None-Match': etag})
+    assert response.status_code == 304